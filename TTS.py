@@ -2,44 +2,63 @@ import json
 import base64
 import os
 import time
-import configparser
-import azure.cognitiveservices.speech as speechsdk
-from googleapiclient.errors import HttpError
-import datetime
-import zipfile
-import io
-import copy
-from urllib.request import urlopen
+import concurrent.futures
 
 import auth
-import azure_batch
-from utils import parseBool
-TTS_API, TRANSLATE_API = auth.first_authentication()
-
-# Read config files
-config = configparser.ConfigParser()
-config.read('config.ini')
-cloudConfig = configparser.ConfigParser()
-cloudConfig.read('cloud_service_settings.ini')
-
-# Get variables from config
-ttsService = cloudConfig['CLOUD']['tts_service'].lower()
-audioEncoding = config['SETTINGS']['synth_audio_encoding'].upper()
-debugMode = parseBool(config['SETTINGS']['debug_mode'])
-azureSentencePause = config['SETTINGS']['azure_sentence_pause'].lower().strip("\"").strip("\'")
-
-# Get Azure variables if applicable
-AZURE_SPEECH_KEY = cloudConfig['CLOUD']['azure_speech_key']
-AZURE_SPEECH_REGION = cloudConfig['CLOUD']['azure_speech_region']
+import azure_batch_payload
+import batch_jobs
+import batch_results
+import azure_synthesizer_pool
+import clip_cache
+import dedup
+import providers
+import rate_limiter
+
+# The Azure and Google SDKs are imported inside the functions that use them, so only the one for the configured tts_service is ever loaded
+# Settings come from the config object (see settings.py) passed into each function, and the Google API is only authenticated the first time it is used
+
+# How long to wait before trying again after going over a quota anyway. Google's quotas are per minute
+QUOTA_RETRY_SECONDS = 15
+
+# With pcm_synthesis, clips are requested as uncompressed 16 bit wav at the sample rate of the final audio, so they don't have to be decoded
+# Azure only offers these sample rates. Its names for them in the speech SDK and in batch synthesis
+AZURE_PCM_FORMATS = {
+    8000: ('Riff8Khz16BitMonoPcm', 'riff-8khz-16bit-mono-pcm'),
+    16000: ('Riff16Khz16BitMonoPcm', 'riff-16khz-16bit-mono-pcm'),
+    22050: ('Riff22050Hz16BitMonoPcm', 'riff-22050hz-16bit-mono-pcm'),
+    24000: ('Riff24Khz16BitMonoPcm', 'riff-24khz-16bit-mono-pcm'),
+    44100: ('Riff44100Hz16BitMonoPcm', 'riff-44100hz-16bit-mono-pcm'),
+    48000: ('Riff48Khz16BitMonoPcm', 'riff-48khz-16bit-mono-pcm'),
+}
+
+def get_azure_pcm_format(config):
+    if config.nativeSampleRate not in AZURE_PCM_FORMATS:
+        raise ValueError(f"Azure can't synthesize PCM audio at synth_sample_rate = {config.nativeSampleRate}. Use one of: {', '.join(str(rate) for rate in AZURE_PCM_FORMATS)}")
+    return AZURE_PCM_FORMATS[config.nativeSampleRate]
+
+def get_azure_output_format(config):
+    return get_azure_pcm_format(config)[0] if config.pcmSynthesis else 'Audio48Khz192KBitRateMonoMp3'
+
+def get_azure_batch_output_format(config):
+    return get_azure_pcm_format(config)[1] if config.pcmSynthesis else azure_batch_payload.DEFAULT_OUTPUT_FORMAT
+
+# Google returns LINEAR16 audio with a wav header
+def get_google_audio_encoding(config):
+    return 'LINEAR16' if config.pcmSynthesis else config.audioEncoding
+
+# Each language can use its own folder for synthesized clips by setting 'workingFolder' in langDict, otherwise the one from the config is used
+def get_working_folder(langDict, config):
+    return langDict.get('workingFolder', config.workingFolder)
 
 # Get List of Voices Available
 def get_voices():
-    voices = TTS_API.voices().list().execute()
+    voices = auth.get_tts_api().voices().list().execute()
     voices_json = json.dumps(voices)
     return voices_json
 
 # Build API request for google text to speech, then execute
-def synthesize_text_google(text, speedFactor, voiceName, voiceGender, languageCode, audioEncoding=audioEncoding):
+# sampleRate: Only needs to be set for uncompressed audio, otherwise Google uses the voice's own sample rate
+def synthesize_text_google(text, speedFactor, voiceName, voiceGender, languageCode, audioEncoding='MP3', sampleRate=None):
     # Keep speedFactor between 0.25 and 4.0
     if speedFactor < 0.25:
         speedFactor = 0.25
@@ -47,9 +66,17 @@ def synthesize_text_google(text, speedFactor, voiceName, voiceGender, languageCo
         speedFactor = 4.0
 
     # API Info at https://texttospeech.googleapis.com/$discovery/rest?version=v1
-    # Try, if error regarding quota, waits a minute and tries again
+    # Several threads can send requests at once, each with its own connection
+    audioConfig = {
+        "audioEncoding": audioEncoding, # MP3
+        "speakingRate": speedFactor
+    }
+    if sampleRate is not None:
+        audioConfig["sampleRateHertz"] = sampleRate
+
     def send_request(speedFactor):
-        response = TTS_API.text().synthesize(
+        audioConfig["speakingRate"] = speedFactor
+        response = auth.get_tts_api().text().synthesize(
             body={
                 'input':{
                     "text": text
@@ -59,37 +86,30 @@ def synthesize_text_google(text, speedFactor, voiceName, voiceGender, languageCo
                     "ssmlGender": voiceGender, # MALE
                     "name": voiceName # "en-US-Neural2-I"
                 },
-                'audioConfig':{
-                    "audioEncoding": audioEncoding, # MP3
-                    "speakingRate": speedFactor
-                }
+                'audioConfig': audioConfig
             }
-        ).execute()
+        ).execute(http=auth.get_thread_http())
         return response
 
+    from googleapiclient.errors import HttpError
     # Use try except to catch quota errors, there is a limit of 100 requests per minute for neural2 voices
+    # The rate limiter in synthesize_dictionary normally keeps below it. If it is hit anyway, the request is retried after a wait by providers.call_with_retries
     try:
         response = send_request(speedFactor)
     except HttpError as hx:
-        print("Error Message: " + str(hx))
         if "Resource has been exhausted" in str(hx):
-            # Wait 65 seconds, then try again
-            print("Waiting 65 seconds to try again")
-            time.sleep(65)
-            print("Trying again...")
-            response = send_request()
-        else:
-            input("Press Enter to continue...")
-    except Exception as ex:
-        print("Error Message: " + str(ex))
-        input("Press Enter to continue...")
+            print("Quota exceeded, waiting to try again")
+            raise providers.RateLimitError(str(hx), retryAfterSeconds=QUOTA_RETRY_SECONDS)
+        print("Error Message: " + str(hx))
+        raise
 
 
     # The response's audioContent is base64. Must decode to selected audio format
     decoded_audio = base64.b64decode(response['audioContent'])
     return decoded_audio
 
-def synthesize_text_azure(text, speedFactor, voiceName, languageCode):
+def synthesize_text_azure(text, speedFactor, voiceName, languageCode, config):
+    import azure.cognitiveservices.speech as speechsdk
     # Determine speedFactor value for Azure TTS. It should be either 'default' or a relative change.
     if speedFactor == 1.0:
         rate = 'default'
@@ -103,8 +123,8 @@ def synthesize_text_azure(text, speedFactor, voiceName, languageCode):
         rate = percentSign + str(round((speedFactor - 1.0) * 100, 5)) + '%'
 
     # Create string for sentence pauses, if not default
-    if not azureSentencePause == 'default' and azureSentencePause.isnumeric():
-        pauseTag = f'<mstts:silence type="Sentenceboundary-exact" value="{azureSentencePause}ms"/>'
+    if not config.azureSentencePause == 'default' and config.azureSentencePause.isnumeric():
+        pauseTag = f'<mstts:silence type="Sentenceboundary-exact" value="{config.azureSentencePause}ms"/>'
     else:
         pauseTag = ''    
 
@@ -114,15 +134,9 @@ def synthesize_text_azure(text, speedFactor, voiceName, languageCode):
         f"<voice name='{voiceName}'>{pauseTag}" \
         f"<prosody rate='{rate}'>{text}</prosody></voice></speak>"
 
-    speech_config = speechsdk.SpeechConfig(subscription=AZURE_SPEECH_KEY, region=AZURE_SPEECH_REGION)
-    # For Azure voices, see: https://learn.microsoft.com/en-us/azure/cognitive-services/speech-service/language-support?tabs=stt-tts
-    speech_config.speech_synthesis_voice_name=voiceName
-    # For audio outputs, see: https://learn.microsoft.com/en-us/python/api/azure-cognitiveservices-speech/azure.cognitiveservices.speech.speechsynthesisoutputformat?view=azure-python
-    speech_config.set_speech_synthesis_output_format(speechsdk.SpeechSynthesisOutputFormat.Audio48Khz192KBitRateMonoMp3)
-    synthesizer = speechsdk.SpeechSynthesizer(speech_config=speech_config, audio_config=None)
-
-    #result = synthesizer.speak_text_async(text).get()
-    result = synthesizer.speak_ssml_async(ssml).get()
+    # Uses one of the already connected synthesizers for this voice, instead of connecting a new one for every line. See azure_synthesizer_pool.py
+    pool = azure_synthesizer_pool.get_pool(config, voiceName, get_azure_output_format(config))
+    result = pool.speak_ssml(ssml)
     
     stream = speechsdk.AudioDataStream(result)
     return stream
@@ -141,216 +155,231 @@ def format_percentage_change(speedFactor):
         rate = percentSign + str(round((speedFactor - 1.0) * 100, 5)) + '%'
     return rate
 
-def synthesize_text_azure_batch(subsDict, langDict, skipSynthesize=False, secondPass=False):
+# Keys for the TTS clip cache. They include every setting that changes the audio, so a cached clip is only used for the exact same request
+def line_request_key(text, speedFactor, langDict, config, speechProvider):
+    return clip_cache.make_request_key({
+        'mode': 'line',
+        'service': config.ttsService,
+        'text': text,
+        'speedFactor': round(speedFactor, 4),
+        'voiceName': langDict['voiceName'],
+        'voiceGender': langDict['voiceGender'],
+        'languageCode': langDict['languageCode'],
+        'audioEncoding': get_google_audio_encoding(config),
+        'azureSentencePause': config.azureSentencePause,
+        'sampleRate': config.nativeSampleRate,
+        'extension': speechProvider.clipExtension,
+        })
+
+def batch_request_key(entry, langDict, config, batchProvider):
+    return clip_cache.make_request_key({
+        'mode': 'batch',
+        'service': config.ttsService,
+        'text': entry['translated_text'],
+        'rate': entry['speed_factor'],
+        'voiceName': langDict['voiceName'],
+        'languageCode': langDict['languageCode'],
+        'azureSentencePause': config.azureSentencePause,
+        'sampleRate': config.nativeSampleRate,
+        'extension': batchProvider.clipExtension,
+        })
+
+def synthesize_text_azure_batch(subsDict, langDict, config, skipSynthesize=False, secondPass=False):
     # Write speed factor to subsDict in correct format
+    # The first pass uses the speed predicted by speech_calibration.py if there is one, otherwise the default speed
     for key, value in subsDict.items():
         if secondPass:
-            subsDict[key]['speed_factor'] = format_percentage_change(subsDict[key]['speed_factor'])
+            subsDict[key]['synth_speed_factor'] = subsDict[key]['speed_factor']
         else:
-            #subsDict[key]['speed_factor'] = float(1.0)
-            subsDict[key]['speed_factor'] = 'default'
-
-    def create_request_payload(remainingEntriesDict):
-        # Create SSML for all subtitles
-        ssmlJson = []
-        payloadSizeInBytes = 0
-        tempDict = dict(remainingEntriesDict) # Need to do this to avoid changing the original dict which would mess with the loop
-
-        for key, value in tempDict.items():
-            rate = tempDict[key]['speed_factor']
-            text = tempDict[key]['translated_text']
-            language = langDict['languageCode']
-            voice = langDict['voiceName']
-
-            # Create strings for prosody tags. Only add them if rate is not default, because azure charges for characters of optional tags
-            if rate == 'default':
-                pOpenTag = ''
-                pCloseTag = ''
-            else:
-                pOpenTag = f"<prosody rate='{rate}'>"
-                pCloseTag = '</prosody>'
-
-            # Create string for sentence pauses, if not default
-            if not azureSentencePause == 'default' and azureSentencePause.isnumeric():
-                pauseTag = f'<mstts:silence type="Sentenceboundary-exact" value="{azureSentencePause}ms"/>'
-            else:
-                pauseTag = ''
-
-            # Create the SSML for each subtitle
-            ssml = f"<speak version='1.0' xml:lang='{language}' xmlns='http://www.w3.org/2001/10/synthesis' " \
-            "xmlns:mstts='http://www.w3.org/2001/mstts'>" \
-            f"<voice name='{voice}'>{pauseTag}" \
-            f"{pOpenTag}{text}{pCloseTag}</voice></speak>"
-            ssmlJson.append({"text": ssml})
-
-            # Construct request payload with SSML
-            # Reconstruct payload with every loop with new SSML so that the payload size is accurate
-            now = datetime.datetime.now()
-            pendingPayload = {
-                'displayName': langDict['languageCode'] + '-' + now.strftime("%Y-%m-%d %H:%M:%S"),
-                'description': 'Batch synthesis of ' + langDict['languageCode'] + ' subtitles',
-                "textType": "SSML",
-                # To use custom voice, see original example code script linked from azure_batch.py
-                "inputs": ssmlJson,
-                "properties": {
-                    "outputFormat": "audio-48khz-192kbitrate-mono-mp3",
-                    "wordBoundaryEnabled": False,
-                    "sentenceBoundaryEnabled": False,
-                    "concatenateResult": False,
-                    "decompressOutputFiles": False
-                },
-            }
-            # Azure TTS Batch requests require payload must be under 500 kilobytes, so check payload is under 500,000 bytes. Not sure if they actually mean kibibytes, assume worst case.
-            # Payload will be formatted as json so must account for that too by doing json.dumps(), otherwise calculated size will be inaccurate
-            payloadSizeInBytes = len(str(json.dumps(pendingPayload)).encode('utf-8')) 
-
-            if payloadSizeInBytes > 495000 or len(ssmlJson) > 995: # Leave some room for anything unexpected. Also number of inputs must be below 1000
-                # If payload would be too large, ignore the last entry and break out of loop
-                return payload, remainingEntriesDict
-            else:
-                payload = copy.deepcopy(pendingPayload) # Must make deepycopy otherwise ssmlJson will be updated in both instead of just pendingPayload
-                # Remove entry from remainingEntriesDict if it was added to payload
-                remainingEntriesDict.pop(key)                
-
-
-        # If all the rest of the entries fit, return the payload
-        return payload, remainingEntriesDict
-    # ------------------------- End create_request_payload() -----------------------------------
-
+            subsDict[key]['synth_speed_factor'] = value.get('predicted_speed_factor', 1.0)
+        subsDict[key]['speed_factor'] = format_percentage_change(subsDict[key]['synth_speed_factor'])
+
+    # Azure, or a fake that works the same way. See providers.py
+    batchProvider = providers.get_batch_speech_provider(config)
+
+    # Clear out the working folder for this language
+    langWorkingFolder = get_working_folder(langDict, config)
+    if not os.path.exists(langWorkingFolder):
+        os.makedirs(langWorkingFolder)
+    batch_results.close_archives(langWorkingFolder)
+    for filename in os.listdir(langWorkingFolder):
+        filePath = os.path.join(langWorkingFolder, filename)
+        if not config.debugMode and os.path.isfile(filePath):
+            os.remove(filePath)
+
+    # Clips that were already synthesized with the exact same request are copied from the cache, only the rest are sent to Azure
+    clipCache = clip_cache.get_clip_cache(config)
+    requestKeys = {key: batch_request_key(value, langDict, config, batchProvider) for key, value in subsDict.items()}
+    entriesToSynthesize = {}
+    for key, value in subsDict.items():
+        filePath = os.path.join(langWorkingFolder, f"{str(key)}.{batchProvider.clipExtension}")
+        if clipCache is not None and clipCache.fetch(requestKeys[key], filePath):
+            subsDict[key]['TTS_FilePath'] = filePath
+            subsDict[key].pop('TTS_ArchiveMember', None)
+        else:
+            entriesToSynthesize[key] = value
+    if clipCache is not None:
+        print(f"TTS clip cache: {len(subsDict) - len(entriesToSynthesize)} hits, {len(entriesToSynthesize)} misses")
 
     # Create payloads, split into multiple if necessary
-    payloadList = []
-    remainingPayloadEntriesDict = dict(subsDict) # Will remove entries as they are added to payloads
-    while len(remainingPayloadEntriesDict) > 0:
-        payloadToAppend, remainingPayloadEntriesDict = create_request_payload(remainingPayloadEntriesDict)
-        payloadList.append(payloadToAppend)
+    packedPayloads = azure_batch_payload.pack_payloads(entriesToSynthesize, langDict, config.azureSentencePause, outputFormat=get_azure_batch_output_format(config))
     
     # Tell user if request will be broken up into multiple payloads
-    if len(payloadList) > 1:
-        print(f'Payload will be broken up into {len(payloadList)} requests (due to Azure size limitations).')
-
-    # Use to keep track of filenames downloaded via separate zip files. WIll remove as they are downloaded
-    remainingDownloadedEntriesList = list(subsDict.keys())
-
-    # Clear out workingFolder
-    for filename in os.listdir('workingFolder'):
-        if not debugMode:
-            os.remove('workingFolder\\' + filename)
-
-    # Loop through payloads and submit to Azure
-    for payload in payloadList:
-        # Reset job_id from previous loops
-        job_id = None
-        
-        # Send request to Azure
-        job_id = azure_batch.submit_synthesis(payload)
-
-        # Wait for job to finish
-        if job_id is not None:
-            status = "Running"
-            resultDownloadLink = None
-            
-            while True: # Must use break to exit loop
-                # Get status
-                response = azure_batch.get_synthesis(job_id)
-                status = response.json()['status']
-                if status == 'Succeeded':
-                    print('Batch synthesis job succeeded')
-                    resultDownloadLink = azure_batch.get_synthesis(job_id).json()['outputs']['result']
-                    break
-                elif status == 'Failed':
-                    print('ERROR: Batch synthesis job failed!')
-                    print("Reason:" + response.reason)
-                    break
-                else:
-                    print(f'Batch synthesis job is still running, status [{status}]')
-                    time.sleep(5)
-            
-            # Download resultig zip file
-            if resultDownloadLink is not None:
-                # Download zip file
-                urlResponse = urlopen(resultDownloadLink)
-
-                # Process zip file    
-                virtualResultZip = io.BytesIO(urlResponse.read())
-                zipdata = zipfile.ZipFile(virtualResultZip)
-                zipinfos = zipdata.infolist()
-
-                # Reorder zipinfos so the file names are in alphanumeric order
-                zipinfos.sort(key=lambda x: x.filename)
-
-                # Only extract necessary files, and rename them while doing so
-                for file in zipinfos:
-                    if file.filename == "summary.json":
-                        #zipdata.extract(file, 'workingFolder') # For debugging
-                        pass
-                    elif "json" not in file.filename:
-                        # Rename file to match first entry in remainingDownloadedEntriesDict, then extract
-                        currentFileNum = remainingDownloadedEntriesList[0]
-                        file.filename = str(currentFileNum) + '.mp3'
-                        #file.filename = file.filename.lstrip('0')
-
-                        # Add file path to subsDict then remove from remainingDownloadedEntriesList
-                        subsDict[currentFileNum]['TTS_FilePath'] = "workingFolder\\" + str(currentFileNum) + '.mp3'
-                        # Extract file
-                        zipdata.extract(file, 'workingFolder')
-                        # Remove entry from remainingDownloadedEntriesList
-                        remainingDownloadedEntriesList.pop(0)
-                    
+    if len(packedPayloads) > 1:
+        print(f'Payload will be broken up into {len(packedPayloads)} requests (due to Azure size limitations).')
+
+    # Submit every payload at once. Jobs from other languages being synthesized at the same time share the same manager, see batch_jobs.py
+    passName = 'pass2' if secondPass else 'pass1'
+    jobs = []
+    for num, (payload, payloadKeys) in enumerate(packedPayloads, start=1):
+        resultPath = os.path.join(langWorkingFolder, f"batch_result_{passName}_{num}.zip")
+        jobs.append(batch_jobs.BatchJob(payload, payloadKeys, resultPath, f"{langDict['languageCode']} {passName} payload {num}", config))
+    batch_jobs.get_manager(config).run_jobs(jobs)
+
+    failedJobs = [job for job in jobs if not job.succeeded]
+    for job in failedJobs:
+        print(f"ERROR: Batch synthesis job failed! ({job.label}) {job.error}")
+    if failedJobs:
+        raise providers.ProviderError(f"{len(failedJobs)} of {len(jobs)} batch synthesis jobs failed for {langDict['languageCode']}")
+
+    # The clips are left in the result archives, and read from there by audio_builder. See batch_results.py
+    for job in jobs:
+        print(f"Batch synthesis job succeeded ({job.label}) in {job.finishTime - job.submitTime:.1f}s, status checked {job.pollCount} times")
+        archive = batch_results.get_archive(job.resultPath)
+        memberNames = archive.map_outputs(job.keys)
+        for key, memberName in memberNames.items():
+            subsDict[key].pop('TTS_FilePath', None)
+            subsDict[key]['TTS_ArchivePath'] = job.resultPath
+            subsDict[key]['TTS_ArchiveMember'] = memberName
+        if clipCache is not None:
+            clipCache.store_many((requestKeys[key], archive.read_member(memberName), os.path.splitext(memberName)[1]) for key, memberName in memberNames.items())
 
     return subsDict
 
 
-def synthesize_dictionary_batch(subsDict, langDict, skipSynthesize=False, secondPass=False):
+# Whether clips are synthesized with batch jobs instead of one request per line
+def use_batch_synthesis(config):
+    return config.batchSynthesize == True and config.ttsService in providers.BATCH_SPEECH_SERVICES
+
+def synthesize_dictionary_batch(subsDict, langDict, config, skipSynthesize=False, secondPass=False):
     if not skipSynthesize:
-        if ttsService == 'azure':
-            subsDict = synthesize_text_azure_batch(subsDict, langDict, skipSynthesize, secondPass)
+        if config.ttsService in providers.BATCH_SPEECH_SERVICES:
+            subsDict = synthesize_text_azure_batch(subsDict, langDict, config, skipSynthesize, secondPass)
         else:
             print('ERROR: Batch TTS only supports azure at this time')
             input('Press enter to exit...')
             exit()
     return subsDict
 
-def synthesize_dictionary(subsDict, langDict, skipSynthesize=False, secondPass=False):
-    for key, value in subsDict.items():
-        # TTS each subtitle text, write to file, write filename into dictionary
-        filePath = f"workingFolder\\{str(key)}.mp3"
-        if not skipSynthesize:
-
-            if secondPass:
-                # Get speed factor from subsDict
-                speedFactor = subsDict[key]['speed_factor']
+# onClipReady: Optional function that is called with the key of each line as soon as its audio file is ready, used for building the audio while still synthesizing
+# stopEvent: Optional threading.Event. Once it is set, clips that haven't started yet are skipped, such as when the audio being built from them failed
+# quiet: Synthesizes the clips one at a time in this thread, without printing progress. For a single line at a time, like the streaming build's second passes
+def synthesize_dictionary(subsDict, langDict, config, skipSynthesize=False, secondPass=False, onClipReady=None, stopEvent=None, quiet=False):
+    langWorkingFolder = get_working_folder(langDict, config)
+    speechProvider = providers.get_speech_provider(config)
+
+    # Prepare output location. If folder doesn't exist, create it
+    if not skipSynthesize and not os.path.exists(langWorkingFolder):
+        try:
+            os.makedirs(langWorkingFolder)
+        except OSError:
+            print("Error creating directory")
+
+    # Group lines that would give the same audio clip, so each clip is only synthesized once and shared by every line that uses it
+    # The first pass uses the speed predicted by speech_calibration.py if there is one, otherwise normal speed
+    def clip_key(key):
+        speedFactor = subsDict[key]['speed_factor'] if secondPass else subsDict[key].get('predicted_speed_factor', 1.0)
+        return (subsDict[key]['translated_text'], langDict['voiceName'], langDict['languageCode'], round(speedFactor, 4))
+    clipIndex = dedup.index_by(subsDict, clip_key)
+    if not skipSynthesize and clipIndex.total > 1:
+        clipIndex.report("Speech synthesis dedup")
+
+    # Clips are synthesized by several threads at once. The rate limiter keeps the requests right at the quota for this service and voice type
+    limiter = rate_limiter.get_tts_limiter(config, langDict['voiceName'])
+    latencyStats = rate_limiter.LatencyStats()
+
+    def send_request(text, speedFactor, filePath):
+        latencyStats.add_rate_limit_wait(limiter.acquire())
+        requestStartTime = time.perf_counter()
+        # The provider is Google, Azure or one of the fakes, depending on tts_service. See providers.py
+        speechProvider.synthesize_to_file(text, speedFactor, langDict, config, filePath)
+        latencyStats.add(time.perf_counter() - requestStartTime)
+
+    def clip_ready(keys, filePath, speedFactor):
+        for sharedKey in keys:
+            subsDict[sharedKey]['TTS_FilePath'] = filePath
+            subsDict[sharedKey]['synth_speed_factor'] = speedFactor
+            if onClipReady is not None:
+                onClipReady(sharedKey)
+
+    # The clip is saved under the number of the first line that uses it
+    # Second pass clips get their own names, so they never replace a first pass clip another line is still sharing
+    def clip_file_path(keys):
+        passSuffix = "_2" if secondPass else ""
+        return os.path.join(langWorkingFolder, f"{str(keys[0])}{passSuffix}.{speechProvider.clipExtension}")
+
+    if skipSynthesize:
+        for clipKey, keys in clipIndex.items():
+            clip_ready(keys, clip_file_path(keys), clipKey[3])
+        return subsDict
+
+    # Clips that were already synthesized with the exact same request are copied from the cache instead
+    clipCache = clip_cache.get_clip_cache(config)
+    cacheHits = []
+
+    def synthesize_clip(text, speedFactor, filePath):
+        if stopEvent is not None and stopEvent.is_set():
+            return
+        requestKey = line_request_key(text, speedFactor, langDict, config, speechProvider)
+        if clipCache is not None and clipCache.fetch(requestKey, filePath):
+            cacheHits.append(filePath)
+            return
+        providers.call_with_retries(send_request, text, speedFactor, filePath)
+        if clipCache is not None:
+            clipCache.store(requestKey, filePath)
+
+    if config.ttsService == 'google':
+        auth.ensure_authenticated() # Log in before starting the threads, in case the user has to use the browser
+
+    if quiet:
+        for clipKey, keys in clipIndex.items():
+            if stopEvent is not None and stopEvent.is_set():
+                break
+            filePath = clip_file_path(keys)
+            synthesize_clip(subsDict[keys[0]]['translated_text'], clipKey[3], filePath)
+            clip_ready(keys, filePath, clipKey[3])
+        return subsDict
+
+    maxWorkers = max(1, min(config.maxTtsRequests, len(clipIndex)))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+        futureToClip = {}
+        for clipKey, keys in clipIndex.items():
+            filePath = clip_file_path(keys)
+            future = executor.submit(synthesize_clip, subsDict[keys[0]]['translated_text'], clipKey[3], filePath)
+            futureToClip[future] = (keys, filePath, clipKey[3])
+
+        # Lines are given their files in the order the clips finish
+        for clipNum, future in enumerate(concurrent.futures.as_completed(futureToClip), start=1):
+            if stopEvent is not None and stopEvent.is_set():
+                executor.shutdown(wait=False, cancel_futures=True)
+                return subsDict
+            try:
+                future.result()
+            except Exception:
+                # The line failed even after retrying, so the track can't be finished. Don't spend requests on the clips that haven't started
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
+            keys, filePath, speedFactor = futureToClip[future]
+            clip_ready(keys, filePath, speedFactor)
+
+            # Print progress and overwrite line next time
+            if not secondPass:
+                print(f" Synthesizing TTS Line: {clipNum} of {len(clipIndex)}", end="\r")
             else:
-                speedFactor = float(1.0)
-
-            # Prepare output location. If folder doesn't exist, create it
-            if not os.path.exists(os.path.dirname(filePath)):
-                try:
-                    os.makedirs(os.path.dirname(filePath))
-                except OSError:
-                    print("Error creating directory")
-
-            # If Google TTS, use Google API
-            if ttsService == "google":
-                audio = synthesize_text_google(value['translated_text'], speedFactor, langDict['voiceName'], langDict['voiceGender'], langDict['languageCode'])
-                with open(filePath, "wb", encoding='utf-8') as out:
-                    out.write(audio)
-
-            # If Azure TTS, use Azure API
-            elif ttsService == "azure":
-                # Audio variable is an AudioDataStream object
-                audio = synthesize_text_azure(value['translated_text'], speedFactor, langDict['voiceName'], langDict['languageCode'])
-                # Save to file using save_to_wav_file method of audio object
-                audio.save_to_wav_file(filePath)
-
-        subsDict[key]['TTS_FilePath'] = filePath
-
-        # Get key index
-        keyIndex = list(subsDict.keys()).index(key)
-        # Print progress and overwrite line next time
-        if not secondPass:
-            print(f" Synthesizing TTS Line: {keyIndex+1} of {len(subsDict)}", end="\r")
-        else:
-            print(f" Synthesizing TTS Line (2nd Pass): {keyIndex+1} of {len(subsDict)}", end="\r")
+                print(f" Synthesizing TTS Line (2nd Pass): {clipNum} of {len(clipIndex)}", end="\r")
     print("                                               ") # Clear the line
+    if clipIndex.total > 1:
+        if clipCache is not None:
+            print(f"TTS clip cache: {len(cacheHits)} hits, {len(clipIndex) - len(cacheHits)} misses")
+        print(f"Speech synthesis: {latencyStats.summary()}")
     return subsDict
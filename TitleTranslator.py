@@ -3,6 +3,7 @@
 #--------------------------------------------------
 # Title and Description Translator
 # Standalone script that makes it easy to translates the title and description of a YouTube video to multiple languages
+# Can also be run at the end of the main dubbing run by setting translate_title_description in config.ini, which shares the same login
 
 
 # SET THE TITLE AND DESCRIPTION TEXT, AND VARIABLES IN THIS SECTION
@@ -29,78 +30,64 @@ originalLanguage = 'en'
 #===============================================================================================================
 
 import auth
-from utils import parseBool
-TTS_API, TRANSLATE_API = auth.first_authentication()
-
-outputFolder = "output"
+import providers
+import settings
+import translation_batching
+import translation_memory
 
+import os
+import concurrent.futures
 import langcodes
-import configparser
 import textwrap
 import re
 import html
 
-description = textwrap.dedent(description).strip("\n")
-
-# Parse the description for hyperlinks and put the tags <span class="notranslate"></span> around them
-# This prevents Google Translate from translating the links
-description = re.sub(r'(https?://[^\s]+)', r' <span class="notranslate">\1</span> ', description)
+# Importing this file doesn't read any config files or log in. Use translate_title_and_description() from other scripts, or run this file directly
 
-# Use span class="notranslate" to prevent translating certain characters
-for char in noTranslateList:
-    description = re.sub(r'(' + char + r'+)', r' <span class="notranslate">\1</span> ', description)
+#--------------------------------- Prepare Text ---------------------------------
+# Returns a list with the title as first element and the non-empty description lines as the rest, and the positions of the empty lines
+def prepare_translation_list(title, description, noTranslateList):
+    description = textwrap.dedent(description).strip("\n")
 
-# Use span class to prevent translating timestamp numbers, only matching if there is a newline or space before and after the timestamp
-description = re.sub(r'(\n|\s)(\d+:\d+)(\n|\s)', r'\1<span class="notranslate">\2</span>\3', description)
+    # Parse the description for hyperlinks and put the tags <span class="notranslate"></span> around them
+    # This prevents Google Translate from translating the links
+    description = re.sub(r'(https?://[^\s]+)', r' <span class="notranslate">\1</span> ', description)
 
+    # Use span class="notranslate" to prevent translating certain characters
+    for char in noTranslateList:
+        description = re.sub(r'(' + char + r'+)', r' <span class="notranslate">\1</span> ', description)
 
-# Split the description into a list of lines, so newlines can be preserved and re-applied after translation
-description = description.splitlines()
+    # Use span class to prevent translating timestamp numbers, only matching if there is a newline or space before and after the timestamp
+    description = re.sub(r'(\n|\s)(\d+:\d+)(\n|\s)', r'\1<span class="notranslate">\2</span>\3', description)
 
-# Create list of lines with empty lines, then remove the empty lines to prepare for translation
-emptyLineIndexes = []
-for i, text in enumerate(description):
-    if text.strip() == '':
-        emptyLineIndexes.append(i)
-for line in description:
-    if line.strip() == '':
-        description.remove(line)
 
+    # Split the description into a list of lines, so newlines can be preserved and re-applied after translation
+    description = description.splitlines()
 
-# List with title as first element and description lines as the rest
-translationList = [title] + description
+    # Create list of lines with empty lines, then remove the empty lines to prepare for translation
+    emptyLineIndexes = [i for i, text in enumerate(description) if text.strip() == '']
+    description = [line for line in description if line.strip() != '']
 
-# Get data from batch config file
-batchConfig = configparser.ConfigParser()
-batchConfig.read('batch.ini')
-languageNums = batchConfig['SETTINGS']['enabled_languages'].replace(' ','').split(',')
-cloudConfig = configparser.ConfigParser()
-cloudConfig.read('cloud_service_settings.ini')
-googleProjectID = cloudConfig['CLOUD']['google_project_id']
-
-batchSettings = {}
-for num in languageNums:
-    batchSettings[num] = {
-        'synth_language_code': batchConfig[f'LANGUAGE-{num}']['synth_language_code'],
-        'synth_voice_name': batchConfig[f'LANGUAGE-{num}']['synth_voice_name'],
-        'translation_target_language': batchConfig[f'LANGUAGE-{num}']['translation_target_language'],
-        'synth_voice_gender': batchConfig[f'LANGUAGE-{num}']['synth_voice_gender']
-    }
+    # List with title as first element and description lines as the rest
+    return [title] + description, emptyLineIndexes
 
 #--------------------------------- Translate ---------------------------------
-def translate(originalLanguage, targetLanguage, translationList):
-    response = auth.TRANSLATE_API.projects().translateText(
-        parent='projects/' + googleProjectID,
-        body={
-            'contents':translationList,
-            'sourceLanguageCode': originalLanguage,
-            'targetLanguageCode': targetLanguage,
-            'mimeType': 'text/html',
-            #'model': 'nmt',
-            #'glossaryConfig': {}
-        }
-    ).execute()
-    translatedTexts = [response['translations'][i]['translatedText'] for i in range(len(response['translations']))]
+def translate(originalLanguage, targetLanguage, translationList, config):
+    # Only lines that changed since the last run are sent to the API. The rest come from the translation memory
+    knownTranslations = {}
+    if config.useTranslationMemory:
+        memory = translation_memory.get_memory(config.cacheFolder)
+        knownTranslations = memory.lookup(translationList, originalLanguage, targetLanguage, 'text/html', config.translateService)
+    textsToSend = list(dict.fromkeys(text for text in translationList if text not in knownTranslations))
+
+    translationProvider = providers.get_translation_provider(config)
+    for request in translation_batching.pack_requests(textsToSend):
+        newTranslations = providers.call_with_retries(providers.translate_texts, translationProvider, request.texts, originalLanguage, targetLanguage, config, mimeType='text/html')
+        if config.useTranslationMemory:
+            memory.store(zip(request.texts, newTranslations), originalLanguage, targetLanguage, 'text/html', config.translateService)
+        knownTranslations.update(zip(request.texts, newTranslations))
+
+    translatedTexts = [knownTranslations[text] for text in translationList]
 
     # Remove the span tags from the translated text, and convert the html formatting for special symbols
     for i, line in enumerate(translatedTexts):
@@ -108,36 +95,66 @@ def translate(originalLanguage, targetLanguage, translationList):
         newText = html.unescape(newText)
         translatedTexts[i] = newText
 
-    return translatedTexts # Returns a list of translated texts
+    return translatedTexts, len(translationList) - len(textsToSend) # Returns a list of translated texts, and how many came from memory
 #--------------------------------------------------------------------------------
 
-
-for key, value in batchSettings.items():
-    result = translate(originalLanguage, value['translation_target_language'], translationList)
-    # Pop out the first element of the list, which is the translated title, leave the rest (Description lines)
-    batchSettings[key]['translated_title'] = result.pop(0)
-    batchSettings[key]['translated_description'] = result
+# Translates the title and description into every language enabled in batch.ini, with the languages all being sent at the same time
+# Returns the batch settings for each language, with 'translated_title' and 'translated_description' added
+def translate_all_languages(config, translationList, originalLanguage=originalLanguage):
+    # Log in before starting the threads, in case the user has to use the browser
+    if config.translateService == 'google':
+        auth.ensure_authenticated()
+
+    batchSettings = {num: dict(value) for num, value in config.batchSettings.items()}
+    maxWorkers = max(1, min(config.maxTranslationRequests, len(batchSettings)))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+        futureToKey = {executor.submit(translate, originalLanguage, value['translation_target_language'], translationList, config): key for key, value in batchSettings.items()}
+        for future in concurrent.futures.as_completed(futureToKey):
+            key = futureToKey[future]
+            result, memoryHits = future.result()
+            # Pop out the first element of the list, which is the translated title, leave the rest (Description lines)
+            batchSettings[key]['translated_title'] = result.pop(0)
+            batchSettings[key]['translated_description'] = result
+            print(f" Translated title and description: {batchSettings[key]['translation_target_language']} ({memoryHits} of {len(translationList)} lines from translation memory)")
+    return batchSettings
 
 # Write the translated text to a file
-with open(outputFolder + '/Translated Titles and Descriptions.txt', 'w', encoding='utf-8') as f:
-    for key, value in batchSettings.items():
-        title_translated = value['translated_title']
-        description_translated = value['translated_description']
-        lang = value['translation_target_language']
-        langDisplay = langcodes.get(lang).display_name()
-        
-        # Re-add the empty lines to the description
-        for i in emptyLineIndexes:
-            description_translated.insert(i, '')
-
-        # Write heading for each language
-        f.write(f'==============================================================================\n')
-        f.write(f'=================================== {langDisplay} ===================================\n')
-        f.write(f'==============================================================================\n\n')
-        f.write(f'{title_translated}\n')
-        f.write("--------------------------------------------------------------------------------\n\n\n")
-        # Write the translated description
-        for line in description_translated:
-            f.write(f'{line}\n')
-      
-        f.write("\n\n\n")
+def write_translations_file(batchSettings, emptyLineIndexes, outputFolder):
+    if not os.path.exists(outputFolder):
+        os.makedirs(outputFolder)
+    outputFilePath = os.path.join(outputFolder, 'Translated Titles and Descriptions.txt')
+    with open(outputFilePath, 'w', encoding='utf-8') as f:
+        for key, value in batchSettings.items():
+            title_translated = value['translated_title']
+            description_translated = list(value['translated_description'])
+            lang = value['translation_target_language']
+            langDisplay = langcodes.get(lang).display_name()
+            
+            # Re-add the empty lines to the description
+            for i in emptyLineIndexes:
+                description_translated.insert(i, '')
+
+            # Write heading for each language
+            f.write(f'==============================================================================\n')
+            f.write(f'=================================== {langDisplay} ===================================\n')
+            f.write(f'==============================================================================\n\n')
+            f.write(f'{title_translated}\n')
+            f.write("--------------------------------------------------------------------------------\n\n\n")
+            # Write the translated description
+            for line in description_translated:
+                f.write(f'{line}\n')
+          
+            f.write("\n\n\n")
+    return outputFilePath
+
+# Translates the title and description set at the top of this file. Called by main.py when translate_title_description is enabled
+def translate_title_and_description(config=None, title=title, description=description, noTranslateList=noTranslateList, originalLanguage=originalLanguage):
+    if config is None:
+        config = settings.get_config()
+    translationList, emptyLineIndexes = prepare_translation_list(title, description, noTranslateList)
+    batchSettings = translate_all_languages(config, translationList, originalLanguage)
+    return write_translations_file(batchSettings, emptyLineIndexes, config.outputFolder)
+
+
+if __name__ == '__main__':
+    print(f"Translated titles and descriptions saved to: {translate_title_and_description(settings.get_config())}")
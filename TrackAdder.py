@@ -41,6 +41,7 @@ import shutil
 # Note: Require ffmpepg to be installed and in the PATH environment variable
 from pydub import AudioSegment
 import langcodes
+import media_probe
 from utils import parseBool
 
 # Auto fetch tracks from tracksFolder
@@ -102,16 +103,30 @@ numTracks = len(tracksToAddDict)
 
 tempFilesToDelete = []
 
+# Number of channels of the first audio stream. The header readers can't always tell (such as for some mp4 codecs), and then give None,
+# so ffprobe is asked directly, and if even that doesn't say, the file is decoded to find out
+def get_channel_count(filePath):
+    num_channels = media_probe.get_audio_channels(filePath)
+    if num_channels is not None:
+        return num_channels
+    try:
+        for stream in media_probe.probe_with_ffprobe(filePath)['streams']:
+            if stream['type'] == 'audio' and stream['channels'] is not None:
+                return stream['channels']
+    except (OSError, sp.CalledProcessError, ValueError):
+        pass
+    return AudioSegment.from_file(filePath).channels
+
 # Check if tracks are stereo, if not it will convert them to stereo before adding
 def convert_to_stereo(tracksDict):
     # Key is the language code, value is the relative file path to audio track
     for langcode, fileName in tracksDict.items():
         filePath = os.path.join(tracksFolder, fileName)
 
-        audio = AudioSegment.from_file(filePath)
-        # Check the number of channels in the audio file
-        num_channels = audio.channels
+        # Check the number of channels in the audio file. Uses the same probe cache as main.py, so the whole file doesn't need to be decoded just to check
+        num_channels = get_channel_count(filePath)
         if num_channels == 1:
+            audio = AudioSegment.from_file(filePath)
             # Check if temp directory exists, if not create it
             if not os.path.exists(tempdir):
                 os.makedirs(tempdir)
@@ -1,49 +1,83 @@
 import soundfile
-import pyrubberband
-import configparser
 import pathlib
 import os
 import io
+import copy
+import wave
 
 import TTS
-from utils import parseBool
+import batch_results
+import mixing_canvas
+import silence_trim
+import stretch_pool
+import speech_calibration
 
 from pydub import AudioSegment
 from pydub.silence import detect_leading_silence
 import langcodes
+import numpy
 
-# MOVE THIS INTO A VARIABLE AT SOME POINT
-outputFolder = "output"
-
-# Set working folder
-workingFolder = "workingFolder"
-
-# Read config files
-config = configparser.ConfigParser()
-config.read('config.ini')
-batchConfig = configparser.ConfigParser()
-batchConfig.read('batch.ini')
-cloudConfig = configparser.ConfigParser()
-cloudConfig.read('cloud_service_settings.ini')
-
-# Get variables from configs
-nativeSampleRate = int(config['SETTINGS']['synth_sample_rate'])
-originalVideoFile = os.path.abspath(batchConfig['SETTINGS']['original_video_file_path'].strip("\""))
-skipSynthesize = parseBool(config['SETTINGS']['skip_synthesize'])
-forceTwoPassStretch = parseBool(config['SETTINGS']['force_stretch_with_twopass'])
-outputFormat = config['SETTINGS']['output_format'].lower()
-batchSynthesize = parseBool(cloudConfig['CLOUD']['batch_tts_synthesize'])
-tts_service = cloudConfig['CLOUD']['tts_service']
-debugMode = parseBool(config['SETTINGS']['debug_mode'])
-
-def trim_clip(inputSound):
-    trim_leading_silence: AudioSegment = lambda x: x[detect_leading_silence(x) :]
-    trim_trailing_silence: AudioSegment = lambda x: trim_leading_silence(x.reverse()).reverse()
-    strip_silence: AudioSegment = lambda x: trim_trailing_silence(trim_leading_silence(x))
-    strippedSound = strip_silence(inputSound)
-    return strippedSound
+# numpy types of the samples in 8, 16 and 32 bit PCM wav files. 8 bit wav samples are unsigned, but converted to signed when read, the same as pydub does
+PCM_SAMPLE_TYPES = {1: numpy.dtype('u1'), 2: numpy.dtype('<i2'), 4: numpy.dtype('<i4')}
+
+# Settings come from the config object (see settings.py) passed into build_audio
+
+# Cuts the silence off both ends of a clip. Chunks of chunkMs quieter than thresholdDb (in dBFS) count as silence, see silence_trim.py
+# 24 bit clips have no numpy type to read their samples as, so they are trimmed with pydub's detect_leading_silence() instead
+def trim_clip(inputSound, thresholdDb=silence_trim.DEFAULT_THRESHOLD_DB, chunkMs=silence_trim.DEFAULT_CHUNK_MS):
+    if inputSound.sample_width not in PCM_SAMPLE_TYPES:
+        leadingMs = detect_leading_silence(inputSound, thresholdDb, chunkMs)
+        trimmedSound = inputSound[leadingMs:]
+        trailingMs = detect_leading_silence(trimmedSound.reverse(), thresholdDb, chunkMs)
+        return trimmedSound[:len(trimmedSound) - trailingMs]
+    samples = numpy.frombuffer(inputSound.raw_data, dtype=f'<i{inputSound.sample_width}').reshape(-1, inputSound.channels)
+    start, end = silence_trim.find_speech_bounds(samples, inputSound.frame_rate, inputSound.sample_width, thresholdDb, chunkMs)
+    return samples_to_segment(samples[start:end], inputSound.frame_rate, inputSound.sample_width)
+
+# Clips from the real services are mp3 unless pcm_synthesis is on, and the fake providers make wav clips. The format is taken from the file extension
+def get_clip_format(filePath):
+    extension = os.path.splitext(filePath)[1].lower().lstrip('.')
+    return extension if extension else "mp3"
+
+# Reads an uncompressed PCM wav clip into an array of samples (one column per channel) without going through ffmpeg
+# Returns (samples, sample rate, sample width in bytes), or None if the clip isn't PCM wav, such as mp3 clips or wav files in another encoding
+def load_clip_samples(clipFile):
+    try:
+        with wave.open(clipFile, 'rb') as wavFile:
+            sampleWidth = wavFile.getsampwidth()
+            if sampleWidth not in PCM_SAMPLE_TYPES:
+                return None
+            frames = wavFile.readframes(wavFile.getnframes())
+            samples = numpy.frombuffer(frames, dtype=PCM_SAMPLE_TYPES[sampleWidth]).reshape(-1, wavFile.getnchannels())
+            if sampleWidth == 1:
+                samples = (samples ^ 0x80).view(numpy.int8)
+            return samples, wavFile.getframerate(), sampleWidth
+    except (wave.Error, EOFError):
+        return None
+
+def samples_to_segment(samples, sampleRate, sampleWidth):
+    return AudioSegment(data=samples.tobytes(), sample_width=sampleWidth, frame_rate=sampleRate, channels=samples.shape[1])
+
+# Decodes a clip from a file path or file object. PCM wav clips are read directly, anything else is decoded with ffmpeg
+def decode_clip(clipFile, clipFormat, nativeSampleRate):
+    if clipFormat == 'wav':
+        clipSamples = load_clip_samples(clipFile)
+        if clipSamples is not None:
+            return samples_to_segment(*clipSamples)
+        if hasattr(clipFile, 'seek'):
+            clipFile.seek(0)
+    return AudioSegment.from_file(clipFile, format=clipFormat, frame_rate=nativeSampleRate)
+
+# Decodes a line's synthesized clip. Batch synthesis clips are read straight out of the job's result archive in memory, see batch_results.py
+def load_clip(value, nativeSampleRate):
+    if value.get('TTS_ArchiveMember'):
+        memberName = value['TTS_ArchiveMember']
+        clipData = batch_results.get_archive(value['TTS_ArchivePath']).read_member(memberName)
+        return decode_clip(io.BytesIO(clipData), get_clip_format(memberName), nativeSampleRate)
+    return decode_clip(value['TTS_FilePath'], get_clip_format(value['TTS_FilePath']), nativeSampleRate)
 
 # Function to insert audio into canvas at specific point
+# Like create_canvas() below, only kept to compare against mixing_canvas.py
 def insert_audio(canvas, audioToOverlay, startTimeMs):
     # Create a copy of the canvas
     canvasCopy = canvas
@@ -53,10 +87,20 @@ def insert_audio(canvas, audioToOverlay, startTimeMs):
     return canvasCopy
 
 # Function to create a canvas of a specific duration in miliseconds
-def create_canvas(canvasDuration, frame_rate=nativeSampleRate):
+# Not used by build_audio anymore, which mixes into a mixing_canvas.MixingCanvas instead. Kept for comparison in benchmarks/canvas_benchmark.py
+def create_canvas(canvasDuration, frame_rate=24000):
     canvas = AudioSegment.silent(duration=canvasDuration, frame_rate=frame_rate)
     return canvas
 
+# Converts the mixed track to 16 bit audio for exporting, and reports if overlapping clips went out of range
+def finish_canvas(canvas, config):
+    clipping = 'normalize' if config.mixClipping == 'normalize' else 'clip'
+    track = canvas.to_segment(clipping)
+    if canvas.clippedSamples:
+        action = 'turned down to fit' if clipping == 'normalize' else 'clipped'
+        print(f"Overlapping clips went over the maximum volume in {canvas.clippedSamples} samples, the track was {action}")
+    return track
+
 def get_speed_factor(subsDict, trimmedAudio, desiredDuration, num):
     virtualTempFile = AudioSegment.from_file(trimmedAudio, format="wav")
     rawDuration = virtualTempFile.duration_seconds
@@ -67,30 +111,59 @@ def get_speed_factor(subsDict, trimmedAudio, desiredDuration, num):
     subsDict[num]['speed_factor'] = speedFactor
     return subsDict
 
-def stretch_audio(audioFileToStretch, speedFactor, num):
-    virtualTempAudioFile = io.BytesIO()
+def stretch_audio(audioFileToStretch, speedFactor, num, langWorkingFolder='workingFolder', debugMode=False):
     # Write the raw string to virtualtempaudiofile
     y, sampleRate = soundfile.read(audioFileToStretch)
+    streched_audio = stretch_pool.stretch_samples(y, sampleRate, speedFactor)
+    return stretched_samples_to_clip(streched_audio, sampleRate, num, langWorkingFolder, debugMode)
 
-    streched_audio = pyrubberband.time_stretch(y, sampleRate, speedFactor, rbargs={'--fine': '--fine'}) # Need to add rbarges in weird way because it demands a dictionary of two values
-    #soundfile.write(f'{workingFolder}\\temp_stretched.wav', streched_audio, sampleRate)
+def stretched_samples_to_clip(streched_audio, sampleRate, num, langWorkingFolder='workingFolder', debugMode=False):
+    virtualTempAudioFile = io.BytesIO()
     soundfile.write(virtualTempAudioFile, streched_audio, sampleRate, format='wav')
     if debugMode:
-        soundfile.write(f'{workingFolder}\\{num}_s.wav', streched_audio, sampleRate) # For debugging, saves the stretched audio files
-    #return AudioSegment.from_file(f'{workingFolder}\\temp_stretched.wav', format="wav")
-    return AudioSegment.from_file(virtualTempAudioFile, format="wav")
+        soundfile.write(os.path.join(langWorkingFolder, f'{num}_s.wav'), streched_audio, sampleRate) # For debugging, saves the stretched audio files
+    virtualTempAudioFile.seek(0)
+    return decode_clip(virtualTempAudioFile, 'wav', sampleRate)
+
+# Stretches clips on all cores at the same time with stretch_pool.py, and yields (key, clip) for each one in the same order they came in
+# clips: Iterable of (key, trimmed virtual wav file, speed factor), where the speed factor is None for clips that don't need stretching
+# A clip that can't be stretched is used as it is, instead of stopping the whole track
+def stretch_clips(clips, config, langWorkingFolder):
+    trimmedFiles = {}
+    def read_clips():
+        for key, trimmedFile, speedFactor in clips:
+            trimmedFiles[key] = trimmedFile
+            if speedFactor is None:
+                yield key, None, None, None
+                continue
+            samples, sampleRate = soundfile.read(trimmedFile)
+            trimmedFile.seek(0)
+            yield key, samples, sampleRate, speedFactor
 
+    for result in stretch_pool.get_pool(config).stretch_in_order(read_clips()):
+        trimmedFile = trimmedFiles.pop(result.key)
+        if result.samples is None or result.error is not None:
+            if result.error is not None:
+                print(f"\nCould not stretch the clip for line {result.key}, it will be used without stretching. {result.error}")
+            yield result.key, decode_clip(trimmedFile, 'wav', config.nativeSampleRate)
+        else:
+            yield result.key, stretched_samples_to_clip(result.samples, result.sampleRate, result.key, langWorkingFolder, config.debugMode)
 
-def build_audio(subsDict, langDict, totalAudioLength, twoPassVoiceSynth=False):
+
+def build_audio(subsDict, langDict, totalAudioLength, config, twoPassVoiceSynth=False):
     virtualTrimmedFileDict = {}
+    langWorkingFolder = TTS.get_working_folder(langDict, config)
+    nativeSampleRate = config.nativeSampleRate
+    debugMode = config.debugMode
+    forceTwoPassStretch = config.forceTwoPassStretch
     # First trim silence off the audio files
     for key, value in subsDict.items():
-        filePathTrimmed = workingFolder + "\\" + str(key) + "_t.wav"
+        filePathTrimmed = os.path.join(langWorkingFolder, str(key) + "_t.wav")
         subsDict[key]['TTS_FilePath_Trimmed'] = filePathTrimmed
 
         # Trim the clip and re-write file
-        rawClip = AudioSegment.from_file(value['TTS_FilePath'], format="mp3", frame_rate=nativeSampleRate)
-        trimmedClip = trim_clip(rawClip)
+        rawClip = load_clip(value, nativeSampleRate)
+        trimmedClip = trim_clip(rawClip, config.trimSilenceThresholdDb, config.trimSilenceChunkMs)
         if debugMode:
             trimmedClip.export(filePathTrimmed, format="wav")
 
@@ -110,22 +183,32 @@ def build_audio(subsDict, langDict, totalAudioLength, twoPassVoiceSynth=False):
         print(f" Calculated Speed Factor: {keyIndex+1} of {len(subsDict)}", end="\r")
     print("\n")
 
+    # Save how long each clip came out, so the speed of later lines with this voice can be predicted. See speech_calibration.py
+    speech_calibration.record_measurements(subsDict.values(), langDict, config)
+
     # If two pass voice synth is enabled, have API re-synthesize the clips at the new speed
     if twoPassVoiceSynth == True:
-        if batchSynthesize == True and tts_service == 'azure':
-            subsDict = TTS.synthesize_dictionary_batch(subsDict, langDict, skipSynthesize=skipSynthesize, secondPass=True)
-        else:
-            subsDict = TTS.synthesize_dictionary(subsDict, langDict, skipSynthesize=skipSynthesize, secondPass=True)
+        # Lines whose first pass was synthesized at a predicted speed, and came out close enough to the right length, are kept as they are
+        secondPassDict = {key: value for key, value in subsDict.items() if speech_calibration.needs_second_pass(value, config)}
+        for value in secondPassDict.values():
+            speech_calibration.set_second_pass_speed_factor(value)
+        if len(secondPassDict) < len(subsDict):
+            print(f"Second pass needed for {len(secondPassDict)} of {len(subsDict)} lines")
+
+        # The lines in secondPassDict are the same objects as in subsDict, so subsDict gets the new clips too
+        if secondPassDict and TTS.use_batch_synthesis(config):
+            TTS.synthesize_dictionary_batch(secondPassDict, langDict, config, skipSynthesize=config.skipSynthesize, secondPass=True)
+        elif secondPassDict:
+            TTS.synthesize_dictionary(secondPassDict, langDict, config, skipSynthesize=config.skipSynthesize, secondPass=True)
             
-        for key, value in subsDict.items():
+        for keyIndex, (key, value) in enumerate(secondPassDict.items()):
             # Trim the clip and re-write file
-            rawClip = AudioSegment.from_file(value['TTS_FilePath'], format="mp3", frame_rate=nativeSampleRate)
-            trimmedClip = trim_clip(rawClip)
+            rawClip = load_clip(value, nativeSampleRate)
+            trimmedClip = trim_clip(rawClip, config.trimSilenceThresholdDb, config.trimSilenceChunkMs)
             if debugMode:
                 trimmedClip.export(value['TTS_FilePath_Trimmed'], format="wav")
             trimmedClip.export(virtualTrimmedFileDict[key], format="wav")
-            keyIndex = list(subsDict.keys()).index(key)
-            print(f" Trimmed Audio (2nd Pass): {keyIndex+1} of {len(subsDict)}", end="\r")
+            print(f" Trimmed Audio (2nd Pass): {keyIndex+1} of {len(secondPassDict)}", end="\r")
         print("\n")
 
         if forceTwoPassStretch == True:
@@ -135,30 +218,29 @@ def build_audio(subsDict, langDict, totalAudioLength, twoPassVoiceSynth=False):
                 print(f" Calculated Speed Factor (2nd Pass): {keyIndex+1} of {len(subsDict)}", end="\r")
             print("\n")
 
-    # Create canvas to overlay audio onto
-    canvas = create_canvas(totalAudioLength)
+    # Create canvas to mix audio into
+    canvas = mixing_canvas.MixingCanvas(totalAudioLength, nativeSampleRate)
 
     # Stretch audio and insert into canvas
-    for key, value in subsDict.items():
-        if not twoPassVoiceSynth or forceTwoPassStretch == True:
-            #stretchedClip = stretch_audio(value['TTS_FilePath_Trimmed'], speedFactor=subsDict[key]['speed_factor'], num=key)
-            stretchedClip = stretch_audio(virtualTrimmedFileDict[key], speedFactor=subsDict[key]['speed_factor'], num=key)
-        else:
-            #stretchedClip = AudioSegment.from_file(value['TTS_FilePath_Trimmed'], format="wav")
-            stretchedClip = AudioSegment.from_file(virtualTrimmedFileDict[key], format="wav")
-            virtualTrimmedFileDict[key].seek(0) # Not 100% sure if this is necessary but it was in the other place it is used
-
-        canvas = insert_audio(canvas, stretchedClip, value['start_ms'])
-        keyIndex = list(subsDict.keys()).index(key)
+    stretchNeeded = not twoPassVoiceSynth or forceTwoPassStretch == True
+    clipsToStretch = ((key, virtualTrimmedFileDict[key], value['speed_factor'] if stretchNeeded else None) for key, value in subsDict.items())
+    for keyIndex, (key, stretchedClip) in enumerate(stretch_clips(clipsToStretch, config, langWorkingFolder)):
+        canvas.add_segment(stretchedClip, subsDict[key]['start_ms'])
         print(f" Final Audio Processed: {keyIndex+1} of {len(subsDict)}", end="\r")
     print("\n")
 
+    export_audio(finish_canvas(canvas, config), langDict, config)
+    return subsDict
+
+
+def export_audio(canvas, langDict, config):
     # Use video file name to use in the name of the output file. Add language name and language code
     lang = langcodes.get(langDict['languageCode'])
     langName = langcodes.get(langDict['languageCode']).get(lang.to_alpha3()).display_name()
-    outputFileName = pathlib.Path(originalVideoFile).stem + f" - {langName} - {langDict['languageCode']}."
+    outputFileName = pathlib.Path(config.originalVideoFile).stem + f" - {langName} - {langDict['languageCode']}."
     # Set output path
-    outputFileName = os.path.join(outputFolder, outputFileName)
+    outputFileName = os.path.join(config.outputFolder, outputFileName)
+    outputFormat = config.outputFormat
 
     # Determine string to use for output format and file extension based on config setting
     if outputFormat == "mp3":
@@ -183,4 +265,70 @@ def build_audio(subsDict, langDict, totalAudioLength, twoPassVoiceSynth=False):
         print("Try removing the .bak extension then listen to the file to see if it worked.\n")
         input("Press Enter to exit...")
 
+    return outputFileName
+
+
+# Trims one clip file and returns it as a virtual wav file. Also saves it to the given path if in debug mode
+def trim_clip_file(filePath, filePathTrimmed, nativeSampleRate=24000, debugMode=False, thresholdDb=silence_trim.DEFAULT_THRESHOLD_DB, chunkMs=silence_trim.DEFAULT_CHUNK_MS):
+    rawClip = decode_clip(filePath, get_clip_format(filePath), nativeSampleRate)
+    trimmedClip = trim_clip(rawClip, thresholdDb, chunkMs)
+    if debugMode:
+        trimmedClip.export(filePathTrimmed, format="wav")
+    tempTrimmedFile = io.BytesIO()
+    trimmedClip.export(tempTrimmedFile, format="wav")
+    tempTrimmedFile.seek(0)
+    return tempTrimmedFile
+
+
+# Streaming version of build_audio. Instead of waiting for every clip to be synthesized, each clip is trimmed, stretched and placed on the canvas
+# as soon as its key comes out of readyKeys, which is usually fed by TTS.synthesize_dictionary through its onClipReady callback while it is still running
+# Does not work with batch synthesis, because those clips all arrive at once anyway
+# synthesisErrors: Optional list the synthesis adds its error to before readyKeys ends. If it isn't empty by then, the unfinished track isn't exported
+def build_audio_streaming(subsDict, langDict, totalAudioLength, readyKeys, config, twoPassVoiceSynth=False, synthesisErrors=None):
+    langWorkingFolder = TTS.get_working_folder(langDict, config)
+    forceTwoPassStretch = config.forceTwoPassStretch
+
+    # The canvas is created first, so clips can be placed on it right away
+    canvas = mixing_canvas.MixingCanvas(totalAudioLength, config.nativeSampleRate)
+    # Copies of each line as measured after the first pass, saved all at once at the end. See speech_calibration.py
+    firstPassValues = []
+    secondPassCount = 0
+
+    # Trims each clip as soon as it is ready and does its second pass if needed, then sends it to be stretched while the next ones are synthesized
+    def prepare_clips():
+        nonlocal secondPassCount
+        for key in readyKeys:
+            value = subsDict[key]
+            filePathTrimmed = os.path.join(langWorkingFolder, str(key) + "_t.wav")
+            subsDict[key]['TTS_FilePath_Trimmed'] = filePathTrimmed
+
+            # Trim silence, then calculate how much to stretch the audio
+            trimmedFile = trim_clip_file(value['TTS_FilePath'], filePathTrimmed, config.nativeSampleRate, config.debugMode, config.trimSilenceThresholdDb, config.trimSilenceChunkMs)
+            get_speed_factor(subsDict, trimmedFile, value['duration_ms'], num=key)
+            firstPassValues.append(copy.copy(value))
+
+            # If two pass voice synth is enabled, have the API re-synthesize just this clip at the new speed, unless its predicted speed was close enough
+            if twoPassVoiceSynth == True and speech_calibration.needs_second_pass(value, config):
+                speech_calibration.set_second_pass_speed_factor(value)
+                secondPassCount += 1
+                TTS.synthesize_dictionary({key: value}, langDict, config, skipSynthesize=config.skipSynthesize, secondPass=True, quiet=True)
+                trimmedFile = trim_clip_file(value['TTS_FilePath'], filePathTrimmed, config.nativeSampleRate, config.debugMode, config.trimSilenceThresholdDb, config.trimSilenceChunkMs)
+                if forceTwoPassStretch == True:
+                    get_speed_factor(subsDict, trimmedFile, value['duration_ms'], num=key)
+
+            stretchNeeded = not twoPassVoiceSynth or forceTwoPassStretch == True
+            yield key, trimmedFile, value['speed_factor'] if stretchNeeded else None
+
+    for processedCount, (key, stretchedClip) in enumerate(stretch_clips(prepare_clips(), config, langWorkingFolder), start=1):
+        canvas.add_segment(stretchedClip, subsDict[key]['start_ms'])
+        print(f" Final Audio Processed: {processedCount} of {len(subsDict)}", end="\r")
+    print("\n")
+
+    speech_calibration.record_measurements(firstPassValues, langDict, config)
+    if twoPassVoiceSynth == True and secondPassCount < len(firstPassValues):
+        print(f"Second pass needed for {secondPassCount} of {len(firstPassValues)} lines")
+
+    if synthesisErrors:
+        return subsDict
+    export_audio(finish_canvas(canvas, config), langDict, config)
     return subsDict
@@ -1,22 +1,26 @@
 #!/usr/bin/env python3
 # -*- coding: UTF-8 -*-
 
-# Google Authentication Modules
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.oauth2.credentials import Credentials
-from google.auth.transport.requests import Request
+# Google Authentication Modules are imported inside get_authenticated_service(), so they are only loaded if a Google API is actually used
 
 # Other Modules
 import os
 import sys
 import traceback
+import threading
 from json import JSONDecodeError
 
 TOKEN_FILE_NAME = 'token.pickle'
 
 TTS_API = None
 TRANSLATE_API = None
+CREDENTIALS = None
+
+# Makes sure only one thread runs the authentication if several need the APIs at the same time
+_authLock = threading.Lock()
+
+# Holds a separate connection for each thread, see get_thread_http()
+_threadLocal = threading.local()
 
 ##########################################################################################
 ################################## AUTHORIZATION #########################################
@@ -33,6 +37,12 @@ TRANSLATE_API = None
 def get_authenticated_service():
   global TTS_API
   global TRANSLATE_API
+  global CREDENTIALS
+  from googleapiclient.discovery import build
+  from google_auth_oauthlib.flow import InstalledAppFlow
+  from google.oauth2.credentials import Credentials
+  from google.auth.transport.requests import Request
+
   CLIENT_SECRETS_FILE = 'client_secrets.json'
   API_SCOPES = ['https://www.googleapis.com/auth/cloud-platform', 'https://www.googleapis.com/auth/cloud-translation']
 
@@ -77,6 +87,8 @@ def get_authenticated_service():
     with open(TOKEN_FILE_NAME, 'w') as token:
       token.write(creds.to_json())
 
+  CREDENTIALS = creds
+
   # Build tts and translate API objects    
   TTS_API = build(TTS_API_SERVICE_NAME, TTS_API_VERSION, credentials=creds, discoveryServiceUrl=TTS_DISCOVERY_SERVICE_URL)
   TRANSLATE_API = build(TRANSLATE_API_SERVICE_NAME, TRANSLATE_API_VERSION, credentials=creds, discoveryServiceUrl=TRANSLATE_DISCOVERY_SERVICE_URL)
@@ -107,3 +119,30 @@ def first_authentication():
       input(f"\nError: Something went wrong during authentication. Try deleting the token.pickle file. \nPress Enter to Exit...")
       sys.exit()
   return TTS_API, TRANSLATE_API
+
+
+# Return the API objects, only authenticating the first time one of them is actually needed
+def ensure_authenticated():
+  if TTS_API is None or TRANSLATE_API is None:
+    with _authLock:
+      if TTS_API is None or TRANSLATE_API is None:
+        first_authentication()
+  return TTS_API, TRANSLATE_API
+
+def get_tts_api():
+  return ensure_authenticated()[0]
+
+def get_translate_api():
+  return ensure_authenticated()[1]
+
+# The API objects share a single connection, which is not thread safe
+# Threads that send requests at the same time should pass their own connection from here to execute(http=...)
+def get_thread_http():
+  ensure_authenticated()
+  http = getattr(_threadLocal, 'http', None)
+  if http is None:
+    import httplib2
+    import google_auth_httplib2
+    http = google_auth_httplib2.AuthorizedHttp(CREDENTIALS, http=httplib2.Http())
+    _threadLocal.http = http
+  return http
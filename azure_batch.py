@@ -10,21 +10,16 @@ import json
 import logging
 import sys
 
-import requests
-import configparser
+# requests is imported inside each function, so it is only loaded when batch synthesis is used
 
-logging.basicConfig(stream=sys.stdout, level=logging.ERROR,
-        format="[%(asctime)s] %(message)s", datefmt="%m/%d/%Y %I:%M:%S %p %Z")
 logger = logging.getLogger(__name__)
 
-# Your Speech resource key and region
-# This example requires environment variables named "SPEECH_KEY" and "SPEECH_REGION"
+# Call this once from the program's entry point. Not done on import, so importing this file doesn't change logging for other programs
+def setup_logging():
+    logging.basicConfig(stream=sys.stdout, level=logging.ERROR,
+            format="[%(asctime)s] %(message)s", datefmt="%m/%d/%Y %I:%M:%S %p %Z")
 
-cloudConfig = configparser.ConfigParser()
-cloudConfig.read('cloud_service_settings.ini')
-
-AZURE_SPEECH_KEY = cloudConfig['CLOUD']['azure_speech_key']
-AZURE_SPEECH_REGION = cloudConfig['CLOUD']['azure_speech_region']
+# Your Speech resource key and region are read from cloud_service_settings.ini, and passed in through the config object from settings.py
 
 NAME = "Simple synthesis"
 DESCRIPTION = "Simple synthesis description"
@@ -34,10 +29,11 @@ DESCRIPTION = "Simple synthesis description"
 SERVICE_HOST = "customvoice.api.speech.microsoft.com"
 
 
-def submit_synthesis(payload):
-    url = f'https://{AZURE_SPEECH_REGION}.{SERVICE_HOST}/api/texttospeech/3.1-preview1/batchsynthesis'
+def submit_synthesis(payload, config):
+    import requests
+    url = f'https://{config.azureSpeechRegion}.{SERVICE_HOST}/api/texttospeech/3.1-preview1/batchsynthesis'
     header = {
-        'Ocp-Apim-Subscription-Key': AZURE_SPEECH_KEY,
+        'Ocp-Apim-Subscription-Key': config.azureSpeechKey,
         'Content-Type': 'application/json'
     }
 
@@ -50,10 +46,11 @@ def submit_synthesis(payload):
         logger.error(f'Failed to submit batch synthesis job: {response.text}')
 
 
-def get_synthesis(job_id):
-    url = f'https://{AZURE_SPEECH_REGION}.{SERVICE_HOST}/api/texttospeech/3.1-preview1/batchsynthesis/{job_id}'
+def get_synthesis(job_id, config):
+    import requests
+    url = f'https://{config.azureSpeechRegion}.{SERVICE_HOST}/api/texttospeech/3.1-preview1/batchsynthesis/{job_id}'
     header = {
-        'Ocp-Apim-Subscription-Key': AZURE_SPEECH_KEY
+        'Ocp-Apim-Subscription-Key': config.azureSpeechKey
     }
     response = requests.get(url, headers=header)
     if response.status_code < 400:
@@ -65,11 +62,12 @@ def get_synthesis(job_id):
         logger.error(f'Failed to get batch synthesis job: {response.text}')
 
 
-def list_synthesis_jobs(skip: int = 0, top: int = 100):
+def list_synthesis_jobs(config, skip: int = 0, top: int = 100):
     """List all batch synthesis jobs in the subscription"""
-    url = f'https://{AZURE_SPEECH_REGION}.{SERVICE_HOST}/api/texttospeech/3.1-preview1/batchsynthesis?skip={skip}&top={top}'
+    import requests
+    url = f'https://{config.azureSpeechRegion}.{SERVICE_HOST}/api/texttospeech/3.1-preview1/batchsynthesis?skip={skip}&top={top}'
     header = {
-        'Ocp-Apim-Subscription-Key': AZURE_SPEECH_KEY
+        'Ocp-Apim-Subscription-Key': config.azureSpeechKey
     }
     response = requests.get(url, headers=header)
     if response.status_code < 400:
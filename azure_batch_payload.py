@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+# Builds the request payloads for Azure batch synthesis
+# Azure requires each payload to be under 500 kilobytes of json, with fewer than 1000 inputs. Instead of re-serializing the whole payload
+# after adding each line to measure it, the size of each line's json is added to a running total, so packing N lines takes a single pass
+
+import datetime
+import json
+
+# Leave some room for anything unexpected. Not sure if Azure actually means kibibytes, assume worst case
+MAX_PAYLOAD_BYTES = 495000
+# Number of inputs must be below 1000
+MAX_PAYLOAD_INPUTS = 995
+
+DEFAULT_OUTPUT_FORMAT = "audio-48khz-192kbitrate-mono-mp3"
+
+# Separator json.dumps() puts between the items of a list, with its default settings
+JSON_ITEM_SEPARATOR_BYTES = len(', ')
+
+
+# Creates the SSML for one subtitle line
+def make_ssml(text, rate, languageCode, voiceName, azureSentencePause):
+    # Create strings for prosody tags. Only add them if rate is not default, because azure charges for characters of optional tags
+    if rate == 'default':
+        pOpenTag = ''
+        pCloseTag = ''
+    else:
+        pOpenTag = f"<prosody rate='{rate}'>"
+        pCloseTag = '</prosody>'
+
+    # Create string for sentence pauses, if not default
+    if not azureSentencePause == 'default' and azureSentencePause.isnumeric():
+        pauseTag = f'<mstts:silence type="Sentenceboundary-exact" value="{azureSentencePause}ms"/>'
+    else:
+        pauseTag = ''
+
+    return f"<speak version='1.0' xml:lang='{languageCode}' xmlns='http://www.w3.org/2001/10/synthesis' " \
+        "xmlns:mstts='http://www.w3.org/2001/mstts'>" \
+        f"<voice name='{voiceName}'>{pauseTag}" \
+        f"{pOpenTag}{text}{pCloseTag}</voice></speak>"
+
+# Everything in the payload except the inputs
+def make_payload(languageCode, inputs, outputFormat=DEFAULT_OUTPUT_FORMAT):
+    now = datetime.datetime.now()
+    return {
+        'displayName': languageCode + '-' + now.strftime("%Y-%m-%d %H:%M:%S"),
+        'description': 'Batch synthesis of ' + languageCode + ' subtitles',
+        "textType": "SSML",
+        # To use custom voice, see original example code script linked from azure_batch.py
+        "inputs": inputs,
+        "properties": {
+            "outputFormat": outputFormat,
+            "wordBoundaryEnabled": False,
+            "sentenceBoundaryEnabled": False,
+            "concatenateResult": False,
+            "decompressOutputFiles": False
+        },
+    }
+
+# Size of the payload as it will be sent. azure_batch.submit_synthesis() uses json.dumps() with the default settings too
+def get_json_size(value):
+    return len(json.dumps(value).encode('utf-8'))
+
+
+class PayloadBuilder:
+    def __init__(self, languageCode, maxBytes=MAX_PAYLOAD_BYTES, maxInputs=MAX_PAYLOAD_INPUTS, outputFormat=DEFAULT_OUTPUT_FORMAT):
+        self.languageCode = languageCode
+        self.outputFormat = outputFormat
+        self.maxBytes = maxBytes
+        self.maxInputs = maxInputs
+        self.emptySize = get_json_size(make_payload(languageCode, [], outputFormat))
+        self.start_payload()
+
+    def start_payload(self):
+        self.inputs = []
+        self.keys = []
+        self.size = self.emptySize
+
+    # Returns True if the input was added, or False if it would go over a limit
+    def try_add(self, key, inputItem, inputSize):
+        addedSize = inputSize + (JSON_ITEM_SEPARATOR_BYTES if self.inputs else 0)
+        if self.inputs and (self.size + addedSize > self.maxBytes or len(self.inputs) >= self.maxInputs):
+            return False
+        self.inputs.append(inputItem)
+        self.keys.append(key)
+        self.size += addedSize
+        return True
+
+    def finish_payload(self):
+        return make_payload(self.languageCode, self.inputs, self.outputFormat), self.keys
+
+
+# Splits the entries of a subtitle dictionary into as few payloads as the limits allow, keeping them in order
+# Returns a list of (payload, keys), where keys are the subtitle keys of the payload's inputs, in the same order
+def pack_payloads(subsDict, langDict, azureSentencePause, maxBytes=MAX_PAYLOAD_BYTES, maxInputs=MAX_PAYLOAD_INPUTS, outputFormat=DEFAULT_OUTPUT_FORMAT):
+    builder = PayloadBuilder(langDict['languageCode'], maxBytes, maxInputs, outputFormat)
+    payloads = []
+    for key, value in subsDict.items():
+        ssml = make_ssml(value['translated_text'], value['speed_factor'], langDict['languageCode'], langDict['voiceName'], azureSentencePause)
+        inputItem = {"text": ssml}
+        inputSize = get_json_size(inputItem)
+        if not builder.try_add(key, inputItem, inputSize):
+            payloads.append(builder.finish_payload())
+            builder.start_payload()
+            builder.try_add(key, inputItem, inputSize)
+    if builder.inputs:
+        payloads.append(builder.finish_payload())
+    return payloads
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+# Reusable Azure speech synthesizers
+# Creating a SpeechSynthesizer and connecting it to Azure (TLS and WebSocket handshakes) takes much longer than synthesizing a short line
+# So instead of a new synthesizer for every line, a small pool of them is kept connected for each voice and output format
+# Each synthesizer is only used by one thread at a time, so several lines can be synthesized at once over the pooled connections
+# Synthesizers that lose their connection or fail are thrown away and replaced, and ones that were idle for a while are reconnected before use
+
+import queue
+import threading
+import time
+
+import providers
+
+# Azure closes connections that have been idle for a while, so reconnect before using a synthesizer that hasn't been used for this long
+IDLE_RECONNECT_SECONDS = 120
+
+
+class PooledSynthesizer:
+    def __init__(self, speechConfig):
+        import azure.cognitiveservices.speech as speechsdk
+        self.synthesizer = speechsdk.SpeechSynthesizer(speech_config=speechConfig, audio_config=None)
+        self.connection = speechsdk.Connection.from_speech_synthesizer(self.synthesizer)
+        self.connected = False
+        self.connection.connected.connect(self.on_connected)
+        self.connection.disconnected.connect(self.on_disconnected)
+        self.lastUsed = time.monotonic()
+
+    def on_connected(self, event):
+        self.connected = True
+
+    def on_disconnected(self, event):
+        self.connected = False
+
+    # Opens the connection ahead of time, so the first line doesn't have to wait for it
+    def connect(self):
+        self.connection.open(True)
+
+    def close(self):
+        try:
+            self.connection.close()
+        except Exception:
+            pass
+
+    # Returns True if the synthesizer can be used right away. Reconnects it first if it was disconnected or idle for too long
+    def check_health(self):
+        if self.connected and time.monotonic() - self.lastUsed <= IDLE_RECONNECT_SECONDS:
+            return True
+        try:
+            self.connect()
+        except Exception:
+            return False
+        return True
+
+
+class SynthesizerPool:
+    def __init__(self, speechConfigFactory, size):
+        self.speechConfigFactory = speechConfigFactory
+        self.size = max(1, size)
+        self.idle = queue.LifoQueue() # The most recently used synthesizer is the one most likely to still be connected
+        self.lock = threading.Lock()
+        self.created = 0
+        self.reconnects = 0
+
+    # Creates and connects every synthesizer in the pool ahead of time
+    # Their places are taken under the lock, but they connect after it is released, so other threads are never stuck behind a handshake
+    # Only a head start: if one fails to connect, the places still left are given back, and acquire() creates them when they are needed
+    def warm_up(self):
+        with self.lock:
+            newCount = self.size - self.created
+            self.created += newCount
+        for filledCount in range(newCount):
+            try:
+                self.idle.put(self.create_synthesizer())
+            except providers.ProviderError as ex:
+                # create_synthesizer() already gave back the place that failed
+                with self.lock:
+                    self.created -= newCount - filledCount - 1
+                print(f"Could not connect Azure speech synthesizers ahead of time, they will be connected when needed: {ex}")
+                return
+
+    # Creates and connects a synthesizer whose place in the pool was already taken by adding to self.created. Call without the lock held
+    # Raises providers.ProviderError if it can't connect, so the line using it is retried
+    def create_synthesizer(self):
+        try:
+            synthesizer = PooledSynthesizer(self.speechConfigFactory())
+            synthesizer.connect()
+        except Exception as ex:
+            with self.lock:
+                self.created -= 1
+            raise providers.ProviderError(f'Could not connect to Azure: {ex}') from ex
+        return synthesizer
+
+    def acquire(self):
+        while True:
+            try:
+                synthesizer = self.idle.get_nowait()
+            except queue.Empty:
+                with self.lock:
+                    canCreate = self.created < self.size
+                    if canCreate:
+                        self.created += 1
+                if canCreate:
+                    return self.create_synthesizer()
+                # Every synthesizer is in use, wait for one to be released. Checks again now and then, in case one was discarded instead
+                try:
+                    synthesizer = self.idle.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+
+            if synthesizer.check_health():
+                return synthesizer
+            self.discard(synthesizer)
+
+    def release(self, synthesizer):
+        synthesizer.lastUsed = time.monotonic()
+        self.idle.put(synthesizer)
+
+    # Throws away a broken synthesizer, so a new one is created in its place next time
+    def discard(self, synthesizer):
+        synthesizer.close()
+        with self.lock:
+            self.created -= 1
+            self.reconnects += 1
+
+    # Synthesizes the SSML on a pooled synthesizer and returns the SpeechSynthesisResult
+    # Raises providers.ProviderError if it fails, so the line is retried on a fresh connection by providers.call_with_retries
+    def speak_ssml(self, ssml):
+        import azure.cognitiveservices.speech as speechsdk
+        synthesizer = self.acquire()
+        try:
+            result = synthesizer.synthesizer.speak_ssml_async(ssml).get()
+        except Exception:
+            self.discard(synthesizer)
+            raise
+
+        if result.reason == speechsdk.ResultReason.SynthesizingAudioCompleted:
+            self.release(synthesizer)
+            return result
+
+        details = result.cancellation_details
+        errorDetails = details.error_details if details is not None else ''
+        if details is not None and details.error_code == speechsdk.CancellationErrorCode.TooManyRequests:
+            self.release(synthesizer)
+            raise providers.RateLimitError(f'Azure rate limit: {errorDetails}', retryAfterSeconds=5)
+        # Anything else could be a broken connection, so don't reuse this synthesizer
+        self.discard(synthesizer)
+        raise providers.ProviderError(f'Azure synthesis failed: {errorDetails}')
+
+
+# One pool per voice, output format and Azure resource for the whole process
+_pools = {}
+_poolsLock = threading.Lock()
+
+def get_pool(config, voiceName, outputFormatName):
+    poolKey = (config.azureSpeechKey, config.azureSpeechRegion, voiceName, outputFormatName)
+    with _poolsLock:
+        pool = _pools.get(poolKey)
+        isNewPool = pool is None
+        if isNewPool:
+            import azure.cognitiveservices.speech as speechsdk
+
+            def make_speech_config():
+                speechConfig = speechsdk.SpeechConfig(subscription=config.azureSpeechKey, region=config.azureSpeechRegion)
+                # For Azure voices, see: https://learn.microsoft.com/en-us/azure/cognitive-services/speech-service/language-support?tabs=stt-tts
+                speechConfig.speech_synthesis_voice_name = voiceName
+                # For audio outputs, see: https://learn.microsoft.com/en-us/python/api/azure-cognitiveservices-speech/azure.cognitiveservices.speech.speechsynthesisoutputformat?view=azure-python
+                speechConfig.set_speech_synthesis_output_format(getattr(speechsdk.SpeechSynthesisOutputFormat, outputFormatName))
+                return speechConfig
+
+            pool = SynthesizerPool(make_speech_config, config.azureSynthesizerPoolSize)
+            _pools[poolKey] = pool
+
+    # Connecting happens after the lock is released, so a slow connection doesn't hold up threads looking up other voices' pools
+    # Threads that get this pool while it is still warming up just wait for its synthesizers like when they are all in use
+    if isNewPool:
+        pool.warm_up()
+    return pool
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+# Runs batch synthesis jobs, such as Azure's, for any number of payloads and languages at the same time
+# Every job is submitted right away instead of waiting for the previous one to finish, and a single scheduler thread checks on all of them,
+# so a run with several payloads or languages takes about as long as its slowest job instead of the sum of them all.
+# Each job is checked less often the longer it runs, and its result zip is downloaded to disk in chunks as soon as it succeeds
+
+import concurrent.futures
+import threading
+import time
+
+import providers
+
+# How much longer to wait before checking a job again each time it is still running
+POLL_BACKOFF_FACTOR = 1.5
+
+
+class BatchJob:
+    def __init__(self, payload, keys, resultPath, label, config):
+        self.payload = payload
+        self.config = config
+        self.keys = keys # Subtitle keys of the payload's inputs, in order
+        self.resultPath = resultPath # Where the result zip is saved
+        self.label = label # Shown in messages, such as the language and payload number
+        self.jobId = None
+        self.status = 'NotSubmitted'
+        self.error = None
+        self.pollInterval = 0
+        self.nextPollTime = 0
+        self.pollCount = 0
+        self.submitTime = None
+        self.finishTime = None
+        self.done = threading.Event()
+
+    @property
+    def succeeded(self):
+        return self.done.is_set() and self.error is None
+
+
+class BatchJobManager:
+    def __init__(self, batchProvider, maxWorkers):
+        self.batchProvider = batchProvider
+        # Submitting, checking and downloading are all short blocking requests, done by these threads
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, maxWorkers), thread_name_prefix='batch-job')
+        self.condition = threading.Condition()
+        self.waitingJobs = [] # Submitted jobs that are still running
+        self.schedulerThread = None
+
+    # Submits every job at the same time. Use wait() to wait for them to finish
+    def submit_all(self, jobs):
+        for job in jobs:
+            self.executor.submit(self.submit_job, job)
+
+    # Blocks until every job has either failed or had its result downloaded
+    def wait(self, jobs):
+        for job in jobs:
+            job.done.wait()
+        return jobs
+
+    def run_jobs(self, jobs):
+        self.submit_all(jobs)
+        return self.wait(jobs)
+
+    def finish_job(self, job, error=None):
+        job.error = error
+        job.finishTime = time.monotonic()
+        job.done.set()
+
+    def submit_job(self, job):
+        try:
+            job.jobId = providers.call_with_retries(self.batchProvider.submit, job.payload, job.config)
+        except Exception as ex:
+            self.finish_job(job, f"Could not submit job: {type(ex).__name__}: {ex}")
+            return
+        if job.jobId is None:
+            self.finish_job(job, 'Could not submit job')
+            return
+        job.submitTime = time.monotonic()
+        job.status = 'NotStarted'
+        self.schedule_poll(job, self.batchProvider.pollIntervalSeconds)
+
+    def schedule_poll(self, job, interval):
+        job.pollInterval = interval
+        job.nextPollTime = time.monotonic() + interval
+        with self.condition:
+            self.waitingJobs.append(job)
+            if self.schedulerThread is None:
+                self.schedulerThread = threading.Thread(target=self.run_scheduler, name='batch-job-scheduler', daemon=True)
+                self.schedulerThread.start()
+            self.condition.notify()
+
+    # Hands each job to a worker thread when it is time to check on it again
+    def run_scheduler(self):
+        while True:
+            with self.condition:
+                now = time.monotonic()
+                dueJobs = [job for job in self.waitingJobs if job.nextPollTime <= now]
+                if not dueJobs:
+                    nextPollTime = min((job.nextPollTime for job in self.waitingJobs), default=None)
+                    self.condition.wait(None if nextPollTime is None else nextPollTime - now)
+                    continue
+                self.waitingJobs = [job for job in self.waitingJobs if job.nextPollTime > now]
+            for job in dueJobs:
+                self.executor.submit(self.poll_job, job)
+
+    def poll_job(self, job):
+        job.pollCount += 1
+        try:
+            response = providers.call_with_retries(self.batchProvider.get_status, job.jobId, job.config)
+        except Exception as ex:
+            self.finish_job(job, f"Could not get job status: {type(ex).__name__}: {ex}")
+            return
+
+        if response is None:
+            # Couldn't reach the service this time, try again later
+            status = job.status
+        else:
+            status = response['status']
+
+        if status == 'Succeeded':
+            job.status = status
+            self.download_job_result(job, response['outputs']['result'])
+        elif status == 'Failed':
+            job.status = status
+            self.finish_job(job, "Reason: " + str(response.get('properties', {}).get('error', 'Unknown')))
+        else:
+            # Back off while nothing changes, but start checking often again once the job starts running, since it could finish soon after
+            if status != job.status:
+                interval = self.batchProvider.pollIntervalSeconds
+            else:
+                interval = min(job.pollInterval * POLL_BACKOFF_FACTOR, self.batchProvider.maxPollIntervalSeconds)
+            job.status = status
+            self.schedule_poll(job, interval)
+
+    def download_job_result(self, job, url):
+        try:
+            self.batchProvider.download_result_to_file(url, job.resultPath)
+        except Exception as ex:
+            self.finish_job(job, f"Could not download result: {type(ex).__name__}: {ex}")
+            return
+        self.finish_job(job)
+
+
+# One manager per batch provider for the whole process, so jobs from every language share the same scheduler
+_managers = {}
+_managersLock = threading.Lock()
+
+def get_manager(config):
+    batchProvider = providers.get_batch_speech_provider(config)
+    with _managersLock:
+        if id(batchProvider) not in _managers:
+            _managers[id(batchProvider)] = BatchJobManager(batchProvider, config.maxTtsRequests)
+        return _managers[id(batchProvider)]
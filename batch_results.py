@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+# Reads the result archives of batch synthesis jobs, without extracting them
+# Azure names each clip in the zip after the position of its input in the payload (0001.mp3, 0002.mp3 ...) and lists them in summary.json,
+# so each clip is matched to its subtitle line by that number instead of by the order of the files in the archive.
+# The clips stay in the archive, and audio_builder reads each one straight from it into memory when it is needed
+
+import json
+import os
+import posixpath
+import threading
+import zipfile
+
+import providers
+
+SUMMARY_FILE_NAME = 'summary.json'
+
+
+class ResultArchive:
+    def __init__(self, archivePath):
+        self.archivePath = archivePath
+        self.zipFile = zipfile.ZipFile(archivePath)
+        self.memberNames = set(self.zipFile.namelist())
+        self.lock = threading.Lock()
+
+    def close(self):
+        self.zipFile.close()
+
+    def read_member(self, memberName):
+        with self.lock:
+            return self.zipFile.read(memberName)
+
+    # Returns the list of results from summary.json, or None if the archive doesn't have one
+    def read_summary(self):
+        if SUMMARY_FILE_NAME not in self.memberNames:
+            return None
+        return json.loads(self.read_member(SUMMARY_FILE_NAME)).get('results', [])
+
+    def audio_member_names(self):
+        return sorted(name for name in self.memberNames if not name.endswith('.json') and not name.endswith('/'))
+
+    # Returns a dictionary of subtitle key -> name of its clip in the archive. keys are the subtitle keys of the payload's inputs, in order
+    # Raises providers.ProviderError if any input has no clip, so a clip is never given to the wrong line
+    def map_outputs(self, keys):
+        results = self.read_summary()
+        if results is not None:
+            outputs = [(result.get('audioFileName'), result.get('status', 'Succeeded')) for result in results]
+        else:
+            outputs = [(memberName, 'Succeeded') for memberName in self.audio_member_names()]
+
+        memberNames = {}
+        for position, (memberName, status) in enumerate(outputs):
+            if status != 'Succeeded' or not memberName:
+                raise providers.ProviderError(f"Batch synthesis of input {position + 1} in {self.archivePath} did not succeed, status [{status}]")
+            if memberName not in self.memberNames:
+                raise providers.ProviderError(f"{memberName} is listed in the summary but missing from {self.archivePath}")
+            index = get_input_index(memberName, position)
+            if not 0 <= index < len(keys) or keys[index] in memberNames:
+                raise providers.ProviderError(f"Unexpected clip {memberName} in {self.archivePath}, the payload had {len(keys)} inputs")
+            memberNames[keys[index]] = memberName
+
+        if len(memberNames) != len(keys):
+            raise providers.ProviderError(f"{self.archivePath} has {len(memberNames)} clips, but the payload had {len(keys)} inputs")
+        return memberNames
+
+
+# Clip names are the 1-based input number, such as 0001.mp3. Falls back to the position in the summary for any other name
+def get_input_index(memberName, position):
+    stem = os.path.splitext(posixpath.basename(memberName))[0]
+    if stem.isdigit():
+        return int(stem) - 1
+    return position
+
+
+# Archives stay open while their language is being built, so each clip read doesn't have to parse the zip's file list again
+_openArchives = {}
+_openArchivesLock = threading.Lock()
+
+def get_archive(archivePath):
+    archivePath = os.path.abspath(archivePath)
+    with _openArchivesLock:
+        if archivePath not in _openArchives:
+            _openArchives[archivePath] = ResultArchive(archivePath)
+        return _openArchives[archivePath]
+
+# Closes every open archive in a folder, so its files can be deleted
+def close_archives(folder):
+    folder = os.path.abspath(folder)
+    with _openArchivesLock:
+        for archivePath in [path for path in _openArchives if os.path.dirname(path) == folder]:
+            _openArchives.pop(archivePath).close()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+# Azure batch payload benchmark
+# Compares azure_batch_payload.pack_payloads() with the payload builder TTS.py used before, which re-serialized the whole payload after adding
+# each line, making it take quadratic time in the number of lines. Both must split the lines into the same payloads, and every payload must
+# really be within Azure's limits when serialized.
+#
+# Usage:    python benchmarks/batch_payload_benchmark.py  [--lines 250 1000 2000 4000]  [--chars 80]  [--skip-legacy-over 4000]
+
+import argparse
+import copy
+import datetime
+import json
+import os
+import random
+import sys
+import time
+
+REPO_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_FOLDER)
+
+import azure_batch_payload
+
+LANG_DICT = {'languageCode': 'es-ES', 'voiceName': 'es-ES-ElviraNeural'}
+SENTENCE_PAUSE = '80'
+WORDS = ['hola', 'mundo', 'señal', 'canción', 'rápido', 'información', 'también', 'días', 'año', 'vídeo', 'pequeño', 'ciudad']
+
+
+# The builder from TTS.synthesize_text_azure_batch() before azure_batch_payload.py, kept as is apart from taking its settings as arguments
+def legacy_create_request_payload(remainingEntriesDict, langDict, azureSentencePause):
+    ssmlJson = []
+    payloadSizeInBytes = 0
+    payload = None
+    tempDict = dict(remainingEntriesDict)
+
+    for key, value in tempDict.items():
+        rate = tempDict[key]['speed_factor']
+        text = tempDict[key]['translated_text']
+        language = langDict['languageCode']
+        voice = langDict['voiceName']
+
+        if rate == 'default':
+            pOpenTag = ''
+            pCloseTag = ''
+        else:
+            pOpenTag = f"<prosody rate='{rate}'>"
+            pCloseTag = '</prosody>'
+
+        if not azureSentencePause == 'default' and azureSentencePause.isnumeric():
+            pauseTag = f'<mstts:silence type="Sentenceboundary-exact" value="{azureSentencePause}ms"/>'
+        else:
+            pauseTag = ''
+
+        ssml = f"<speak version='1.0' xml:lang='{language}' xmlns='http://www.w3.org/2001/10/synthesis' " \
+        "xmlns:mstts='http://www.w3.org/2001/mstts'>" \
+        f"<voice name='{voice}'>{pauseTag}" \
+        f"{pOpenTag}{text}{pCloseTag}</voice></speak>"
+        ssmlJson.append({"text": ssml})
+
+        now = datetime.datetime.now()
+        pendingPayload = {
+            'displayName': langDict['languageCode'] + '-' + now.strftime("%Y-%m-%d %H:%M:%S"),
+            'description': 'Batch synthesis of ' + langDict['languageCode'] + ' subtitles',
+            "textType": "SSML",
+            "inputs": ssmlJson,
+            "properties": {
+                "outputFormat": "audio-48khz-192kbitrate-mono-mp3",
+                "wordBoundaryEnabled": False,
+                "sentenceBoundaryEnabled": False,
+                "concatenateResult": False,
+                "decompressOutputFiles": False
+            },
+        }
+        payloadSizeInBytes = len(str(json.dumps(pendingPayload)).encode('utf-8'))
+
+        if payloadSizeInBytes > 495000 or len(ssmlJson) > 995:
+            return payload, remainingEntriesDict
+        else:
+            payload = copy.deepcopy(pendingPayload)
+            remainingEntriesDict.pop(key)
+
+    return payload, remainingEntriesDict
+
+def legacy_pack(subsDict):
+    payloadList = []
+    remaining = dict(subsDict)
+    while len(remaining) > 0:
+        payload, remaining = legacy_create_request_payload(remaining, LANG_DICT, SENTENCE_PAUSE)
+        payloadList.append(payload)
+    return payloadList
+
+
+# Lines of about the given length, with some non-ascii characters since those take 6 bytes each once serialized, and varied speeds
+def make_subs(lineCount, chars, seed=1):
+    rng = random.Random(seed)
+    subsDict = {}
+    for key in range(1, lineCount + 1):
+        words = []
+        while sum(len(word) + 1 for word in words) < chars:
+            words.append(rng.choice(WORDS))
+        rate = 'default' if rng.random() < 0.5 else f"{rng.uniform(-20, 40):+.2f}%"
+        subsDict[key] = {'translated_text': ' '.join(words), 'speed_factor': rate}
+    return subsDict
+
+def check_within_limits(payloads):
+    for payload in payloads:
+        assert len(json.dumps(payload).encode('utf-8')) <= azure_batch_payload.MAX_PAYLOAD_BYTES, 'Payload over the size limit'
+        assert len(payload['inputs']) <= azure_batch_payload.MAX_PAYLOAD_INPUTS, 'Payload over the input limit'
+
+def time_call(function, *args):
+    startTime = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - startTime
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the Azure batch payload packer with the previous builder')
+    parser.add_argument('--lines', type=int, nargs='+', default=[250, 1000, 2000, 4000], help='Numbers of subtitle lines to pack')
+    parser.add_argument('--chars', type=int, default=80, help='Approximate characters per line. Use a few thousand to hit the size limit')
+    parser.add_argument('--skip-legacy-over', type=int, default=4000, help="Don't run the previous builder for more lines than this, it gets slow")
+    args = parser.parse_args()
+
+    print(f"{'Lines':>7} {'Payloads':>9} {'Packer':>10} {'Previous':>10} {'Speedup':>8}")
+    for lineCount in args.lines:
+        subsDict = make_subs(lineCount, args.chars)
+        packed, packSeconds = time_call(azure_batch_payload.pack_payloads, subsDict, LANG_DICT, SENTENCE_PAUSE)
+        payloads = [payload for payload, keys in packed]
+        check_within_limits(payloads)
+        assert [key for payload, keys in packed for key in keys] == list(subsDict.keys()), 'Lines missing or out of order'
+
+        if lineCount > args.skip_legacy_over:
+            print(f"{lineCount:>7} {len(payloads):>9} {packSeconds * 1000:>8.1f}ms {'skipped':>10}")
+            continue
+        legacyPayloads, legacySeconds = time_call(legacy_pack, subsDict)
+        assert [payload['inputs'] for payload in payloads] == [payload['inputs'] for payload in legacyPayloads], 'Payloads differ from the previous builder'
+        print(f"{lineCount:>7} {len(payloads):>9} {packSeconds * 1000:>8.1f}ms {legacySeconds * 1000:>8.1f}ms {legacySeconds / packSeconds:>7.0f}x")
+
+if __name__ == '__main__':
+    main()
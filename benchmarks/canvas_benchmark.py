@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+# Mixing canvas benchmark
+# Compares mixing_canvas.MixingCanvas with the create_canvas() / insert_audio() path audio_builder used before, which calls pydub's overlay()
+# once per clip and so copies the whole track every time. Clips are generated noise placed back to back like subtitle lines, with a few
+# overlapping ones. Both must produce exactly the same track.
+#
+# Usage:    python benchmarks/canvas_benchmark.py  [--minutes 2 10 30 120]  [--cues-per-minute 25]  [--sample-rate 24000]  [--skip-legacy-over 30]
+
+import argparse
+import os
+import sys
+import time
+
+import numpy
+
+REPO_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_FOLDER)
+
+import audio_builder
+import mixing_canvas
+from pydub import AudioSegment
+
+
+# Returns a list of (start ms, clip). Every tenth clip starts a little before the previous one ends
+def make_clips(minutes, cuesPerMinute, sampleRate, seed=1):
+    rng = numpy.random.default_rng(seed)
+    totalMs = minutes * 60000
+    cueCount = int(minutes * cuesPerMinute)
+    slotMs = totalMs // max(cueCount, 1)
+    clips = []
+    for index in range(cueCount):
+        startMs = index * slotMs
+        if index % 10 == 9:
+            startMs -= slotMs // 4
+        durationMs = int(slotMs * rng.uniform(0.5, 0.95))
+        samples = rng.integers(-8000, 8000, size=durationMs * sampleRate // 1000, dtype=numpy.int16)
+        clip = AudioSegment(data=samples.tobytes(), sample_width=2, frame_rate=sampleRate, channels=1)
+        clips.append((startMs, clip))
+    return totalMs, clips
+
+def mix_legacy(totalMs, clips, sampleRate):
+    canvas = audio_builder.create_canvas(totalMs, sampleRate)
+    for startMs, clip in clips:
+        canvas = audio_builder.insert_audio(canvas, clip, startMs)
+    return canvas
+
+def mix_canvas(totalMs, clips, sampleRate):
+    canvas = mixing_canvas.MixingCanvas(totalMs, sampleRate)
+    for startMs, clip in clips:
+        canvas.add_segment(clip, startMs)
+    return canvas.to_segment()
+
+def time_call(function, *args):
+    startTime = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - startTime
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the numpy mixing canvas with the previous pydub overlay canvas')
+    parser.add_argument('--minutes', type=float, nargs='+', default=[2, 10, 30, 120], help='Lengths of the tracks to mix, in minutes')
+    parser.add_argument('--cues-per-minute', type=float, default=25, help='Subtitle lines per minute of track')
+    parser.add_argument('--sample-rate', type=int, default=24000, help='Sample rate of the track and clips')
+    parser.add_argument('--skip-legacy-over', type=float, default=30, help="Don't run the previous canvas for tracks longer than this many minutes, it gets slow")
+    args = parser.parse_args()
+
+    print(f"{'Minutes':>8} {'Cues':>6} {'Canvas':>10} {'Previous':>10} {'Speedup':>8}")
+    for minutes in args.minutes:
+        totalMs, clips = make_clips(minutes, args.cues_per_minute, args.sample_rate)
+        mixed, canvasSeconds = time_call(mix_canvas, totalMs, clips, args.sample_rate)
+
+        if minutes > args.skip_legacy_over:
+            print(f"{minutes:>8g} {len(clips):>6} {canvasSeconds:>9.2f}s {'skipped':>10}")
+            continue
+        legacyMixed, legacySeconds = time_call(mix_legacy, totalMs, clips, args.sample_rate)
+        assert mixed.raw_data == legacyMixed.raw_data, 'Track differs from the previous canvas'
+        print(f"{minutes:>8g} {len(clips):>6} {canvasSeconds:>9.2f}s {legacySeconds:>9.2f}s {legacySeconds / canvasSeconds:>7.0f}x")
+
+if __name__ == '__main__':
+    main()
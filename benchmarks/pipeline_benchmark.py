@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+# End to end pipeline benchmark
+# Runs main.run_job() on a generated subtitle file, using the fake providers from providers.py instead of the real cloud services.
+# Everything from translating to writing the final audio files is included. Needs no credentials, network access, ffmpeg or rubberband,
+# because the fake clips are wav files, the output is wav, and two pass synthesis is used so nothing has to be stretched.
+#
+# Usage:    python benchmarks/pipeline_benchmark.py  [--provider fake|http]  [--cues 200]  [--languages 2]  [--latency-ms 50]
+#                                                    [--error-rate 0]  [--requests-per-second 0]  [--repeat-ratio 0.2]
+#                                                    [--mode sequential|pipelined|parallel]  [--batch]  [--streaming]  [--warmup-runs 0]  [--verbose]
+#
+# With --warmup-runs, the program is first run that many times on other subtitle text with the same cache folder, which lets the speaking rate
+# calibration learn the voices (see speech_calibration.py). Only the last run is timed
+#
+# With --provider http, a local stand-in server (benchmarks/provider_server.py) is started in the background for the duration of the run
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+import wave
+
+REPO_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_FOLDER)
+
+# Languages to use, in order. Voice names don't matter to the fakes, but look like real ones
+LANGUAGES = [
+    ('es', 'es-ES', 'es-ES-Neural2-B'), ('fr', 'fr-FR', 'fr-FR-Neural2-B'), ('de', 'de-DE', 'de-DE-Neural2-B'),
+    ('it', 'it-IT', 'it-IT-Neural2-C'), ('pt', 'pt-BR', 'pt-BR-Neural2-B'), ('ja', 'ja-JP', 'ja-JP-Neural2-C'),
+    ('ko', 'ko-KR', 'ko-KR-Neural2-C'), ('nl', 'nl-NL', 'nl-NL-Wavenet-B'), ('pl', 'pl-PL', 'pl-PL-Wavenet-B'),
+    ('sv', 'sv-SE', 'sv-SE-Wavenet-C'), ('tr', 'tr-TR', 'tr-TR-Wavenet-B'), ('hi', 'hi-IN', 'hi-IN-Neural2-B'),
+]
+
+CUE_SPACING_MS = 3000
+CUE_DURATION_MS = 2500
+
+
+def ms_to_srt(totalMs):
+    hours, remainder = divmod(totalMs, 3600000)
+    minutes, remainder = divmod(remainder, 60000)
+    seconds, milliseconds = divmod(remainder, 1000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d},{milliseconds:03d}"
+
+# Every line is different, except for a fraction that repeats a few common lines like real subtitles do
+# Each take has different text, so clips from an earlier take aren't reused from the cache
+def write_subtitles(filePath, numCues, repeatRatio, take=0):
+    repeatedLines = ['Thanks for watching!', '[Music]', 'Let me know in the comments.']
+    repeatEvery = int(1 / repeatRatio) if repeatRatio > 0 else 0
+    with open(filePath, 'w', encoding='utf-8') as f:
+        for i in range(numCues):
+            startMs = i * CUE_SPACING_MS
+            if repeatEvery and i % repeatEvery == 0:
+                text = repeatedLines[(i // repeatEvery) % len(repeatedLines)]
+            else:
+                text = f"This is subtitle line number {i+1}, with some words." if take == 0 else f"Take {take} of line {i+1}, with a few {'more ' * (i % 4)}words."
+            # Gaps between lines, so the lines aren't combined
+            f.write(f"{i+1}\n{ms_to_srt(startMs)} --> {ms_to_srt(startMs + CUE_DURATION_MS)}\n{text}\n\n")
+
+# Stands in for the original video. Only its duration is used
+def write_silent_wav(filePath, durationMs, sampleRate=8000):
+    with wave.open(filePath, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(1)
+        wav.setframerate(sampleRate)
+        wav.writeframes(b'\x80' * int(sampleRate * durationMs / 1000))
+
+def make_config(args, workFolder, providerServerUrl):
+    import settings
+    languageNums = [str(num) for num in range(1, args.languages + 1)]
+    batchSettings = {}
+    for num, (targetLanguage, languageCode, voiceName) in zip(languageNums, LANGUAGES):
+        batchSettings[num] = {'synth_language_code': languageCode, 'synth_voice_name': voiceName, 'translation_target_language': targetLanguage, 'synth_voice_gender': 'MALE'}
+
+    return settings.Config(
+        originalLanguage = 'en-US',
+        outputFormat = 'wav',
+        twoPassVoiceSynth = True,
+        useTranslationMemory = args.translation_memory,
+        streamingAudioBuild = args.streaming,
+        parallelLanguages = args.mode == 'parallel',
+        pipelineLanguages = args.mode == 'pipelined',
+        ttsService = args.provider,
+        translateService = args.provider,
+        batchSynthesize = args.batch,
+        fakeLatencyMs = args.latency_ms,
+        fakeErrorRate = args.error_rate,
+        fakeRequestsPerSecond = args.requests_per_second,
+        providerServerUrl = providerServerUrl,
+        originalVideoFile = os.path.join(workFolder, 'video.wav'),
+        srtFile = os.path.join(workFolder, 'subtitles.srt'),
+        languageNums = languageNums,
+        batchSettings = batchSettings,
+        outputFolder = os.path.join(workFolder, 'output'),
+        workingFolder = os.path.join(workFolder, 'workingFolder'),
+        cacheFolder = os.path.join(workFolder, 'cache'),
+    )
+
+
+# Request counts are only known for providers in this process or the local server
+def get_behaviors(args, config, server):
+    import providers
+    if server is not None:
+        return [server.behavior]
+    if args.mode == 'parallel':
+        return []
+    return [providers.get_translation_provider(config).behavior, get_speech_provider(args, config).behavior]
+
+def get_speech_provider(args, config):
+    import providers
+    return providers.get_batch_speech_provider(config) if args.batch else providers.get_speech_provider(config)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the whole program against fake providers and time it')
+    parser.add_argument('--provider', choices=['fake', 'http'], default='fake', help='In-process fakes, or a local HTTP stand-in server')
+    parser.add_argument('--cues', type=int, default=200, help='Number of subtitle lines to generate')
+    parser.add_argument('--languages', type=int, default=2, help=f'Number of languages to process (max {len(LANGUAGES)})')
+    parser.add_argument('--latency-ms', type=int, default=50, help='Simulated latency of each request')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests that fail and are retried')
+    parser.add_argument('--requests-per-second', type=int, default=0, help='Simulated rate limit. 0 for no limit')
+    parser.add_argument('--repeat-ratio', type=float, default=0.2, help='Fraction of subtitle lines that repeat common lines')
+    parser.add_argument('--mode', choices=['sequential', 'pipelined', 'parallel'], default='sequential', help='How languages are processed')
+    parser.add_argument('--batch', action='store_true', help='Use batch synthesis instead of one request per line')
+    parser.add_argument('--streaming', action='store_true', help='Build the audio while synthesizing')
+    parser.add_argument('--translation-memory', action='store_true', help='Use the translation memory (starts empty on each run)')
+    parser.add_argument('--warmup-runs', type=int, default=0, help='Untimed runs on other subtitle text first, so the speaking rates are calibrated')
+    parser.add_argument('--verbose', action='store_true', help="Show the program's own output")
+    args = parser.parse_args()
+    args.languages = max(1, min(args.languages, len(LANGUAGES)))
+
+    import main as program
+    import providers
+
+    with tempfile.TemporaryDirectory() as workFolder:
+        write_subtitles(os.path.join(workFolder, 'subtitles.srt'), args.cues, args.repeat_ratio)
+        write_silent_wav(os.path.join(workFolder, 'video.wav'), args.cues * CUE_SPACING_MS + 1000)
+
+        server = None
+        providerServerUrl = ''
+        if args.provider == 'http':
+            from provider_server import start_server_thread
+            server = start_server_thread(0, args.latency_ms, args.error_rate, args.requests_per_second)
+            providerServerUrl = f'http://127.0.0.1:{server.server_address[1]}'
+
+        config = make_config(args, workFolder, providerServerUrl)
+        print(f"Running {args.cues} lines x {args.languages} languages  (provider: {args.provider}, mode: {args.mode}, latency: {args.latency_ms}ms, "
+              f"error rate: {args.error_rate}, rate limit: {args.requests_per_second or 'none'}{', batch' if args.batch else ''}{', streaming' if args.streaming else ''})")
+
+        output = io.StringIO()
+        for take in range(1, args.warmup_runs + 1):
+            write_subtitles(config.srtFile, args.cues, args.repeat_ratio, take)
+            with contextlib.redirect_stdout(output):
+                program.run_job(config)
+        if args.warmup_runs:
+            write_subtitles(config.srtFile, args.cues, args.repeat_ratio)
+            for behavior in get_behaviors(args, config, server):
+                behavior.requestCount = 0
+                behavior.rejectedCount = 0
+            print(f"Finished {args.warmup_runs} warm-up runs")
+
+        startTime = time.perf_counter()
+        with contextlib.redirect_stdout(sys.stdout if args.verbose else output):
+            program.run_job(config)
+        totalSeconds = time.perf_counter() - startTime
+
+        outputFiles = sorted(os.listdir(config.outputFolder))
+        audioFiles = [fileName for fileName in outputFiles if fileName.endswith('.wav')]
+        print(f"\nTotal time: {totalSeconds:.2f}s   ({totalSeconds / args.languages:.2f}s per language, {args.cues * args.languages / totalSeconds:.0f} lines/s)")
+        print(f"Output audio files: {len(audioFiles)} of {args.languages}")
+
+        # Request counts are only known for providers in this process or the local server. Parallel mode uses separate processes
+        if server is not None:
+            print(f"Requests to local server: {server.behavior.requestCount}  ({server.behavior.rejectedCount} failed or rate limited and retried)")
+            server.shutdown()
+        elif args.mode != 'parallel':
+            kinds = [('Translation', providers.get_translation_provider(config)), ('Batch synthesis' if args.batch else 'Synthesis', get_speech_provider(args, config))]
+            for name, provider in kinds:
+                print(f"{name} requests: {provider.behavior.requestCount}  ({provider.behavior.rejectedCount} failed or rate limited and retried)")
+
+        if len(audioFiles) != args.languages:
+            if not args.verbose:
+                print(output.getvalue()[-3000:])
+            print("\nFAILED: Not every language produced an audio file")
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
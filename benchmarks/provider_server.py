@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+# Local stand-in server for the translation and TTS services
+# Answers the same requests as the 'http' providers in providers.py send, with the deterministic fake translations and generated audio clips.
+# Nothing leaves the computer, so the whole program can be run and timed without credentials or network access.
+#
+# Usage:    python benchmarks/provider_server.py  [--port 8765]  [--latency-ms 0]  [--error-rate 0]  [--requests-per-second 0]
+# Then set tts_service and/or translate_service to http in cloud_service_settings.ini
+#
+# Endpoints:
+#   POST /translate                  {contents, sourceLanguageCode, targetLanguageCode, mimeType}  ->  {translations: [{translatedText}]}
+#   POST /synthesize                 {text, speakingRate, voiceName, languageCode, sampleRate}      ->  {audioContent: base64 wav}
+#   POST /batchsynthesis             Azure style batch synthesis payload                            ->  {id}
+#   GET  /batchsynthesis/<id>        ->  {id, status, outputs: {result: url}}
+#   GET  /results/<id>.zip           ->  zip file of the clips, like Azure's
+
+import argparse
+import base64
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+REPO_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_FOLDER)
+import providers
+
+
+class ProviderRequestHandler(BaseHTTPRequestHandler):
+    # Set on the server object by make_server()
+    #   server.behavior: providers.FakeServiceBehavior
+    #   server.jobs: Batch job ID -> job dictionary
+
+    def log_message(self, format, *args):
+        pass # Don't print every request
+
+    def send_json(self, data, status=200):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_bytes(self, data, contentType):
+        self.send_response(200)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length)) if length else {}
+
+    # Applies the simulated latency, errors and rate limit. Returns False if an error response was already sent
+    def begin_simulated_request(self):
+        try:
+            self.server.behavior.begin_request()
+        except providers.RateLimitError as rx:
+            self.send_response(429)
+            self.send_header('Retry-After', f'{rx.retryAfterSeconds:.3f}')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return False
+        except providers.ProviderError:
+            self.send_json({'error': 'Simulated server error'}, status=500)
+            return False
+        return True
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        data = self.read_json()
+        if url.path == '/translate':
+            if self.begin_simulated_request():
+                translations = [{'translatedText': providers.fake_translate_text(text, data['targetLanguageCode'])} for text in data['contents']]
+                self.send_json({'translations': translations})
+
+        elif url.path == '/synthesize':
+            if self.begin_simulated_request():
+                audio = providers.make_fake_clip(data['text'], float(data.get('speakingRate', 1.0)), int(data.get('sampleRate', 24000)))
+                self.send_json({'audioContent': base64.b64encode(audio).decode('ascii')})
+
+        elif url.path == '/batchsynthesis':
+            if not self.begin_simulated_request():
+                return
+            sampleRate = int(parse_qs(url.query).get('sampleRate', ['24000'])[0])
+            with self.server.jobsLock:
+                jobId = f'job-{len(self.server.jobs) + 1}'
+                # Like Azure, the job takes a while to finish instead of the submit request
+                self.server.jobs[jobId] = {'payload': data, 'sampleRate': sampleRate, 'readyTime': time.monotonic() + self.server.behavior.latencyMs / 1000}
+            self.send_json({'id': jobId, 'status': 'NotStarted'}, status=201)
+
+        else:
+            self.send_json({'error': 'Not found'}, status=404)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path.startswith('/batchsynthesis/'):
+            jobId = url.path[len('/batchsynthesis/'):]
+            job = self.server.jobs.get(jobId)
+            if job is None:
+                self.send_json({'error': 'Not found'}, status=404)
+            elif time.monotonic() < job['readyTime']:
+                self.send_json({'id': jobId, 'status': 'Running'})
+            else:
+                host, port = self.server.server_address[:2]
+                self.send_json({'id': jobId, 'status': 'Succeeded', 'outputs': {'result': f'http://{host}:{port}/results/{jobId}.zip'}})
+
+        elif url.path.startswith('/results/') and url.path.endswith('.zip'):
+            job = self.server.jobs.get(url.path[len('/results/'):-len('.zip')])
+            if job is None:
+                self.send_json({'error': 'Not found'}, status=404)
+            else:
+                self.send_bytes(providers.make_fake_batch_result(job['payload'], job['sampleRate']), 'application/zip')
+
+        else:
+            self.send_json({'error': 'Not found'}, status=404)
+
+
+def make_server(port=8765, latencyMs=0, errorRate=0.0, requestsPerSecond=0, host='127.0.0.1'):
+    server = ThreadingHTTPServer((host, port), ProviderRequestHandler)
+    server.daemon_threads = True
+    server.behavior = providers.FakeServiceBehavior(latencyMs, errorRate, requestsPerSecond)
+    server.jobs = {}
+    server.jobsLock = threading.Lock()
+    return server
+
+# Starts the server in a background thread and returns it. Use port 0 to pick any free port, then read it from server.server_address
+def start_server_thread(port=0, latencyMs=0, errorRate=0.0, requestsPerSecond=0):
+    server = make_server(port, latencyMs, errorRate, requestsPerSecond)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in server for the translation and TTS services')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency-ms', type=int, default=0, help='How long each request takes')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests that fail with a server error')
+    parser.add_argument('--requests-per-second', type=int, default=0, help='Requests per second before returning 429 errors. 0 for no limit')
+    args = parser.parse_args()
+
+    server = make_server(args.port, args.latency_ms, args.error_rate, args.requests_per_second)
+    print(f"Listening on http://127.0.0.1:{args.port}  (Ctrl+C to stop)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(f"\n{server.behavior.requestCount} requests, {server.behavior.rejectedCount} rejected")
+
+if __name__ == '__main__':
+    main()
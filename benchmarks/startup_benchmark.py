@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+# Startup benchmark
+# Measures how long it takes to import the program's modules in a fresh Python process (cold import), and how long until it is ready to do
+# real work (config loaded and subtitles parsed). Also checks that no cloud provider SDK is loaded just by importing the program.
+# Nothing here needs API credentials or network access.
+#
+# Usage:    python benchmarks/startup_benchmark.py  [--runs 5]  [--max-import-seconds 1.0]  [--max-first-work-seconds 2.0]
+# Exits with code 1 if a limit is exceeded or a provider SDK is imported too early, so it can be used to catch startup regressions
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+REPO_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that should only be loaded once a provider is actually used
+PROVIDER_MODULES = ['azure.cognitiveservices.speech', 'googleapiclient.discovery', 'google_auth_oauthlib.flow', 'google.oauth2.credentials', 'requests']
+
+# Module entry points to time the import of
+MODULES_TO_IMPORT = ['main', 'TTS', 'audio_builder', 'auth', 'azure_batch', 'settings', 'subtitles']
+
+# Runs in the child process. Prints a json result on the last line
+CHILD_SCRIPT = r'''
+import json, sys, time
+startTime = time.perf_counter()
+sys.path.insert(0, {repoFolder!r})
+import {moduleName}
+importSeconds = time.perf_counter() - startTime
+result = {{'importSeconds': importSeconds}}
+if {firstWork!r}:
+    import main, settings
+    config = settings.load_config()
+    cueTable = main.load_cue_table(config)
+    result['firstWorkSeconds'] = time.perf_counter() - startTime
+    result['cues'] = len(cueTable)
+result['providerModulesLoaded'] = [name for name in {providerModules!r} if name in sys.modules]
+print(json.dumps(result))
+'''
+
+
+def write_sample_files(folder, numCues=2000):
+    # Copies the real config files, and points batch.ini at a generated subtitle file
+    import configparser
+    for fileName in ('config.ini', 'cloud_service_settings.ini'):
+        with open(os.path.join(REPO_FOLDER, fileName), 'r', encoding='utf-8') as src, open(os.path.join(folder, fileName), 'w', encoding='utf-8') as dst:
+            dst.write(src.read())
+
+    srtPath = os.path.join(folder, 'subtitles.srt')
+    with open(srtPath, 'w', encoding='utf-8') as f:
+        for i in range(numCues):
+            startMs = i * 3000
+            endMs = startMs + 2500
+            f.write(f"{i+1}\n{ms_to_srt(startMs)} --> {ms_to_srt(endMs)}\nThis is sample subtitle line number {i+1}\n\n")
+
+    batchConfig = configparser.ConfigParser()
+    batchConfig.read(os.path.join(REPO_FOLDER, 'batch.ini'))
+    batchConfig['SETTINGS']['srt_file_path'] = srtPath
+    batchConfig['SETTINGS']['original_video_file_path'] = os.path.join(folder, 'video.mp4')
+    with open(os.path.join(folder, 'batch.ini'), 'w', encoding='utf-8') as f:
+        batchConfig.write(f)
+
+def ms_to_srt(totalMs):
+    hours, remainder = divmod(totalMs, 3600000)
+    minutes, remainder = divmod(remainder, 60000)
+    seconds, milliseconds = divmod(remainder, 1000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d},{milliseconds:03d}"
+
+def run_child(moduleName, workFolder, firstWork=False):
+    script = CHILD_SCRIPT.format(repoFolder=REPO_FOLDER, moduleName=moduleName, firstWork=firstWork, providerModules=PROVIDER_MODULES)
+    # -I isn't used because the site-packages are needed, but -B avoids timing the writing of .pyc files after the first run
+    output = subprocess.check_output([sys.executable, '-B', '-c', script], cwd=workFolder, stderr=subprocess.DEVNULL).decode()
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure cold import time and time to first work')
+    parser.add_argument('--runs', type=int, default=5, help='Number of fresh processes to run for each measurement')
+    parser.add_argument('--max-import-seconds', type=float, default=None, help='Fail if the median cold import of main takes longer than this')
+    parser.add_argument('--max-first-work-seconds', type=float, default=None, help='Fail if the median time to first work takes longer than this')
+    args = parser.parse_args()
+
+    failed = False
+    with tempfile.TemporaryDirectory() as workFolder:
+        write_sample_files(workFolder)
+
+        # Warm up once so the results don't include compiling to .pyc
+        run_child('main', workFolder)
+
+        print(f"\n{'Module':<16} {'Median':>10} {'Min':>10}   Provider SDKs loaded")
+        print('-' * 70)
+        for moduleName in MODULES_TO_IMPORT:
+            results = [run_child(moduleName, workFolder) for _ in range(args.runs)]
+            times = [result['importSeconds'] for result in results]
+            loaded = results[-1]['providerModulesLoaded']
+            print(f"{moduleName:<16} {statistics.median(times)*1000:>8.1f}ms {min(times)*1000:>8.1f}ms   {', '.join(loaded) if loaded else '-'}")
+            if loaded:
+                failed = True
+            if moduleName == 'main' and args.max_import_seconds is not None and statistics.median(times) > args.max_import_seconds:
+                print(f"  [!] Median import of main is over the limit of {args.max_import_seconds}s")
+                failed = True
+
+        results = [run_child('main', workFolder, firstWork=True) for _ in range(args.runs)]
+        times = [result['firstWorkSeconds'] for result in results]
+        print(f"\nTime to first work (import, load config, parse {results[0]['cues']} cues):")
+        print(f"   Median {statistics.median(times)*1000:.1f}ms   Min {min(times)*1000:.1f}ms")
+        if args.max_first_work_seconds is not None and statistics.median(times) > args.max_first_work_seconds:
+            print(f"  [!] Median time to first work is over the limit of {args.max_first_work_seconds}s")
+            failed = True
+
+    if failed:
+        print("\nFAILED: Startup is slower than allowed, or a provider SDK was loaded during import")
+        sys.exit(1)
+    print("\nOK")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+# TTS clip cache: Keeps every synthesized clip in the cache folder, named by a hash of everything that was sent to the TTS service to make it
+# If the exact same request is made again, in a later run, the second pass, or another language using the same voice, the clip is copied from here
+# instead of synthesized again. So after changing the wording of one subtitle line, only that line is sent to the TTS service
+# The total size is limited. When it is exceeded, the clips that were least recently used are deleted first
+
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+CLIPS_FOLDER_NAME = 'tts_clips'
+INDEX_FILE_NAME = 'tts_clips.sqlite3'
+
+
+# Returns a hash of all the values that affect the synthesized audio. requestValues must be a json serializable dictionary
+def make_request_key(requestValues):
+    return hashlib.sha256(json.dumps(requestValues, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+class ClipCache:
+    def __init__(self, cacheFolder, maxBytes):
+        self.clipsFolder = os.path.join(cacheFolder, CLIPS_FOLDER_NAME)
+        if not os.path.exists(self.clipsFolder):
+            os.makedirs(self.clipsFolder)
+        self.maxBytes = maxBytes
+        self.lock = threading.Lock()
+        # Same as the translation memory, the connection is shared by threads with a lock, and waits for other processes when they are writing
+        self.connection = sqlite3.connect(os.path.join(cacheFolder, INDEX_FILE_NAME), timeout=30, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS clips ('
+                ' request_key TEXT PRIMARY KEY,'
+                ' file_name TEXT NOT NULL,'
+                ' size INTEGER NOT NULL,'
+                ' last_used REAL NOT NULL)'
+            )
+            self.connection.execute('CREATE INDEX IF NOT EXISTS clips_last_used ON clips (last_used)')
+
+    # Copies the cached clip to destinationPath and returns True, or returns False if it isn't cached
+    # Only the index is used with the lock held, so synthesis threads copy their clips at the same time
+    def fetch(self, requestKey, destinationPath):
+        with self.lock:
+            row = self.connection.execute('SELECT file_name FROM clips WHERE request_key = ?', (requestKey,)).fetchone()
+            if row is None:
+                return False
+            # Marked as used before copying, so it's the last clip to be evicted while it is being copied
+            with self.connection:
+                self.connection.execute('UPDATE clips SET last_used = ? WHERE request_key = ?', (time.time(), requestKey))
+        cachedPath = os.path.join(self.clipsFolder, row[0])
+        try:
+            shutil.copyfile(cachedPath, destinationPath)
+        except FileNotFoundError:
+            # Deleted from outside the program, or evicted by another process. Forget about it
+            with self.lock, self.connection:
+                self.connection.execute('DELETE FROM clips WHERE request_key = ?', (requestKey,))
+            return False
+        return True
+
+    # Copies a newly synthesized clip into the cache
+    def store(self, requestKey, sourcePath):
+        fileName = requestKey + os.path.splitext(sourcePath)[1]
+        cachedPath = os.path.join(self.clipsFolder, fileName)
+        # Copy to a temporary name first, so another process never sees half a file
+        temporaryPath = self.get_temporary_path(cachedPath)
+        shutil.copyfile(sourcePath, temporaryPath)
+        os.replace(temporaryPath, cachedPath)
+        self.add_to_index([(requestKey, fileName, os.path.getsize(cachedPath))])
+
+    # Stores clips that are already in memory, such as ones read from a batch result archive. clips: (requestKey, audio bytes, extension)
+    # All of them are added to the index in a single transaction, which is much faster than one per clip
+    def store_many(self, clips):
+        rows = []
+        for requestKey, audioBytes, extension in clips:
+            fileName = requestKey + extension
+            cachedPath = os.path.join(self.clipsFolder, fileName)
+            temporaryPath = self.get_temporary_path(cachedPath)
+            with open(temporaryPath, 'wb') as out:
+                out.write(audioBytes)
+            os.replace(temporaryPath, cachedPath)
+            rows.append((requestKey, fileName, len(audioBytes)))
+        self.add_to_index(rows)
+
+    def get_temporary_path(self, cachedPath):
+        return f"{cachedPath}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    def add_to_index(self, rows):
+        if not rows:
+            return
+        now = time.time()
+        with self.lock:
+            with self.connection:
+                self.connection.executemany('INSERT OR REPLACE INTO clips (request_key, file_name, size, last_used) VALUES (?, ?, ?, ?)', ((requestKey, fileName, size, now) for requestKey, fileName, size in rows))
+            self.evict()
+
+    # Deletes the least recently used clips until the cache is within its size limit. Must be called with the lock held
+    # A clip that can't be deleted, such as one another thread is copying on Windows, keeps its place in the index and is tried again next time
+    def evict(self):
+        totalBytes = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM clips').fetchone()[0]
+        if totalBytes <= self.maxBytes:
+            return
+        candidates = []
+        for requestKey, fileName, size in self.connection.execute('SELECT request_key, file_name, size FROM clips ORDER BY last_used'):
+            if totalBytes <= self.maxBytes:
+                break
+            candidates.append((requestKey, fileName))
+            totalBytes -= size
+        evictedKeys = []
+        for requestKey, fileName in candidates:
+            try:
+                os.remove(os.path.join(self.clipsFolder, fileName))
+            except FileNotFoundError:
+                pass
+            except OSError:
+                continue
+            evictedKeys.append((requestKey,))
+        with self.connection:
+            self.connection.executemany('DELETE FROM clips WHERE request_key = ?', evictedKeys)
+
+
+# One open cache per folder for the whole program
+_openCaches = {}
+_openCachesLock = threading.Lock()
+
+# Returns None if the cache is turned off (tts_cache_max_mb = 0)
+def get_clip_cache(config):
+    if config.ttsCacheMaxMb <= 0:
+        return None
+    cacheFolder = os.path.abspath(config.cacheFolder)
+    with _openCachesLock:
+        if cacheFolder not in _openCaches:
+            _openCaches[cacheFolder] = ClipCache(cacheFolder, config.ttsCacheMaxMb * 1024 * 1024)
+        return _openCaches[cacheFolder]
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+# Combines adjacent subtitle entries so each spoken clip is closer to a natural speaking rate
+# Unlike combine_subtitles_advanced in main.py, which merges one pair at a time and restarts after every merge,
+# this works out the best grouping of all the entries in a single pass using dynamic programming
+
+import copy
+
+# Defaults match the values used in combine_subtitles_advanced
+CHAR_RATE_GOAL = 20 # Characters per second
+GAP_THRESHOLD = 100 # The maximum gap between subtitles to combine, in milliseconds
+
+# Small cost added per merge, so entries are only combined when it actually brings the speaking rate closer to the goal
+MERGE_PENALTY = 0.001
+
+
+def combine_subtitles_linear(inputDict, maxCharacters=200, charRateGoal=CHAR_RATE_GOAL, gapThreshold=GAP_THRESHOLD, dictKey='translated_text'):
+    entryList = []
+    for key, value in inputDict.items():
+        value['originalIndex'] = int(key)-1
+        entryList.append(value)
+    numEntries = len(entryList)
+    if numEntries == 0:
+        return {}
+
+    # Read everything needed once, as plain integers
+    starts = [int(entry['start_ms']) for entry in entryList]
+    ends = [int(entry['end_ms']) for entry in entryList]
+    charCounts = [len(entry[dictKey]) for entry in entryList]
+    gaps = [int(entry['break_until_next'] or 0) for entry in entryList]
+
+    # The cost of a group is how far its speaking rate is from the goal, weighted by its duration, so groups of different lengths compare fairly
+    # That works out to the number of characters that are "off" from what would be spoken at the goal rate
+    def group_cost(first, last, chars):
+        durationSeconds = max(ends[last] - starts[first], 1) / 1000
+        return abs(chars - charRateGoal * durationSeconds) + MERGE_PENALTY * (last - first)
+
+    # bestCost[i] is the lowest total cost for entries 0 to i-1, and groupStart[i] is where the last group in that solution begins
+    bestCost = [0.0] * (numEntries + 1)
+    groupStart = [0] * (numEntries + 1)
+
+    for last in range(numEntries):
+        chars = charCounts[last]
+        bestCost[last + 1] = bestCost[last] + group_cost(last, last, chars)
+        groupStart[last + 1] = last
+
+        # Try extending the group backwards. The window is limited by maxCharacters and the gap threshold, so this stays close to linear
+        first = last - 1
+        while first >= 0:
+            if gaps[first] >= gapThreshold:
+                break
+            chars += charCounts[first]
+            if chars > maxCharacters:
+                break
+            cost = bestCost[first] + group_cost(first, last, chars)
+            if cost < bestCost[last + 1]:
+                bestCost[last + 1] = cost
+                groupStart[last + 1] = first
+            first -= 1
+
+    # Walk back through the solution to get the groups in order
+    groups = []
+    last = numEntries
+    while last > 0:
+        first = groupStart[last]
+        groups.append((first, last - 1))
+        last = first
+    groups.reverse()
+
+    combinedList = [merge_entries(entryList, first, last, dictKey) for first, last in groups]
+
+    # Add the final speaking rates, used in the debug output
+    for entry in combinedList:
+        entry['char_rate'] = round(len(entry[dictKey]) / (max(int(entry['duration_ms']), 1) / 1000), 2)
+        entry['char_rate_diff'] = abs(round(entry['char_rate'] - charRateGoal, 2))
+
+    # Convert the list back to a dictionary then return it
+    return dict(enumerate(combinedList, start=1))
+
+
+def merge_entries(entryList, first, last, dictKey='translated_text'):
+    if first == last:
+        return entryList[first]
+
+    # Copy so the original entries are left alone
+    merged = copy.copy(entryList[first])
+    lastEntry = entryList[last]
+    group = entryList[first:last + 1]
+
+    merged['text'] = ' '.join(entry['text'] for entry in group)
+    if dictKey != 'text':
+        merged[dictKey] = ' '.join(entry[dictKey] for entry in group)
+    merged['end_ms'] = lastEntry['end_ms']
+    merged['end_ms_buffered'] = lastEntry['end_ms_buffered']
+    merged['duration_ms'] = int(lastEntry['end_ms']) - int(merged['start_ms'])
+    merged['duration_ms_buffered'] = int(lastEntry['end_ms_buffered']) - int(merged['start_ms_buffered'])
+    merged['break_until_next'] = lastEntry['break_until_next']
+    merged['srt_timestamps_line'] = merged['srt_timestamps_line'].split(' --> ')[0] + ' --> ' + lastEntry['srt_timestamps_line'].split(' --> ')[1]
+    return merged
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+# Groups identical work so it is only done once
+# Subtitles often repeat the same lines ("Thanks for watching", music cues, catchphrases). Each unique key (such as the text, or the text, voice and speed)
+# is sent to the API once, and the shared result is then given to every subtitle line that used it
+
+class DedupIndex:
+    def __init__(self):
+        # Unique key -> list of the items (usually subtitle keys) that share it, in the order they were added
+        self.groups = {}
+        self.total = 0
+
+    def add(self, uniqueKey, item):
+        group = self.groups.get(uniqueKey)
+        if group is None:
+            self.groups[uniqueKey] = [item]
+        else:
+            group.append(item)
+        self.total += 1
+
+    def __len__(self):
+        return len(self.groups)
+
+    def items(self):
+        return self.groups.items()
+
+    def unique_keys(self):
+        return list(self.groups)
+
+    # Fraction of the items that didn't need their own API call
+    def ratio(self):
+        if self.total == 0:
+            return 0.0
+        return 1 - (len(self.groups) / self.total)
+
+    def report(self, label):
+        print(f"{label}: {self.total} lines, {len(self.groups)} unique ({self.ratio():.1%} duplicates skipped)")
+
+
+def index_by(items, keyFunction):
+    index = DedupIndex()
+    for item in items:
+        index.add(keyFunction(item), item)
+    return index
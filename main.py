@@ -7,21 +7,33 @@
 # NOTE: By contributing to this project, you agree to the terms of the GPLv3 license, and agree to grant the project owner the right to also provide or sell this software, including your contribution, to anyone under any other license, with no compensation to you.
 
 version = '0.7.0'
-print(f"------- 'Auto Synced Translated Dubs' script by ThioJoe - Release version {version} -------")
 
 # Import other files
 import TTS
+import TitleTranslator
 import audio_builder
 import auth
-from utils import parseBool
+import azure_batch
+import combiner
+import dedup
+import media_probe
+import pipeline
+import providers
+import settings
+import speech_calibration
+import subtitles
+import translation_batching
+import translation_memory
 # Import built in modules
-import re
-import configparser
 import os
 import pathlib
 import copy
+import time
+import traceback
+import queue
+import threading
+import concurrent.futures
 # Import other modules
-import ffprobe
 import langcodes
 from operator import itemgetter
 
@@ -29,156 +41,24 @@ from operator import itemgetter
 # rubberband binaries: https://breakfastquay.com/rubberband/ - Put rubberband.exe and sndfile.dll in the same folder as this script
 # ffmpeg installed: https://ffmpeg.org/download.html
 
-
-# ====================================== SET CONFIGS ================================================
-# MOVE THIS INTO A DICTIONARY VARIABLE AT SOME POINT
-outputFolder = "output"
-
-# Read config file
-config = configparser.ConfigParser()
-config.read('config.ini')
-
-skipSynthesize = parseBool(config['SETTINGS']['skip_synthesize'])  # Set to true if you don't want to synthesize the audio. For example, you already did that and are testing
-debugMode = parseBool(config['SETTINGS']['debug_mode'])
-
-# Translation Settings
-skipTranslation = parseBool(config['SETTINGS']['skip_translation'])  # Set to true if you don't want to translate the subtitles. If so, ignore the following two variables
-originalLanguage = config['SETTINGS']['original_language']
-
-# Note! Setting this to true will make it so instead of just stretching the audio clips, it will have the API generate new audio clips with adjusted speaking rates
-# This can't be done on the first pass because we don't know how long the audio clips will be until we generate them
-twoPassVoiceSynth = parseBool(config['SETTINGS']['two_pass_voice_synth'])
-
-# Will add this many milliseconds of extra silence before and after each audio clip / spoken subtitle line
-addBufferMilliseconds = int(config['SETTINGS']['add_line_buffer_milliseconds'])
-
-# Will combine subtitles into one audio clip if they are less than this many characters
-combineMaxChars = int(config['SETTINGS']['combine_subtitles_max_chars'])  
-
-#---------------------------------------- Parse Cloud Service Settings ----------------------------------------
-# Get auth and project settings for Azure or Google Cloud
-cloudConfig = configparser.ConfigParser()
-cloudConfig.read('cloud_service_settings.ini')
-tts_service = cloudConfig['CLOUD']['tts_service']
-googleProjectID = cloudConfig['CLOUD']['google_project_id']
-batchSynthesize = parseBool(cloudConfig['CLOUD']['batch_tts_synthesize'])
-
-#---------------------------------------- Batch File Processing ----------------------------------------
-
-batchConfig = configparser.ConfigParser()
-batchConfig.read('batch.ini')
-# Get list of languages to process
-languageNums = batchConfig['SETTINGS']['enabled_languages'].replace(' ','').split(',')
-originalVideoFile = os.path.abspath(batchConfig['SETTINGS']['original_video_file_path'].strip("\""))
-srtFile = os.path.abspath(batchConfig['SETTINGS']['srt_file_path'].strip("\""))
-
-# Validate the number of sections
-for num in languageNums:
-    # Check if section exists
-    if not batchConfig.has_section(f'LANGUAGE-{num}'):
-        raise ValueError(f'Invalid language number in batch.ini: {num} - Make sure the section [LANGUAGE-{num}] exists')
-
-# Validate the settings in each section
-for num in languageNums:
-    if not batchConfig.has_option(f'LANGUAGE-{num}', 'synth_language_code'):
-        raise ValueError(f'Invalid configuration in batch.ini: {num} - Make sure the option "synth_language_code" exists under [LANGUAGE-{num}]')
-    if not batchConfig.has_option(f'LANGUAGE-{num}', 'synth_voice_name'):
-        raise ValueError(f'Invalid configuration in batch.ini: {num} - Make sure the option "synth_voice_name" exists under [LANGUAGE-{num}]')
-    if not batchConfig.has_option(f'LANGUAGE-{num}', 'translation_target_language'):
-        raise ValueError(f'Invalid configuration in batch.ini: {num} - Make sure the option "translation_target_language" exists under [LANGUAGE-{num}]')
-    if not batchConfig.has_option(f'LANGUAGE-{num}', 'synth_voice_gender'):
-        raise ValueError(f'Invalid configuration in batch.ini: {num} - Make sure the option "synth_voice_gender" exists under [LANGUAGE-{num}]')    
-
-# Create a dictionary of the settings from each section
-batchSettings = {}
-for num in languageNums:
-    batchSettings[num] = {
-        'synth_language_code': batchConfig[f'LANGUAGE-{num}']['synth_language_code'],
-        'synth_voice_name': batchConfig[f'LANGUAGE-{num}']['synth_voice_name'],
-        'translation_target_language': batchConfig[f'LANGUAGE-{num}']['translation_target_language'],
-        'synth_voice_gender': batchConfig[f'LANGUAGE-{num}']['synth_voice_gender']
-    }
+# Importing this file does not read any config files, call APIs or process anything. Use run_job() to run everything,
+# with a Config object from settings.py. Running this file directly loads the config files and calls run_job() for you
 
 #======================================== Get Total Duration ================================================
 # Final audio file Should equal the length of the video in milliseconds
-def get_duration(filename):
-    import subprocess, json
-    result = subprocess.check_output(
-            f'ffprobe -v quiet -show_streams -select_streams v:0 -of json "{filename}"', shell=True).decode()
-    fields = json.loads(result)['streams'][0]
-    try:
-        duration = fields['tags']['DURATION']
-    except KeyError:
-        duration = fields['duration']
-    durationMS = round(float(duration)*1000) # Convert to milliseconds
-    return durationMS
-
-totalAudioLength = get_duration(originalVideoFile)
-#totalAudioLength = 999999 # Or set manually here and comment out the above line
+# The result is cached by file path, size and modification time, so re-runs on the same video don't probe it again. See media_probe.py
+def get_duration(filename, cacheFolder=media_probe.DEFAULT_CACHE_FOLDER):
+    return media_probe.get_duration_ms(filename, cacheFolder)
 
 #======================================== Parse SRT File ================================================
-# Open an srt file and read the lines into a list
-with open(srtFile, 'r', encoding='utf-8') as f:
-    lines = f.readlines()
-
-# Matches the following example with regex:    00:00:20,130 --> 00:00:23,419
-subtitleTimeLineRegex = re.compile(r'\d\d:\d\d:\d\d,\d\d\d --> \d\d:\d\d:\d\d,\d\d\d')
-
-# Create a dictionary
-subsDict = {}
-
-# Enumerate lines, and if a line in lines contains only an integer, put that number in the key, and a dictionary in the value
-# The dictionary contains the start, ending, and duration of the subtitles as well as the text
-# The next line uses the syntax HH:MM:SS,MMM --> HH:MM:SS,MMM . Get the difference between the two times and put that in the dictionary
-# For the line after that, put the text in the dictionary
-for lineNum, line in enumerate(lines):
-    line = line.strip()
-    if line.isdigit() and subtitleTimeLineRegex.match(lines[lineNum + 1]):
-        lineWithTimestamps = lines[lineNum + 1].strip()
-        lineWithSubtitleText = lines[lineNum + 2].strip()
-
-        # If there are more lines after the subtitle text, add them to the text
-        count = 3
-        while True:
-            # Check if the next line is blank or not
-            if (lineNum+count) < len(lines) and lines[lineNum + count].strip():
-                lineWithSubtitleText += ' ' + lines[lineNum + count].strip()
-                count += 1
-            else:
-                break
-
-        # Create empty dictionary with keys for start and end times and subtitle text
-        subsDict[line] = {'start_ms': '', 'end_ms': '', 'duration_ms': '', 'text': '', 'break_until_next': '', 'srt_timestamps_line': lineWithTimestamps}
-
-        time = lineWithTimestamps.split(' --> ')
-        time1 = time[0].split(':')
-        time2 = time[1].split(':')
-
-        # Converts the time to milliseconds
-        processedTime1 = int(time1[0]) * 3600000 + int(time1[1]) * 60000 + int(time1[2].split(',')[0]) * 1000 + int(time1[2].split(',')[1]) #/ 1000 #Uncomment to turn into seconds
-        processedTime2 = int(time2[0]) * 3600000 + int(time2[1]) * 60000 + int(time2[2].split(',')[0]) * 1000 + int(time2[2].split(',')[1]) #/ 1000 #Uncomment to turn into seconds
-        timeDifferenceMs = str(processedTime2 - processedTime1)
-
-        # Adjust times with buffer
-        if addBufferMilliseconds > 0:
-            subsDict[line]['start_ms_buffered'] = str(processedTime1 + addBufferMilliseconds)
-            subsDict[line]['end_ms_buffered'] = str(processedTime2 - addBufferMilliseconds)
-            subsDict[line]['duration_ms_buffered'] = str((processedTime2 - addBufferMilliseconds) - (processedTime1 + addBufferMilliseconds))
-        else:
-            subsDict[line]['start_ms_buffered'] = str(processedTime1)
-            subsDict[line]['end_ms_buffered'] = str(processedTime2)
-            subsDict[line]['duration_ms_buffered'] = str(processedTime2 - processedTime1)
-        
-        # Set the keys in the dictionary to the values
-        subsDict[line]['start_ms'] = str(processedTime1)
-        subsDict[line]['end_ms'] = str(processedTime2)
-        subsDict[line]['duration_ms'] = timeDifferenceMs
-        subsDict[line]['text'] = lineWithSubtitleText
-        if lineNum > 0:
-            # Goes back to previous line's dictionary and writes difference in time to current line
-            subsDict[str(int(line)-1)]['break_until_next'] = processedTime1 - int(subsDict[str(int(line) - 1)]['end_ms'])
-        else:
-            subsDict[line]['break_until_next'] = 0
+# Stream the subtitle file (SRT or VTT) one cue at a time into a compact table of integer timings
+# This is the shared, read-only base for every language. Each language gets its own overlay of it, see cueTable.new_overlay()
+def load_cue_table(config):
+    cueTable = subtitles.CueTable.from_file(config.srtFile, bufferMs=config.addBufferMilliseconds)
+    # Apply the buffer to the start and end times, so the buffered values are used as the main values
+    if config.addBufferMilliseconds > 0:
+        cueTable.apply_buffer()
+    return cueTable
 
 
 #----------------------------------------------------------------------
@@ -346,14 +226,15 @@ def combine_subtitles_advanced(inputDict, maxCharacters=200):
 #----------------------------------------------------------------------
 
 # Calculate the number of characters per second for each subtitle entry
+# Entries are copied individually instead of deep copied, because for subtitle overlays that only copies the per-language values
 def calc_dict_speaking_rates(inputDict, dictKey='translated_text'):  
-    tempDict = copy.deepcopy(inputDict)
+    tempDict = {key: copy.copy(value) for key, value in inputDict.items()}
     for key, value in tempDict.items():
         tempDict[key]['char_rate'] = round(len(value[dictKey]) / (int(value['duration_ms']) / 1000), 2)
     return tempDict
 
 def calc_list_speaking_rates(inputList, charRateGoal, dictKey='translated_text'): 
-    tempList = copy.deepcopy(inputList)
+    tempList = [copy.copy(entry) for entry in inputList]
     for i in range(len(tempList)):
         # Calculate the number of characters per second based on the duration of the entry
         tempList[i]['char_rate'] = round(len(tempList[i][dictKey]) / (int(tempList[i]['duration_ms']) / 1000), 2)
@@ -361,111 +242,99 @@ def calc_list_speaking_rates(inputList, charRateGoal, dictKey='translated_text')
         tempList[i]['char_rate_diff'] = abs(round(tempList[i]['char_rate'] - charRateGoal, 2))
     return tempList
 
-# Apply the buffer to the start and end times by setting copying over the buffer values to main values
-for key, value in subsDict.items():
-    if addBufferMilliseconds > 0:
-        subsDict[key]['start_ms'] = value['start_ms_buffered']
-        subsDict[key]['end_ms'] = value['end_ms_buffered']
-        subsDict[key]['duration_ms'] = value['duration_ms_buffered']
-
 #======================================== Translate Text ================================================
 # Note: This function was almost entirely written by GPT-3 after feeding it my original code and asking it to change it so it
 # would break up the text into chunks if it was too long. It appears to work
 
 # Translate the text entries of the dictionary
-def translate_dictionary(inputSubsDict, langDict, skipTranslation=False):
+# Sends a single packed request to the translation provider and returns its translations, in the same order as request.texts
+def send_translation_request(request, targetLanguage, config):
+    translationProvider = providers.get_translation_provider(config)
+    return providers.call_with_retries(providers.translate_texts, translationProvider, request.texts, config.originalLanguage, targetLanguage, config)
+
+# Sends texts to the translation API and returns the translations in the same order
+# The texts are packed into as few requests as the API limits allow, and the requests are sent at the same time
+def request_translations(textToTranslate, targetLanguage, config):
+    requests = translation_batching.pack_requests(textToTranslate)
+    translatedTexts = [None] * len(textToTranslate)
+    if len(requests) > 1:
+        print(f"Translating {len(textToTranslate)} lines in {len(requests)} requests...")
+    else:
+        print("Translating text...")
+
+    # Authenticate before starting the threads, in case the user has to log in
+    if config.translateService == 'google':
+        auth.ensure_authenticated()
+
+    maxWorkers = max(1, min(config.maxTranslationRequests, len(requests)))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=maxWorkers) as executor:
+        futureToRequest = {executor.submit(send_translation_request, request, targetLanguage, config): request for request in requests}
+        finishedLines = 0
+        for future in concurrent.futures.as_completed(futureToRequest):
+            request = futureToRequest[future]
+            # Put each translation back at the position its text came from
+            for index, translatedText in zip(request.indexes, future.result()):
+                translatedTexts[index] = translatedText
+            finishedLines += len(request)
+            print(f' Translated: {finishedLines} of {len(textToTranslate)}', end='\r')
+
+    return translatedTexts
+
+def translate_dictionary(inputSubsDict, langDict, config, skipTranslation=False):
     targetLanguage = langDict['targetLanguage']
 
-    # Create a container for all the text to be translated
-    textToTranslate = []
+    # Group the lines by their text, so each unique text is only translated once
+    textIndex = dedup.index_by(inputSubsDict, lambda key: inputSubsDict[key]['text'])
 
-    for key in inputSubsDict:
-        originalText = inputSubsDict[key]['text']
-        textToTranslate.append(originalText)
-    
-    # Calculate the total number of utf-8 codepoints
-    codepoints = 0
-    for text in textToTranslate:
-        codepoints += len(text.encode("utf-8"))
-    
-    # If the codepoints are greater than 28000, split the request into multiple
-    # Google's API limit is 30000 Utf-8 codepoints per request, but we leave some room just in case
     if skipTranslation == False:
-        if codepoints > 27000:
-            # GPT-3 Description of what the following line does:
-            # Splits the list of text to be translated into smaller chunks of 100 texts.
-            # It does this by looping over the list in steps of 100, and slicing out each chunk from the original list. 
-            # Each chunk is appended to a new list, chunkedTexts, which then contains the text to be translated in chunks.
-            chunkedTexts = [textToTranslate[x:x+100] for x in range(0, len(textToTranslate), 100)]
-            
-            # Send and receive the batch requests
-            for chunk in chunkedTexts:
-                # Print status with progress
-                print(f'Translating text group {chunkedTexts.index(chunk)+1} of {len(chunkedTexts)}')
-                
-                # Send the request
-                response = auth.TRANSLATE_API.projects().translateText(
-                    parent='projects/' + googleProjectID,
-                    body={
-                        'contents': chunk,
-                        'sourceLanguageCode': originalLanguage,
-                        'targetLanguageCode': targetLanguage,
-                        'mimeType': 'text/plain',
-                        #'model': 'nmt',
-                        #'glossaryConfig': {}
-                    }
-                ).execute()
-
-                # Extract the translated texts from the response
-                translatedTexts = [response['translations'][i]['translatedText'] for i in range(len(response['translations']))]
-                
-                # Add the translated texts to the dictionary
-                for i, key in enumerate(inputSubsDict):
-                    inputSubsDict[key]['translated_text'] = translatedTexts[i]
-                    # Print progress, ovwerwrite the same line
-                    print(f' Translated: {key} of {len(inputSubsDict)}', end='\r')
-        
-        else:
-            print("Translating text...")
-            response = auth.TRANSLATE_API.projects().translateText(
-                parent='projects/' + googleProjectID,
-                body={
-                    'contents':textToTranslate,
-                    'sourceLanguageCode': originalLanguage,
-                    'targetLanguageCode': targetLanguage,
-                    'mimeType': 'text/plain',
-                    #'model': 'nmt',
-                    #'glossaryConfig': {}
-                }
-            ).execute()
-            translatedTexts = [response['translations'][i]['translatedText'] for i in range(len(response['translations']))]
-            for i, key in enumerate(inputSubsDict):
-                inputSubsDict[key]['translated_text'] = translatedTexts[i]
-                # Print progress, ovwerwrite the same line
-                print(f' Translated: {key} of {len(inputSubsDict)}', end='\r')
+        textIndex.report("Translation dedup")
+        textToTranslate = textIndex.unique_keys()
+
+        # Look up lines that were already translated in a previous run, so only new or changed lines are sent to the API
+        knownTranslations = {}
+        if config.useTranslationMemory:
+            memory = translation_memory.get_memory(config.cacheFolder)
+            knownTranslations = memory.lookup(textToTranslate, config.originalLanguage, targetLanguage, 'text/plain', config.translateService)
+        textsToSend = [text for text in textToTranslate if text not in knownTranslations]
+        if config.useTranslationMemory:
+            print(f"Translation memory: {len(textToTranslate) - len(textsToSend)} hits, {len(textsToSend)} misses")
+
+        if textsToSend:
+            newTranslations = request_translations(textsToSend, targetLanguage, config)
+            if config.useTranslationMemory:
+                memory.store(zip(textsToSend, newTranslations), config.originalLanguage, targetLanguage, 'text/plain', config.translateService)
+            knownTranslations.update(zip(textsToSend, newTranslations))
+
+        # Give each shared translation to every line with the same text
+        for text, keys in textIndex.items():
+            for key in keys:
+                inputSubsDict[key]['translated_text'] = knownTranslations[text]
     else:
         for key in inputSubsDict:
             inputSubsDict[key]['translated_text'] = inputSubsDict[key]['text'] # Skips translating, such as for testing
     print("                                                  ")
 
-    combinedProcessedDict = combine_subtitles_advanced(inputSubsDict, combineMaxChars)
+    if config.combineAlgorithm == 'legacy':
+        combinedProcessedDict = combine_subtitles_advanced(inputSubsDict, config.combineMaxChars)
+    else:
+        combinedProcessedDict = combiner.combine_subtitles_linear(inputSubsDict, config.combineMaxChars)
 
-    if skipTranslation == False or debugMode == True:
+    if skipTranslation == False or config.debugMode == True:
         # Use video file name to use in the name of the translate srt file, also display regular language name
         lang = langcodes.get(targetLanguage).display_name()
-        if debugMode:
-            translatedSrtFileName = pathlib.Path(originalVideoFile).stem + f" - {lang} - {targetLanguage}.DEBUG.txt"
+        if config.debugMode:
+            translatedSrtFileName = pathlib.Path(config.originalVideoFile).stem + f" - {lang} - {targetLanguage}.DEBUG.txt"
         else:
-            translatedSrtFileName = pathlib.Path(originalVideoFile).stem + f" - {lang} - {targetLanguage}.srt"
+            translatedSrtFileName = pathlib.Path(config.originalVideoFile).stem + f" - {lang} - {targetLanguage}.srt"
         # Set path to save translated srt file
-        translatedSrtFileName = os.path.join(outputFolder, translatedSrtFileName)
+        translatedSrtFileName = os.path.join(config.outputFolder, translatedSrtFileName)
         # Write new srt file with translated text
         with open(translatedSrtFileName, 'w', encoding='utf-8') as f:
             for key in combinedProcessedDict:
                 f.write(str(key) + '\n')
                 f.write(combinedProcessedDict[key]['srt_timestamps_line'] + '\n')
                 f.write(combinedProcessedDict[key]['translated_text'] + '\n')
-                if debugMode:
+                if config.debugMode:
                     f.write(f"DEBUG: duration_ms = {combinedProcessedDict[key]['duration_ms']}" + '\n')
                     f.write(f"DEBUG: char_rate = {combinedProcessedDict[key]['char_rate']}" + '\n')
                     f.write(f"DEBUG: start_ms = {combinedProcessedDict[key]['start_ms']}" + '\n')
@@ -476,43 +345,289 @@ def translate_dictionary(inputSubsDict, langDict, skipTranslation=False):
 
     return combinedProcessedDict
 
-#============================================= Directory Validation =====================================================
-
-# Check if the output folder exists, if not, create it
-if not os.path.exists(outputFolder):
-    os.makedirs(outputFolder)
-
-# Check if the working folder exists, if not, create it
-if not os.path.exists('workingFolder'):
-    os.makedirs('workingFolder')
-
 #======================================== Translation and Text-To-Speech ================================================    
 
 # Create dictionary to store settings for the language to pass into functions
-langDict = {}
-for langNum, value in batchSettings.items():
-    # Place settings into individual dictionary
-    langDict = {
-        'targetLanguage': value['translation_target_language'], 
-        'voiceName': value['synth_voice_name'], 
-        'languageCode': value['synth_language_code'], 
-        'voiceGender': value['synth_voice_gender']
+def make_lang_dict(langSettings, langWorkingFolder='workingFolder'):
+    return {
+        'targetLanguage': langSettings['translation_target_language'], 
+        'voiceName': langSettings['synth_voice_name'], 
+        'languageCode': langSettings['synth_language_code'], 
+        'voiceGender': langSettings['synth_voice_gender'],
+        'workingFolder': langWorkingFolder
         }
 
-    # Create subs dict to use for this language
-    individualLanguageSubsDict = copy.deepcopy(subsDict)
+# The three stages of processing a language. They are separate so they can also be run at the same time for different languages, see pipeline.py
+def translate_language(config, cueTable, langDict):
+    # Create subs dict to use for this language. The original subtitle data is shared, only the values changed for this language are stored separately
+    individualLanguageSubsDict = cueTable.new_overlay()
+    return translate_dictionary(individualLanguageSubsDict, langDict, config, skipTranslation=config.skipTranslation)
+
+def synthesize_language(config, individualLanguageSubsDict, langDict):
+    speech_calibration.predict_speed_factors(individualLanguageSubsDict, langDict, config)
+    if TTS.use_batch_synthesis(config):
+        return TTS.synthesize_dictionary_batch(individualLanguageSubsDict, langDict, config, skipSynthesize=config.skipSynthesize)
+    else:
+        return TTS.synthesize_dictionary(individualLanguageSubsDict, langDict, config, skipSynthesize=config.skipSynthesize)
+
+def build_language(config, individualLanguageSubsDict, langDict, totalAudioLength):
+    return audio_builder.build_audio(individualLanguageSubsDict, langDict, totalAudioLength, config, config.twoPassVoiceSynth)
+
+# Whether clips can be put into the final audio while the rest are still being synthesized. Batch synthesis returns all the clips at once so it can't
+def use_streaming_build(config):
+    return config.streamingAudioBuild and not TTS.use_batch_synthesis(config)
+
+# Synthesizes in a background thread, while each finished clip is trimmed, stretched and put onto the canvas right away
+def synthesize_and_build_language(config, individualLanguageSubsDict, langDict, totalAudioLength):
+    readyKeysQueue = queue.Queue()
+    synthesisErrors = []
+    stopSynthesis = threading.Event()
+
+    def synthesize():
+        try:
+            TTS.synthesize_dictionary(individualLanguageSubsDict, langDict, config, skipSynthesize=config.skipSynthesize, onClipReady=readyKeysQueue.put, stopEvent=stopSynthesis)
+        except Exception as ex:
+            synthesisErrors.append(ex)
+        finally:
+            readyKeysQueue.put(None) # Tells the builder there are no more clips coming
+
+    speech_calibration.predict_speed_factors(individualLanguageSubsDict, langDict, config)
+    synthesisThread = threading.Thread(target=synthesize, daemon=True)
+    synthesisThread.start()
+    readyKeys = iter(readyKeysQueue.get, None)
+    try:
+        individualLanguageSubsDict = audio_builder.build_audio_streaming(individualLanguageSubsDict, langDict, totalAudioLength, readyKeys, config, config.twoPassVoiceSynth, synthesisErrors)
+    except Exception:
+        # Nothing will use the rest of the clips, so don't keep sending requests for them
+        stopSynthesis.set()
+        raise
+    finally:
+        synthesisThread.join()
+
+    if synthesisErrors:
+        raise synthesisErrors[0]
+    return individualLanguageSubsDict
+
+# Translates, synthesizes and builds the audio track for a single language
+def process_language(config, cueTable, totalAudioLength, langNum, langSettings, langWorkingFolder=None):
+    if langWorkingFolder is None:
+        langWorkingFolder = config.workingFolder
+    langDict = make_lang_dict(langSettings, langWorkingFolder)
+    if not os.path.exists(langWorkingFolder):
+        os.makedirs(langWorkingFolder)
 
     # Print language being processed
     print(f"\n----- Beginning Processing of Language: {langDict['languageCode']} -----")
 
-    # Translate
-    individualLanguageSubsDict = translate_dictionary(individualLanguageSubsDict, langDict, skipTranslation=skipTranslation)
-
-    # Synthesize
-    if batchSynthesize == True and tts_service == 'azure':
-        individualLanguageSubsDict = TTS.synthesize_dictionary_batch(individualLanguageSubsDict, langDict, skipSynthesize=skipSynthesize)
+    individualLanguageSubsDict = translate_language(config, cueTable, langDict)
+    if use_streaming_build(config):
+        individualLanguageSubsDict = synthesize_and_build_language(config, individualLanguageSubsDict, langDict, totalAudioLength)
     else:
-        individualLanguageSubsDict = TTS.synthesize_dictionary(individualLanguageSubsDict, langDict, skipSynthesize=skipSynthesize)
-
-    # Build audio
-    individualLanguageSubsDict = audio_builder.build_audio(individualLanguageSubsDict, langDict, totalAudioLength, twoPassVoiceSynth)
+        individualLanguageSubsDict = synthesize_language(config, individualLanguageSubsDict, langDict)
+        individualLanguageSubsDict = build_language(config, individualLanguageSubsDict, langDict, totalAudioLength)
+    return individualLanguageSubsDict
+
+# Each language gets its own working folder when processed at the same time as others, so clips with the same file names don't overwrite each other
+def get_language_working_folder(config, langNum):
+    return os.path.join(config.workingFolder, f'LANGUAGE-{langNum}')
+
+# Runs in a separate worker process when processing languages in parallel. Everything it needs is passed in, nothing is re-read in the worker
+# Returns a small summary instead of the whole dictionary, and catches errors so one failed language doesn't stop the others
+def process_language_worker(config, cueTable, totalAudioLength, langNum, langSettings):
+    startTime = time.perf_counter()
+    result = {'langNum': langNum, 'languageCode': langSettings['synth_language_code'], 'lines': 0, 'error': None}
+    try:
+        processedDict = process_language(config, cueTable, totalAudioLength, langNum, langSettings, get_language_working_folder(config, langNum))
+        result['lines'] = len(processedDict)
+    except Exception as ex:
+        result['error'] = f"{type(ex).__name__}: {ex}"
+        traceback.print_exc()
+    result['seconds'] = time.perf_counter() - startTime
+    return result
+
+def process_languages_parallel(config, cueTable, totalAudioLength):
+    batchSettings = config.batchSettings
+    maxWorkers = config.maxParallelLanguages
+    if maxWorkers <= 0:
+        maxWorkers = min(len(batchSettings), os.cpu_count() or 1)
+    # Each language process stretches its clips in its own pool of processes, so they share the cores instead of each starting one per core
+    if config.maxStretchWorkers <= 0:
+        config = copy.copy(config)
+        config.maxStretchWorkers = max(1, (os.cpu_count() or 1) // maxWorkers)
+    print(f"\nProcessing {len(batchSettings)} languages in parallel using {maxWorkers} worker processes...")
+
+    startTime = time.perf_counter()
+    results = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=maxWorkers) as executor:
+        futures = [executor.submit(process_language_worker, config, cueTable, totalAudioLength, langNum, value) for langNum, value in batchSettings.items()]
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            results.append(result)
+            status = 'Done' if result['error'] is None else 'FAILED'
+            print(f"\n[{len(results)} of {len(futures)} languages finished] {result['languageCode']}: {status}")
+    print_language_summary(config, results, time.perf_counter() - startTime)
+    return results
+
+# Runs the translate, synthesize and build stages at the same time for different languages, in a single process
+# While one language is being built, the next one is synthesizing and the one after that is translating
+def process_languages_pipelined(config, cueTable, totalAudioLength):
+    batchSettings = config.batchSettings
+    print(f"\nProcessing {len(batchSettings)} languages with translation, synthesis and audio building running at the same time...")
+
+    def translate_stage(item):
+        langDict = make_lang_dict(item.langSettings, get_language_working_folder(config, item.langNum))
+        if not os.path.exists(langDict['workingFolder']):
+            os.makedirs(langDict['workingFolder'])
+        print(f"\n----- Translating Language: {langDict['languageCode']} -----")
+        return langDict, translate_language(config, cueTable, langDict)
+
+    def synthesize_stage(item):
+        langDict, individualLanguageSubsDict = item.data
+        print(f"\n----- Synthesizing Language: {langDict['languageCode']} -----")
+        return langDict, synthesize_language(config, individualLanguageSubsDict, langDict)
+
+    def build_stage(item):
+        langDict, individualLanguageSubsDict = item.data
+        print(f"\n----- Building Audio for Language: {langDict['languageCode']} -----")
+        individualLanguageSubsDict = build_language(config, individualLanguageSubsDict, langDict, totalAudioLength)
+        # Only keep the number of lines, so the finished dictionary can be freed
+        return len(individualLanguageSubsDict)
+
+    def synthesize_and_build_stage(item):
+        langDict, individualLanguageSubsDict = item.data
+        print(f"\n----- Synthesizing and Building Audio for Language: {langDict['languageCode']} -----")
+        return len(synthesize_and_build_language(config, individualLanguageSubsDict, langDict, totalAudioLength))
+
+    startTime = time.perf_counter()
+    if use_streaming_build(config):
+        stages = [('translate', translate_stage), ('synthesize+build', synthesize_and_build_stage)]
+    else:
+        stages = [('translate', translate_stage), ('synthesize', synthesize_stage), ('build', build_stage)]
+    items = pipeline.run_pipeline(batchSettings, stages, queueSize=config.pipelineQueueSize)
+
+    results = []
+    for item in items:
+        stageTimes = '  '.join(f"{name} {seconds:.1f}s" for name, seconds in item.stageSeconds.items())
+        results.append({
+            'langNum': item.langNum,
+            'languageCode': item.langSettings['synth_language_code'],
+            'lines': item.data if item.error is None else 0,
+            'error': item.error,
+            'seconds': sum(item.stageSeconds.values()),
+            'details': stageTimes
+            })
+    print_language_summary(config, results, time.perf_counter() - startTime)
+    return results
+
+# With batch synthesis, every language is translated first, then all of their batch jobs are submitted at once and waited on together
+# The second pass jobs of all languages are also sent at the same time while building, so the whole run waits for the slowest job instead of every job
+def process_languages_batch(config, cueTable, totalAudioLength):
+    batchSettings = config.batchSettings
+    print(f"\nProcessing {len(batchSettings)} languages with all of their batch synthesis jobs running at the same time...")
+    startTime = time.perf_counter()
+    results = {}
+    langData = {}
+
+    def run_step(langNum, stepName, stepFunction):
+        result = results[langNum]
+        if result['error'] is not None:
+            return None
+        stepStartTime = time.perf_counter()
+        try:
+            return stepFunction()
+        except Exception as ex:
+            result['error'] = f"{stepName}: {type(ex).__name__}: {ex}"
+            traceback.print_exc()
+        finally:
+            result['stepSeconds'][stepName] = time.perf_counter() - stepStartTime
+
+    def synthesize_step(langNum):
+        langDict, individualLanguageSubsDict = langData[langNum]
+        print(f"\n----- Synthesizing Language: {langDict['languageCode']} -----")
+        langData[langNum] = (langDict, synthesize_language(config, individualLanguageSubsDict, langDict))
+
+    def build_step(langNum):
+        langDict, individualLanguageSubsDict = langData.pop(langNum)
+        print(f"\n----- Building Audio for Language: {langDict['languageCode']} -----")
+        results[langNum]['lines'] = len(build_language(config, individualLanguageSubsDict, langDict, totalAudioLength))
+
+    for langNum, langSettings in batchSettings.items():
+        results[langNum] = {'langNum': langNum, 'languageCode': langSettings['synth_language_code'], 'lines': 0, 'error': None, 'stepSeconds': {}}
+        langDict = make_lang_dict(langSettings, get_language_working_folder(config, langNum))
+        if not os.path.exists(langDict['workingFolder']):
+            os.makedirs(langDict['workingFolder'])
+        print(f"\n----- Translating Language: {langDict['languageCode']} -----")
+        langData[langNum] = (langDict, run_step(langNum, 'translate', lambda: translate_language(config, cueTable, langDict)))
+
+    # One thread per language, which mostly just waits for its jobs. The jobs themselves are run by batch_jobs.py
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(batchSettings)) as executor:
+        list(executor.map(lambda langNum: run_step(langNum, 'synthesize', lambda: synthesize_step(langNum)), batchSettings))
+        list(executor.map(lambda langNum: run_step(langNum, 'build', lambda: build_step(langNum)), batchSettings))
+
+    for result in results.values():
+        stepSeconds = result.pop('stepSeconds')
+        result['seconds'] = sum(stepSeconds.values())
+        result['details'] = '  '.join(f"{name} {seconds:.1f}s" for name, seconds in stepSeconds.items())
+    results = list(results.values())
+    print_language_summary(config, results, time.perf_counter() - startTime)
+    return results
+
+def print_language_summary(config, results, totalSeconds):
+    print("\n========================= Summary =========================")
+    # Show in the same order as batch.ini
+    for result in sorted(results, key=lambda x: config.languageNums.index(x['langNum'])):
+        if result['error'] is None:
+            status = f"OK      {result['lines']} lines"
+        else:
+            status = f"FAILED  {result['error']}"
+        if result.get('details'):
+            status += f"   ({result['details']})"
+        print(f" LANGUAGE-{result['langNum']:<4} {result['languageCode']:<8} {result['seconds']:8.1f}s   {status}")
+    languageSeconds = sum(result['seconds'] for result in results)
+    failedCount = sum(1 for result in results if result['error'] is not None)
+    print(f"\n Total time: {totalSeconds:.1f}s  (Sum of all languages: {languageSeconds:.1f}s)")
+    if failedCount:
+        print(f" {failedCount} of {len(results)} languages failed. See errors above.")
+    print("===========================================================")
+
+#============================================= Run Job =====================================================
+# Processes every enabled language in the config. Can be called from other scripts, or repeatedly in a long running program
+def run_job(config=None):
+    if config is None:
+        config = settings.get_config()
+
+    # Check if the output and working folders exist, if not, create them
+    if not os.path.exists(config.outputFolder):
+        os.makedirs(config.outputFolder)
+    if not os.path.exists(config.workingFolder):
+        os.makedirs(config.workingFolder)
+
+    totalAudioLength = get_duration(config.originalVideoFile, config.cacheFolder)
+    #totalAudioLength = 999999 # Or set manually here and comment out the above line
+    cueTable = load_cue_table(config)
+
+    batchSettings = config.batchSettings
+    results = None
+    if config.parallelLanguages and len(batchSettings) > 1:
+        results = process_languages_parallel(config, cueTable, totalAudioLength)
+    elif TTS.use_batch_synthesis(config) and len(batchSettings) > 1:
+        results = process_languages_batch(config, cueTable, totalAudioLength)
+    elif config.pipelineLanguages and len(batchSettings) > 1:
+        results = process_languages_pipelined(config, cueTable, totalAudioLength)
+    else:
+        for langNum, value in batchSettings.items():
+            process_language(config, cueTable, totalAudioLength, langNum, value)
+
+    # Uses the same login as the subtitle translation, and the translation memory
+    if config.translateTitleDescription:
+        print("\n----- Translating Title and Description -----")
+        outputFilePath = TitleTranslator.translate_title_and_description(config)
+        print(f"Saved to: {outputFilePath}")
+    return results
+
+
+# Must be inside this check, because worker processes import this file
+if __name__ == '__main__':
+    print(f"------- 'Auto Synced Translated Dubs' script by ThioJoe - Release version {version} -------")
+    azure_batch.setup_logging()
+    run_job(settings.get_config())
@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+# Gets the duration, streams and sample rate of video and audio files, and caches the results
+# MP4/MOV, MKV/WebM and WAV headers are read directly in Python, which is much faster than starting ffprobe. Anything else falls back to ffprobe
+# Results are saved to a cache file keyed by the file path, size and modification time, so the same file is never probed twice
+
+import json
+import os
+import struct
+import subprocess
+import threading
+import wave
+
+DEFAULT_CACHE_FOLDER = 'cache'
+CACHE_FILE_NAME = 'media_probe_cache.json'
+
+# Only one thread at a time should read or write the cache file
+_cacheLock = threading.Lock()
+
+
+#======================================== Cache ================================================
+def get_cache_key(filePath):
+    fileStats = os.stat(filePath)
+    return f"{os.path.abspath(filePath)}|{fileStats.st_size}|{fileStats.st_mtime_ns}"
+
+def load_cache(cacheFolder):
+    cachePath = os.path.join(cacheFolder, CACHE_FILE_NAME)
+    try:
+        with open(cachePath, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def save_cache(cacheFolder, cache):
+    if not os.path.exists(cacheFolder):
+        os.makedirs(cacheFolder)
+    cachePath = os.path.join(cacheFolder, CACHE_FILE_NAME)
+    # Write to a temporary file first, so a crash can't leave a half written cache
+    tempPath = cachePath + '.tmp'
+    with open(tempPath, 'w', encoding='utf-8') as f:
+        json.dump(cache, f, indent=1)
+    os.replace(tempPath, cachePath)
+
+# Returns a dictionary with:
+#   'duration_ms': Duration of the first video stream (or of the file if there is no video), in milliseconds
+#   'sample_rate': Sample rate of the first audio stream, or None
+#   'streams': List of dictionaries for each stream with 'type' ('video' / 'audio'), 'duration_ms', and for audio 'channels' and 'sample_rate'
+#   'source': Which reader was used ('mp4', 'mkv', 'wav' or 'ffprobe')
+def probe_media(filePath, cacheFolder=DEFAULT_CACHE_FOLDER, useCache=True):
+    cacheKey = get_cache_key(filePath)
+    if useCache:
+        with _cacheLock:
+            cache = load_cache(cacheFolder)
+        if cacheKey in cache:
+            return cache[cacheKey]
+
+    result = read_media_headers(filePath)
+    if result is None:
+        result = probe_with_ffprobe(filePath)
+
+    if useCache:
+        with _cacheLock:
+            # Re-load in case another process updated it in the meantime
+            cache = load_cache(cacheFolder)
+            cache[cacheKey] = result
+            save_cache(cacheFolder, cache)
+    return result
+
+def get_duration_ms(filePath, cacheFolder=DEFAULT_CACHE_FOLDER):
+    return probe_media(filePath, cacheFolder)['duration_ms']
+
+# Number of channels of the first audio stream
+def get_audio_channels(filePath, cacheFolder=DEFAULT_CACHE_FOLDER):
+    for stream in probe_media(filePath, cacheFolder)['streams']:
+        if stream['type'] == 'audio':
+            return stream['channels']
+    return None
+
+def make_result(streams, source, fallbackDurationMs=None):
+    videoStreams = [stream for stream in streams if stream['type'] == 'video' and stream.get('duration_ms')]
+    audioStreams = [stream for stream in streams if stream['type'] == 'audio']
+    if videoStreams:
+        durationMs = videoStreams[0]['duration_ms']
+    else:
+        durationMs = fallbackDurationMs
+    if not durationMs:
+        return None
+    return {
+        'duration_ms': durationMs,
+        'sample_rate': audioStreams[0].get('sample_rate') if audioStreams else None,
+        'streams': streams,
+        'source': source,
+    }
+
+
+#======================================== ffprobe ================================================
+def probe_with_ffprobe(filePath):
+    output = subprocess.check_output(['ffprobe', '-v', 'quiet', '-show_streams', '-show_format', '-of', 'json', filePath]).decode()
+    data = json.loads(output)
+
+    streams = []
+    for fields in data.get('streams', []):
+        codecType = fields.get('codec_type')
+        if codecType not in ('video', 'audio'):
+            continue
+        try:
+            duration = fields['tags']['DURATION']
+        except KeyError:
+            duration = fields.get('duration')
+        stream = {'type': codecType, 'duration_ms': parse_ffprobe_duration(duration)}
+        if codecType == 'audio':
+            stream['channels'] = fields.get('channels')
+            stream['sample_rate'] = int(fields['sample_rate']) if fields.get('sample_rate') else None
+        streams.append(stream)
+
+    formatDuration = parse_ffprobe_duration(data.get('format', {}).get('duration'))
+    result = make_result(streams, 'ffprobe', formatDuration)
+    if result is None:
+        raise ValueError(f"Could not get the duration of: {filePath}")
+    return result
+
+def parse_ffprobe_duration(duration):
+    # Duration is either in seconds like "12.345000", or from MKV tags like "00:00:12.345000000"
+    if duration is None:
+        return None
+    if ':' in str(duration):
+        hours, minutes, seconds = str(duration).split(':')
+        return round((int(hours) * 3600 + int(minutes) * 60 + float(seconds)) * 1000)
+    return round(float(duration) * 1000) # Convert to milliseconds
+
+
+#======================================== Direct Header Readers ================================================
+# Each reader returns None if it can't get what it needs, so ffprobe is used instead
+def read_media_headers(filePath):
+    extension = os.path.splitext(filePath)[1].lower()
+    try:
+        if extension in ('.mp4', '.m4v', '.mov', '.m4a'):
+            return read_mp4_headers(filePath)
+        elif extension in ('.mkv', '.webm', '.mka'):
+            return read_mkv_headers(filePath)
+        elif extension == '.wav':
+            return read_wav_headers(filePath)
+    except (OSError, struct.error, ValueError, EOFError, wave.Error):
+        return None
+    return None
+
+
+# ----- WAV -----
+def read_wav_headers(filePath):
+    with wave.open(filePath, 'rb') as wavFile:
+        sampleRate = wavFile.getframerate()
+        stream = {'type': 'audio', 'duration_ms': round(wavFile.getnframes() * 1000 / sampleRate), 'channels': wavFile.getnchannels(), 'sample_rate': sampleRate}
+    return make_result([stream], 'wav', stream['duration_ms'])
+
+
+# ----- MP4 / MOV -----
+# MP4 files are made of nested "boxes", each starting with a 4 byte size and a 4 byte type
+def iter_mp4_boxes(f, start, end):
+    position = start
+    while position + 8 <= end:
+        f.seek(position)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        size, boxType = struct.unpack('>I4s', header)
+        headerSize = 8
+        if size == 1: # 64 bit size follows
+            size = struct.unpack('>Q', f.read(8))[0]
+            headerSize = 16
+        elif size == 0: # Box goes to the end of the file
+            size = end - position
+        if size < headerSize:
+            return
+        yield boxType, position + headerSize, position + size
+        position += size
+
+def find_mp4_box(f, start, end, boxType):
+    for foundType, contentStart, contentEnd in iter_mp4_boxes(f, start, end):
+        if foundType == boxType:
+            return contentStart, contentEnd
+    return None
+
+def read_mp4_headers(filePath):
+    with open(filePath, 'rb') as f:
+        fileSize = os.fstat(f.fileno()).st_size
+        # The moov box can be at the start or the end of the file. Only the box headers are read while looking for it, so the media data is skipped over
+        moov = find_mp4_box(f, 0, fileSize, b'moov')
+        if moov is None:
+            return None
+
+        movieDurationMs = None
+        mvhd = find_mp4_box(f, moov[0], moov[1], b'mvhd')
+        if mvhd is not None:
+            timescale, duration = read_mp4_timescale_and_duration(f, mvhd[0])
+            if timescale:
+                movieDurationMs = round(duration * 1000 / timescale)
+
+        streams = []
+        for boxType, trakStart, trakEnd in iter_mp4_boxes(f, moov[0], moov[1]):
+            if boxType != b'trak':
+                continue
+            stream = read_mp4_track(f, trakStart, trakEnd)
+            if stream is not None:
+                streams.append(stream)
+
+    return make_result(streams, 'mp4', movieDurationMs)
+
+def read_mp4_timescale_and_duration(f, contentStart):
+    # Same layout for mvhd and mdhd boxes. Version 1 uses 64 bit times
+    f.seek(contentStart)
+    version = f.read(4)[0]
+    if version == 1:
+        f.seek(16, 1)
+        timescale, duration = struct.unpack('>IQ', f.read(12))
+    else:
+        f.seek(8, 1)
+        timescale, duration = struct.unpack('>II', f.read(8))
+    return timescale, duration
+
+def read_mp4_track(f, trakStart, trakEnd):
+    mdia = find_mp4_box(f, trakStart, trakEnd, b'mdia')
+    if mdia is None:
+        return None
+    hdlr = find_mp4_box(f, mdia[0], mdia[1], b'hdlr')
+    mdhd = find_mp4_box(f, mdia[0], mdia[1], b'mdhd')
+    if hdlr is None or mdhd is None:
+        return None
+
+    f.seek(hdlr[0] + 8) # Skip version, flags and pre_defined
+    handlerType = f.read(4)
+    if handlerType == b'vide':
+        streamType = 'video'
+    elif handlerType == b'soun':
+        streamType = 'audio'
+    else:
+        return None
+
+    timescale, duration = read_mp4_timescale_and_duration(f, mdhd[0])
+    # Fragmented files have a duration of 0 here, so leave it for ffprobe in that case
+    stream = {'type': streamType, 'duration_ms': round(duration * 1000 / timescale) if timescale and duration else None}
+
+    if streamType == 'audio':
+        stream['channels'] = None
+        stream['sample_rate'] = timescale
+        minf = find_mp4_box(f, mdia[0], mdia[1], b'minf')
+        stbl = find_mp4_box(f, minf[0], minf[1], b'stbl') if minf else None
+        stsd = find_mp4_box(f, stbl[0], stbl[1], b'stsd') if stbl else None
+        if stsd is not None:
+            # stsd: version/flags (4), entry count (4), then the first sample entry: size (4), format (4), reserved (6), data ref index (2),
+            # reserved (8), channel count (2), sample size (2), pre_defined (2), reserved (2), sample rate as 16.16 fixed point (4)
+            f.seek(stsd[0] + 8 + 8 + 8 + 8)
+            channels, _, _, _, sampleRateFixed = struct.unpack('>HHHHI', f.read(12))
+            stream['channels'] = channels
+            if sampleRateFixed >> 16:
+                stream['sample_rate'] = sampleRateFixed >> 16
+    return stream
+
+
+# ----- MKV / WebM -----
+# Matroska files use EBML, where every element has a variable length ID and a variable length size
+MKV_SEGMENT = 0x18538067
+MKV_INFO = 0x1549A966
+MKV_TIMECODE_SCALE = 0x2AD7B1
+MKV_DURATION = 0x4489
+MKV_TRACKS = 0x1654AE6B
+MKV_TRACK_ENTRY = 0xAE
+MKV_TRACK_TYPE = 0x83
+MKV_AUDIO = 0xE1
+MKV_SAMPLING_FREQUENCY = 0xB5
+MKV_CHANNELS = 0x9F
+MKV_CLUSTER = 0x1F43B675
+
+def read_mkv_vint(f, keepMarker):
+    firstByte = f.read(1)
+    if not firstByte:
+        raise EOFError
+    first = firstByte[0]
+    length = 1
+    mask = 0x80
+    while length <= 8 and not (first & mask):
+        mask >>= 1
+        length += 1
+    if length > 8:
+        raise ValueError('Invalid EBML variable length integer')
+    value = first if keepMarker else first & (mask - 1)
+    allOnes = (first & (mask - 1)) == (mask - 1)
+    for byte in f.read(length - 1):
+        value = (value << 8) | byte
+        allOnes = allOnes and byte == 0xFF
+    # A size with all bits set means "unknown size"
+    if not keepMarker and allOnes:
+        return None
+    return value
+
+def iter_mkv_elements(f, start, end):
+    position = start
+    while position < end:
+        f.seek(position)
+        elementID = read_mkv_vint(f, keepMarker=True)
+        size = read_mkv_vint(f, keepMarker=False)
+        contentStart = f.tell()
+        if size is None:
+            # Unknown size is only allowed for the segment and clusters, stop there
+            yield elementID, contentStart, None
+            return
+        yield elementID, contentStart, contentStart + size
+        position = contentStart + size
+
+def read_mkv_uint(f, start, end):
+    f.seek(start)
+    return int.from_bytes(f.read(end - start), 'big')
+
+def read_mkv_float(f, start, end):
+    f.seek(start)
+    data = f.read(end - start)
+    if len(data) == 4:
+        return struct.unpack('>f', data)[0]
+    return struct.unpack('>d', data)[0]
+
+def read_mkv_headers(filePath):
+    with open(filePath, 'rb') as f:
+        fileSize = os.fstat(f.fileno()).st_size
+        segment = None
+        for elementID, contentStart, contentEnd in iter_mkv_elements(f, 0, fileSize):
+            if elementID == MKV_SEGMENT:
+                segment = (contentStart, contentEnd if contentEnd is not None else fileSize)
+                break
+        if segment is None:
+            return None
+
+        timecodeScale = 1000000 # Default is 1 millisecond, in nanoseconds
+        duration = None
+        streams = []
+        for elementID, contentStart, contentEnd in iter_mkv_elements(f, segment[0], segment[1]):
+            if elementID == MKV_INFO:
+                for childID, childStart, childEnd in iter_mkv_elements(f, contentStart, contentEnd):
+                    if childID == MKV_TIMECODE_SCALE:
+                        timecodeScale = read_mkv_uint(f, childStart, childEnd)
+                    elif childID == MKV_DURATION:
+                        duration = read_mkv_float(f, childStart, childEnd)
+            elif elementID == MKV_TRACKS:
+                for childID, childStart, childEnd in iter_mkv_elements(f, contentStart, contentEnd):
+                    if childID == MKV_TRACK_ENTRY:
+                        stream = read_mkv_track(f, childStart, childEnd)
+                        if stream is not None:
+                            streams.append(stream)
+            elif elementID == MKV_CLUSTER or contentEnd is None:
+                # Info and tracks come before the clusters of media data, so no need to go further
+                break
+
+    if duration is None:
+        return None
+    durationMs = round(duration * timecodeScale / 1000000)
+    # MKV doesn't store a duration per track, so every stream gets the duration of the file
+    for stream in streams:
+        stream['duration_ms'] = durationMs
+    return make_result(streams, 'mkv', durationMs)
+
+def read_mkv_track(f, start, end):
+    trackType = None
+    channels = 1 # Default according to the Matroska specification
+    sampleRate = 8000
+    for elementID, contentStart, contentEnd in iter_mkv_elements(f, start, end):
+        if elementID == MKV_TRACK_TYPE:
+            trackType = read_mkv_uint(f, contentStart, contentEnd)
+        elif elementID == MKV_AUDIO:
+            for childID, childStart, childEnd in iter_mkv_elements(f, contentStart, contentEnd):
+                if childID == MKV_SAMPLING_FREQUENCY:
+                    sampleRate = round(read_mkv_float(f, childStart, childEnd))
+                elif childID == MKV_CHANNELS:
+                    channels = read_mkv_uint(f, childStart, childEnd)
+    if trackType == 1:
+        return {'type': 'video'}
+    elif trackType == 2:
+        return {'type': 'audio', 'channels': channels, 'sample_rate': sampleRate}
+    return None
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+# Mixing canvas for the final audio track
+# pydub's overlay() builds a whole new AudioSegment the length of the video for every clip placed on it, so placing every clip takes
+# time and memory proportional to the number of lines times the length of the track. This canvas is a single numpy array allocated once,
+# and each clip is added into it in place at its sample offset, which only touches the samples the clip covers.
+# Samples are added up as float32 so overlapping clips can go past the 16 bit range while mixing, and are only brought back into range
+# once, when the finished track is converted back to 16 bit audio (see CLIPPING_MODES)
+
+import numpy
+from pydub import AudioSegment
+
+SAMPLE_WIDTH = 2 # The finished track is 16 bit, the same as pydub's silent canvas
+MAX_SAMPLE_VALUE = 32767
+MIN_SAMPLE_VALUE = -32768
+
+# clip: Samples out of range are cut off, which is what pydub's overlay() did each time clips overlapped
+# normalize: If any sample is out of range, the whole track is turned down just enough to fit, so nothing is distorted
+CLIPPING_MODES = ('clip', 'normalize')
+
+
+class MixingCanvas:
+    def __init__(self, durationMs, sampleRate=24000, channels=1):
+        self.sampleRate = sampleRate
+        self.channels = channels
+        self.frameCount = self.get_frame_offset(durationMs)
+        self.samples = numpy.zeros((self.frameCount, channels), dtype=numpy.float32)
+        self.clippedSamples = 0 # How many samples were out of range when the track was last converted to 16 bit
+
+    # Same rounding as pydub uses to turn milliseconds into a frame position
+    def get_frame_offset(self, positionMs):
+        return int(positionMs * self.sampleRate / 1000.0)
+
+    # samples: 16 bit sample values at the canvas's sample rate, with one column per channel, or a flat array for mono audio
+    # Anything past the end of the canvas is left out, as with pydub's overlay()
+    def add_samples(self, samples, startMs):
+        samples = numpy.asarray(samples)
+        if samples.ndim == 1:
+            samples = samples.reshape(-1, 1)
+        if samples.shape[1] != self.channels:
+            raise ValueError(f"Clip has {samples.shape[1]} channels, but the canvas has {self.channels}")
+        start = max(self.get_frame_offset(startMs), 0)
+        end = min(start + len(samples), self.frameCount)
+        if end > start:
+            self.samples[start:end] += samples[:end - start]
+
+    def add_segment(self, segment, startMs):
+        if segment.frame_rate != self.sampleRate:
+            segment = segment.set_frame_rate(self.sampleRate)
+        if segment.channels != self.channels:
+            segment = segment.set_channels(self.channels)
+        if segment.sample_width != SAMPLE_WIDTH:
+            segment = segment.set_sample_width(SAMPLE_WIDTH)
+        self.add_samples(numpy.frombuffer(segment.raw_data, dtype='<i2').reshape(-1, self.channels), startMs)
+
+    # Returns the mixed track as 16 bit samples, bringing any samples out of range back into it with the given clipping mode
+    def to_samples(self, clipping='clip'):
+        if clipping not in CLIPPING_MODES:
+            raise ValueError(f"Unknown clipping mode '{clipping}'. Use one of: {', '.join(CLIPPING_MODES)}")
+        mixed = self.samples
+        self.clippedSamples = int(numpy.count_nonzero((mixed > MAX_SAMPLE_VALUE) | (mixed < MIN_SAMPLE_VALUE)))
+        if clipping == 'normalize' and self.clippedSamples:
+            peak = float(numpy.max(numpy.abs(mixed)))
+            mixed = mixed * (MAX_SAMPLE_VALUE / peak)
+        return numpy.clip(numpy.rint(mixed), MIN_SAMPLE_VALUE, MAX_SAMPLE_VALUE).astype('<i2')
+
+    def to_segment(self, clipping='clip'):
+        samples = self.to_samples(clipping)
+        return AudioSegment(data=samples.tobytes(), sample_width=SAMPLE_WIDTH, frame_rate=self.sampleRate, channels=self.channels)
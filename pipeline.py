@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+# Runs the processing stages of multiple languages at the same time, like an assembly line
+# Each stage (translate, synthesize, build) has its own thread, and languages are passed from one stage to the next through bounded queues
+# So while one language is being built, the next can be synthesizing and the one after that translating
+
+import queue
+import threading
+import time
+import traceback
+
+# Put in a queue to tell the next stage there are no more languages coming
+_END_OF_QUEUE = object()
+
+
+class PipelineItem:
+    # Holds one language as it moves through the stages
+    __slots__ = ('langNum', 'langSettings', 'data', 'error', 'stageSeconds')
+
+    def __init__(self, langNum, langSettings):
+        self.langNum = langNum
+        self.langSettings = langSettings
+        self.data = None # Whatever the previous stage returned, such as the subs dictionary
+        self.error = None
+        self.stageSeconds = {}
+
+
+def _run_stage(stageName, stageFunction, inputQueue, outputQueue):
+    while True:
+        item = inputQueue.get()
+        if item is _END_OF_QUEUE:
+            if outputQueue is not None:
+                outputQueue.put(_END_OF_QUEUE)
+            return
+
+        # If an earlier stage failed for this language, just pass it along so it still shows up in the results
+        if item.error is None:
+            startTime = time.perf_counter()
+            try:
+                item.data = stageFunction(item)
+            except Exception as ex:
+                item.error = f"{stageName}: {type(ex).__name__}: {ex}"
+                traceback.print_exc()
+            item.stageSeconds[stageName] = time.perf_counter() - startTime
+
+        if outputQueue is not None:
+            # Blocks if the next stage is still busy and its queue is full, which keeps memory use capped
+            outputQueue.put(item)
+
+
+def run_pipeline(languages, stages, queueSize=1):
+    # languages: Dictionary of language number -> settings, like batchSettings in main.py
+    # stages: List of (name, function) tuples in order. Each function takes a PipelineItem and returns the new value for item.data
+    #   > The last stage should return something small, because its result is kept until every language is finished
+    # queueSize: How many finished languages can wait in front of each stage
+    items = [PipelineItem(langNum, langSettings) for langNum, langSettings in languages.items()]
+
+    # One queue in front of each stage. The first one holds every language so it is unbounded, the rest are bounded
+    queues = [queue.Queue()] + [queue.Queue(maxsize=queueSize) for _ in range(len(stages) - 1)]
+    threads = []
+    for i, (stageName, stageFunction) in enumerate(stages):
+        outputQueue = queues[i + 1] if i + 1 < len(queues) else None
+        thread = threading.Thread(target=_run_stage, args=(stageName, stageFunction, queues[i], outputQueue), name=f'pipeline-{stageName}', daemon=True)
+        thread.start()
+        threads.append(thread)
+
+    for item in items:
+        queues[0].put(item)
+    queues[0].put(_END_OF_QUEUE)
+
+    for thread in threads:
+        thread.join()
+    return items
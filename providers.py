@@ -0,0 +1,449 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+# Translation and speech synthesis providers
+# Every call to a translation or TTS service goes through one of the provider objects here, chosen by translate_service and tts_service
+# in cloud_service_settings.ini. Besides the real Google and Azure services, there are fake providers that need no credentials or network:
+#   >  fake: Runs in the same process. Returns deterministic translations and generated audio clips
+#   >  http: Talks to the local stand-in server in benchmarks/provider_server.py, which uses the same fake responses over real HTTP
+# Both fakes can simulate latency, random errors and rate limits, which is useful for measuring and tuning the program's throughput
+
+import abc
+import base64
+import io
+import json
+import os
+import random
+import re
+import threading
+import time
+import zipfile
+
+# Services that can be used for each type of provider
+TRANSLATION_SERVICES = ('google', 'fake', 'http')
+SPEECH_SERVICES = ('google', 'azure', 'fake', 'http')
+BATCH_SPEECH_SERVICES = ('azure', 'fake', 'http')
+
+# Speaking speed of the fake voice at a speed factor of 1.0
+FAKE_MS_PER_CHARACTER = 60
+# Silence added before and after the fake speech, so the clips have something to trim like real ones
+FAKE_SILENCE_MS = 50
+
+
+# A request to a provider failed in a way that is worth retrying
+class ProviderError(Exception):
+    pass
+
+# The provider rejected a request because too many were sent
+class RateLimitError(ProviderError):
+    def __init__(self, message, retryAfterSeconds=1.0):
+        super().__init__(message)
+        self.retryAfterSeconds = retryAfterSeconds
+
+
+# Calls function, and tries again if it raises a ProviderError. Waits longer after each failure, or as long as the provider asked after a rate limit
+def call_with_retries(function, *args, maxAttempts=5, **kwargs):
+    for attempt in range(1, maxAttempts + 1):
+        try:
+            return function(*args, **kwargs)
+        except RateLimitError as rx:
+            if attempt == maxAttempts:
+                raise
+            time.sleep(rx.retryAfterSeconds)
+        except ProviderError:
+            if attempt == maxAttempts:
+                raise
+            time.sleep(min(0.1 * (2 ** attempt), 5))
+
+# Translates texts with the provider, and raises a ProviderError if it didn't return one translation for each text, so the request is retried
+# Otherwise the missing lines would only fail much later, when the translations are put back together
+def translate_texts(translationProvider, texts, sourceLanguage, targetLanguage, config, mimeType='text/plain'):
+    translations = translationProvider.translate(texts, sourceLanguage, targetLanguage, config, mimeType=mimeType)
+    if len(translations) != len(texts):
+        raise ProviderError(f'Sent {len(texts)} texts to translate, but got {len(translations)} translations back')
+    return translations
+
+
+# ------------------------------------------------------------------------------------------------------------------------------
+# Base classes. A provider that is missing one of the abstract methods fails as soon as it is created, instead of partway through a job
+# ------------------------------------------------------------------------------------------------------------------------------
+
+class TranslationProvider(abc.ABC):
+    # Returns the translations of texts, in the same order
+    @abc.abstractmethod
+    def translate(self, texts, sourceLanguage, targetLanguage, config, mimeType='text/plain'):
+        pass
+
+class SpeechProvider(abc.ABC):
+    # File extension of the clips, which also tells audio_builder how to read them
+    clipExtension = 'mp3'
+
+    # Returns the audio of one line of text as bytes
+    @abc.abstractmethod
+    def synthesize(self, text, speedFactor, langDict, config):
+        pass
+
+    def synthesize_to_file(self, text, speedFactor, langDict, config, filePath):
+        audio = self.synthesize(text, speedFactor, langDict, config)
+        with open(filePath, 'wb') as out:
+            out.write(audio)
+
+class BatchSpeechProvider(abc.ABC):
+    clipExtension = 'mp3'
+    # How long to wait before first checking the status of a job. The wait grows each time the job is still running, up to maxPollIntervalSeconds
+    pollIntervalSeconds = 5
+    maxPollIntervalSeconds = 30
+
+    # Takes an Azure style batch synthesis payload and returns the job ID, or None if it couldn't be submitted
+    @abc.abstractmethod
+    def submit(self, payload, config):
+        pass
+
+    # Returns the job's status json as a dictionary, or None if it couldn't be retrieved
+    @abc.abstractmethod
+    def get_status(self, jobId, config):
+        pass
+
+    # Returns the bytes of the zip file with the results
+    @abc.abstractmethod
+    def download_result(self, url):
+        pass
+
+    # Saves the zip file with the results to filePath
+    def download_result_to_file(self, url, filePath):
+        with open(filePath, 'wb') as out:
+            out.write(self.download_result(url))
+
+
+# Saves a download to a file a chunk at a time, so large result files are never held in memory all at once
+# Written to a temporary name first, so a partly downloaded file is never mistaken for a finished one
+DOWNLOAD_CHUNK_BYTES = 1024 * 1024
+
+def download_url_to_file(url, filePath, timeout=60):
+    from urllib.request import urlopen
+    temporaryPath = f"{filePath}.{threading.get_ident()}.part"
+    with urlopen(url, timeout=timeout) as response, open(temporaryPath, 'wb') as out:
+        while True:
+            chunk = response.read(DOWNLOAD_CHUNK_BYTES)
+            if not chunk:
+                break
+            out.write(chunk)
+    os.replace(temporaryPath, filePath)
+
+
+# ------------------------------------------------------------------------------------------------------------------------------
+# Real services. The API code itself is in TTS.py, azure_batch.py and auth.py, these just adapt it to the provider interface
+# ------------------------------------------------------------------------------------------------------------------------------
+
+class GoogleTranslationProvider(TranslationProvider):
+    def translate(self, texts, sourceLanguage, targetLanguage, config, mimeType='text/plain'):
+        import auth
+        response = auth.get_translate_api().projects().translateText(
+            parent='projects/' + config.googleProjectID,
+            body={
+                'contents': texts,
+                'sourceLanguageCode': sourceLanguage,
+                'targetLanguageCode': targetLanguage,
+                'mimeType': mimeType,
+                #'model': 'nmt',
+                #'glossaryConfig': {}
+            }
+        ).execute(http=auth.get_thread_http()) # Each thread uses its own connection
+        return [translation['translatedText'] for translation in response['translations']]
+
+# With pcm_synthesis, the real services return uncompressed wav clips instead of mp3
+class GoogleSpeechProvider(SpeechProvider):
+    def __init__(self, pcmSynthesis=False):
+        self.clipExtension = 'wav' if pcmSynthesis else 'mp3'
+
+    def synthesize(self, text, speedFactor, langDict, config):
+        import TTS
+        sampleRate = config.nativeSampleRate if config.pcmSynthesis else None
+        return TTS.synthesize_text_google(text, speedFactor, langDict['voiceName'], langDict['voiceGender'], langDict['languageCode'], TTS.get_google_audio_encoding(config), sampleRate)
+
+class AzureSpeechProvider(SpeechProvider):
+    def __init__(self, pcmSynthesis=False):
+        self.clipExtension = 'wav' if pcmSynthesis else 'mp3'
+
+    def synthesize(self, text, speedFactor, langDict, config):
+        import TTS
+        stream = TTS.synthesize_text_azure(text, speedFactor, langDict['voiceName'], langDict['languageCode'], config)
+        audioFile = io.BytesIO()
+        # AudioDataStream only saves directly to a file, so read its data into memory instead
+        buffer = bytearray(32000)
+        while True:
+            filledSize = stream.read_data(buffer)
+            if filledSize == 0:
+                break
+            audioFile.write(buffer[:filledSize])
+        return audioFile.getvalue()
+
+class AzureBatchSpeechProvider(BatchSpeechProvider):
+    def __init__(self, pcmSynthesis=False):
+        self.clipExtension = 'wav' if pcmSynthesis else 'mp3'
+
+    def submit(self, payload, config):
+        import azure_batch
+        return azure_batch.submit_synthesis(payload, config)
+
+    def get_status(self, jobId, config):
+        import azure_batch
+        response = azure_batch.get_synthesis(jobId, config)
+        if response is None:
+            return None
+        return response.json()
+
+    def download_result(self, url):
+        from urllib.request import urlopen
+        return urlopen(url).read()
+
+    def download_result_to_file(self, url, filePath):
+        download_url_to_file(url, filePath)
+
+
+# ------------------------------------------------------------------------------------------------------------------------------
+# Fakes
+# ------------------------------------------------------------------------------------------------------------------------------
+
+# Simulates the latency, errors and rate limits of a real service. Shared by the in-process fakes and the local stand-in server
+class FakeServiceBehavior:
+    def __init__(self, latencyMs=0, errorRate=0.0, requestsPerSecond=0, seed=0):
+        self.latencyMs = latencyMs
+        self.errorRate = errorRate
+        # 0 means no limit
+        self.requestsPerSecond = requestsPerSecond
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.recentRequestTimes = []
+        self.requestCount = 0
+        self.rejectedCount = 0
+
+    # Call at the start of every simulated request. Raises RateLimitError or ProviderError the same way a real service would fail
+    def begin_request(self):
+        with self.lock:
+            self.requestCount += 1
+            now = time.monotonic()
+            if self.requestsPerSecond > 0:
+                # Only keep requests from the last second
+                self.recentRequestTimes = [t for t in self.recentRequestTimes if now - t < 1.0]
+                if len(self.recentRequestTimes) >= self.requestsPerSecond:
+                    self.rejectedCount += 1
+                    retryAfterSeconds = 1.0 - (now - self.recentRequestTimes[0])
+                    raise RateLimitError('Simulated rate limit exceeded', retryAfterSeconds=max(retryAfterSeconds, 0.01))
+                self.recentRequestTimes.append(now)
+            failed = self.errorRate > 0 and self.random.random() < self.errorRate
+
+        if self.latencyMs > 0:
+            time.sleep(self.latencyMs / 1000)
+        if failed:
+            with self.lock:
+                self.rejectedCount += 1
+            raise ProviderError('Simulated server error')
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.fakeLatencyMs, config.fakeErrorRate, config.fakeRequestsPerSecond)
+
+
+def fake_translate_text(text, targetLanguage):
+    return f"[{targetLanguage}] {text}"
+
+# Creates a mono 16 bit wav clip of a tone, whose length depends on the length of the text and the speed factor, like real speech
+def make_fake_clip(text, speedFactor=1.0, sampleRate=24000):
+    import numpy
+    speechMs = max(len(text), 1) * FAKE_MS_PER_CHARACTER / max(speedFactor, 0.01)
+    speechSamples = int(sampleRate * speechMs / 1000)
+    silenceSamples = int(sampleRate * FAKE_SILENCE_MS / 1000)
+    # Pick a pitch from the text, so the same text always gives the same clip
+    frequency = 200 + (sum(text.encode('utf-8')) % 300)
+    tone = 0.3 * numpy.sin(2 * numpy.pi * frequency * numpy.arange(speechSamples) / sampleRate)
+    samples = numpy.concatenate([numpy.zeros(silenceSamples), tone, numpy.zeros(silenceSamples)])
+    return make_wav_bytes((samples * 32767).astype('<i2').tobytes(), sampleRate)
+
+def make_wav_bytes(pcmBytes, sampleRate, channels=1, sampleWidth=2):
+    import wave
+    wavFile = io.BytesIO()
+    with wave.open(wavFile, 'wb') as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(sampleWidth)
+        wav.setframerate(sampleRate)
+        wav.writeframes(pcmBytes)
+    return wavFile.getvalue()
+
+# Gets the text and speed factor back out of the SSML that TTS.py creates for Azure
+ssmlRateRegex = re.compile(r"<prosody rate='([+-]?[0-9.]+)%'>")
+ssmlTagRegex = re.compile(r'<[^>]+>')
+
+def parse_ssml(ssml):
+    rateMatch = ssmlRateRegex.search(ssml)
+    speedFactor = 1.0 + float(rateMatch.group(1)) / 100 if rateMatch else 1.0
+    return ssmlTagRegex.sub('', ssml), speedFactor
+
+# Creates a zip file like the one Azure returns for a batch synthesis job: 0001.wav, 0002.wav ... and summary.json
+def make_fake_batch_result(payload, sampleRate=24000):
+    zipBytes = io.BytesIO()
+    summary = {'results': []}
+    with zipfile.ZipFile(zipBytes, 'w', zipfile.ZIP_STORED) as zipFile:
+        for num, item in enumerate(payload['inputs'], start=1):
+            text, speedFactor = parse_ssml(item['text'])
+            fileName = f'{num:04d}.wav'
+            zipFile.writestr(fileName, make_fake_clip(text, speedFactor, sampleRate))
+            summary['results'].append({'texts': [item['text']], 'status': 'Succeeded', 'audioFileName': fileName})
+        zipFile.writestr('summary.json', json.dumps(summary))
+    return zipBytes.getvalue()
+
+
+class FakeTranslationProvider(TranslationProvider):
+    def __init__(self, behavior):
+        self.behavior = behavior
+
+    def translate(self, texts, sourceLanguage, targetLanguage, config, mimeType='text/plain'):
+        self.behavior.begin_request()
+        return [fake_translate_text(text, targetLanguage) for text in texts]
+
+class FakeSpeechProvider(SpeechProvider):
+    clipExtension = 'wav'
+
+    def __init__(self, behavior):
+        self.behavior = behavior
+
+    def synthesize(self, text, speedFactor, langDict, config):
+        self.behavior.begin_request()
+        return make_fake_clip(text, speedFactor, config.nativeSampleRate)
+
+class FakeBatchSpeechProvider(BatchSpeechProvider):
+    clipExtension = 'wav'
+    pollIntervalSeconds = 0.05
+    maxPollIntervalSeconds = 0.5
+
+    def __init__(self, behavior):
+        self.behavior = behavior
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, payload, config):
+        self.behavior.begin_request()
+        # Like Azure, the job also takes a while to finish after it is submitted
+        with self.lock:
+            jobId = f'fake-job-{len(self.jobs) + 1}'
+            self.jobs[jobId] = {'payload': payload, 'readyTime': time.monotonic() + self.behavior.latencyMs / 1000, 'sampleRate': config.nativeSampleRate}
+        return jobId
+
+    def get_status(self, jobId, config):
+        job = self.jobs[jobId]
+        if time.monotonic() < job['readyTime']:
+            return {'id': jobId, 'status': 'Running'}
+        return {'id': jobId, 'status': 'Succeeded', 'outputs': {'result': f'fake://{jobId}'}}
+
+    def download_result(self, url):
+        job = self.jobs[url[len('fake://'):]]
+        return make_fake_batch_result(job['payload'], job['sampleRate'])
+
+
+# ------------------------------------------------------------------------------------------------------------------------------
+# Local HTTP stand-in. The server side is in benchmarks/provider_server.py
+# ------------------------------------------------------------------------------------------------------------------------------
+
+class LocalServerClient:
+    def __init__(self, baseUrl):
+        self.baseUrl = baseUrl.rstrip('/')
+
+    def request(self, method, path, data=None):
+        from urllib.request import Request, urlopen
+        from urllib.error import HTTPError
+        body = json.dumps(data).encode('utf-8') if data is not None else None
+        request = Request(self.baseUrl + path, data=body, method=method, headers={'Content-Type': 'application/json'})
+        try:
+            with urlopen(request, timeout=60) as response:
+                return response.read()
+        except HTTPError as hx:
+            if hx.code == 429:
+                raise RateLimitError('Rate limited by local server', retryAfterSeconds=float(hx.headers.get('Retry-After', 1)))
+            if hx.code >= 500:
+                raise ProviderError(f'Local server error {hx.code}')
+            raise
+
+    def request_json(self, method, path, data=None):
+        return json.loads(self.request(method, path, data))
+
+class HttpTranslationProvider(TranslationProvider):
+    def __init__(self, client):
+        self.client = client
+
+    def translate(self, texts, sourceLanguage, targetLanguage, config, mimeType='text/plain'):
+        response = self.client.request_json('POST', '/translate', {'contents': texts, 'sourceLanguageCode': sourceLanguage, 'targetLanguageCode': targetLanguage, 'mimeType': mimeType})
+        return [translation['translatedText'] for translation in response['translations']]
+
+class HttpSpeechProvider(SpeechProvider):
+    clipExtension = 'wav'
+
+    def __init__(self, client):
+        self.client = client
+
+    def synthesize(self, text, speedFactor, langDict, config):
+        response = self.client.request_json('POST', '/synthesize', {'text': text, 'speakingRate': speedFactor, 'voiceName': langDict['voiceName'], 'languageCode': langDict['languageCode'], 'sampleRate': config.nativeSampleRate})
+        return base64.b64decode(response['audioContent'])
+
+class HttpBatchSpeechProvider(BatchSpeechProvider):
+    clipExtension = 'wav'
+    pollIntervalSeconds = 0.05
+    maxPollIntervalSeconds = 0.5
+
+    def __init__(self, client):
+        self.client = client
+
+    def submit(self, payload, config):
+        return self.client.request_json('POST', f'/batchsynthesis?sampleRate={config.nativeSampleRate}', payload)['id']
+
+    def get_status(self, jobId, config):
+        return self.client.request_json('GET', f'/batchsynthesis/{jobId}')
+
+    def download_result(self, url):
+        from urllib.request import urlopen
+        return urlopen(url, timeout=60).read()
+
+    def download_result_to_file(self, url, filePath):
+        download_url_to_file(url, filePath)
+
+
+# ------------------------------------------------------------------------------------------------------------------------------
+# Getting the provider for the current config
+# ------------------------------------------------------------------------------------------------------------------------------
+
+# Providers are created once per process, so the fakes keep their rate limit state between calls
+_providers = {}
+_providersLock = threading.Lock()
+
+def get_provider(kind, service, config):
+    providerKey = (kind, service, config.pcmSynthesis)
+    with _providersLock:
+        if providerKey not in _providers:
+            _providers[providerKey] = create_provider(kind, service, config)
+        return _providers[providerKey]
+
+def create_provider(kind, service, config):
+    if service == 'fake':
+        # Each kind of fake has its own limits, like separate services would
+        behavior = FakeServiceBehavior.from_config(config)
+        return {'translate': FakeTranslationProvider, 'speech': FakeSpeechProvider, 'batch': FakeBatchSpeechProvider}[kind](behavior)
+    if service == 'http':
+        client = LocalServerClient(config.providerServerUrl)
+        return {'translate': HttpTranslationProvider, 'speech': HttpSpeechProvider, 'batch': HttpBatchSpeechProvider}[kind](client)
+    if kind == 'translate' and service == 'google':
+        return GoogleTranslationProvider()
+    if kind == 'speech' and service == 'google':
+        return GoogleSpeechProvider(config.pcmSynthesis)
+    if kind == 'speech' and service == 'azure':
+        return AzureSpeechProvider(config.pcmSynthesis)
+    if kind == 'batch' and service == 'azure':
+        return AzureBatchSpeechProvider(config.pcmSynthesis)
+    raise ValueError(f'Unsupported service for {kind}: {service}')
+
+def get_translation_provider(config):
+    return get_provider('translate', config.translateService, config)
+
+def get_speech_provider(config):
+    return get_provider('speech', config.ttsService, config)
+
+def get_batch_speech_provider(config):
+    return get_provider('batch', config.ttsService, config)
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+# Rate limiting and request timing for the TTS services
+# Each service and voice type has its own quota (For example Google allows far fewer requests per minute for Neural2 voices than Standard ones)
+# A token bucket for each one lets requests be sent from many threads at once while staying right at the quota, instead of hitting it and waiting
+
+import threading
+import time
+
+# Default requests per minute for each service and voice type. 0 means no limit
+# Can be overridden for all voices with tts_requests_per_minute in config.ini
+DEFAULT_REQUESTS_PER_MINUTE = {
+    ('google', 'neural2'): 100,
+    ('google', 'studio'): 100,
+    ('google', 'polyglot'): 100,
+    ('google', 'news'): 100,
+    ('google', 'journey'): 100,
+    ('google', 'wavenet'): 1000,
+    ('google', 'standard'): 1000,
+    ('google', 'other'): 100,
+    ('azure', 'neural'): 12000, # 200 per second on the standard (S0) tier
+}
+
+GOOGLE_VOICE_TIERS = ('neural2', 'studio', 'polyglot', 'news', 'journey', 'wavenet', 'standard')
+
+
+class TokenBucket:
+    # ratePerSecond: How many tokens are added per second. 0 means no limit
+    # capacity: Most tokens that can be saved up. At 1, requests are spread out evenly instead of sent in bursts
+    def __init__(self, ratePerSecond, capacity=1.0):
+        self.ratePerSecond = ratePerSecond
+        self.capacity = capacity
+        self.tokens = capacity
+        self.lastRefill = time.monotonic()
+        self.lock = threading.Lock()
+
+    # Blocks until a token is available, then uses it. Returns how many seconds it waited
+    def acquire(self):
+        if self.ratePerSecond <= 0:
+            return 0.0
+        waitedSeconds = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.lastRefill) * self.ratePerSecond)
+                self.lastRefill = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waitedSeconds
+                waitSeconds = (1 - self.tokens) / self.ratePerSecond
+            time.sleep(waitSeconds)
+            waitedSeconds += waitSeconds
+
+
+# Records how long each request took, and how long requests waited for the rate limiter, from any thread
+class LatencyStats:
+    def __init__(self):
+        self.latencies = []
+        self.rateLimitWaitSeconds = 0.0
+        self.lock = threading.Lock()
+        self.startTime = time.perf_counter()
+
+    def add(self, seconds):
+        with self.lock:
+            self.latencies.append(seconds)
+
+    def add_rate_limit_wait(self, seconds):
+        with self.lock:
+            self.rateLimitWaitSeconds += seconds
+
+    def percentile(self, fraction):
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def summary(self):
+        if not self.latencies:
+            return "No requests"
+        count = len(self.latencies)
+        totalSeconds = time.perf_counter() - self.startTime
+        return (f"{count} requests in {totalSeconds:.1f}s ({count / totalSeconds * 60:.0f}/min) - Latency: "
+                f"avg {sum(self.latencies) / count * 1000:.0f}ms, p50 {self.percentile(0.5) * 1000:.0f}ms, "
+                f"p95 {self.percentile(0.95) * 1000:.0f}ms, max {max(self.latencies) * 1000:.0f}ms - "
+                f"Waited for rate limit: {self.rateLimitWaitSeconds:.1f}s in total")
+
+
+def get_voice_tier(service, voiceName):
+    if service == 'google':
+        voiceNameLower = voiceName.lower()
+        for tier in GOOGLE_VOICE_TIERS:
+            if tier in voiceNameLower:
+                return tier
+        return 'other'
+    if service == 'azure':
+        return 'neural'
+    return service
+
+def get_requests_per_minute(service, tier, config):
+    if config.ttsRequestsPerMinute > 0:
+        return config.ttsRequestsPerMinute
+    if service == 'fake':
+        return config.fakeRequestsPerSecond * 60
+    return DEFAULT_REQUESTS_PER_MINUTE.get((service, tier), 0)
+
+
+# One bucket per service and voice type for the whole process, so languages synthesizing at the same time share the quota
+_buckets = {}
+_bucketsLock = threading.Lock()
+
+def get_tts_limiter(config, voiceName):
+    service = config.ttsService
+    tier = get_voice_tier(service, voiceName)
+    with _bucketsLock:
+        if (service, tier) not in _buckets:
+            _buckets[(service, tier)] = TokenBucket(get_requests_per_minute(service, tier, config) / 60)
+        return _buckets[(service, tier)]
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+# Loads config.ini, cloud_service_settings.ini and batch.ini into a single typed object
+# Nothing is read when this module is imported. Call load_config() to read the files, or get_config() to read them only the first time
+# The resulting Config object is then passed to the functions that need it
+
+import configparser
+import os
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+from utils import parseBool
+
+CONFIG_FILE = 'config.ini'
+CLOUD_CONFIG_FILE = 'cloud_service_settings.ini'
+BATCH_CONFIG_FILE = 'batch.ini'
+
+# Options that must exist in every [LANGUAGE-#] section of batch.ini that is enabled
+REQUIRED_LANGUAGE_OPTIONS = ('synth_language_code', 'synth_voice_name', 'translation_target_language', 'synth_voice_gender')
+
+
+@dataclass
+class Config:
+    # ---------- config.ini ----------
+    skipTranslation: bool = False
+    skipSynthesize: bool = False
+    originalLanguage: str = 'en-US'
+    outputFormat: str = 'aac'
+    mixClipping: str = 'clip'
+    audioEncoding: str = 'MP3'
+    nativeSampleRate: int = 24000
+    pcmSynthesis: bool = False
+    twoPassVoiceSynth: bool = True
+    forceTwoPassStretch: bool = False
+    speakingRateCalibration: bool = True
+    speakingRateTolerancePercent: float = 5.0
+    speakingRateMinSamples: int = 30
+    trimSilenceThresholdDb: float = -50.0
+    trimSilenceChunkMs: int = 10
+    azureSentencePause: str = 'default'
+    addBufferMilliseconds: int = 0
+    combineMaxChars: int = 200
+    combineAlgorithm: str = 'linear'
+    useTranslationMemory: bool = True
+    maxTranslationRequests: int = 4
+    translateTitleDescription: bool = False
+    maxTtsRequests: int = 8
+    ttsRequestsPerMinute: int = 0
+    ttsCacheMaxMb: int = 2000
+    streamingAudioBuild: bool = False
+    parallelLanguages: bool = False
+    maxParallelLanguages: int = 0
+    maxStretchWorkers: int = 0
+    pipelineLanguages: bool = False
+    pipelineQueueSize: int = 1
+    debugMode: bool = False
+
+    # ---------- cloud_service_settings.ini ----------
+    ttsService: str = 'google'
+    translateService: str = 'google'
+    googleProjectID: str = ''
+    azureSpeechKey: str = ''
+    azureSpeechRegion: str = ''
+    batchSynthesize: bool = False
+    azureSynthesizerPoolSize: int = 4
+    # Only used by the fake providers, see providers.py
+    fakeLatencyMs: int = 0
+    fakeErrorRate: float = 0.0
+    fakeRequestsPerSecond: int = 0
+    providerServerUrl: str = 'http://127.0.0.1:8765'
+
+    # ---------- batch.ini ----------
+    originalVideoFile: str = ''
+    srtFile: str = ''
+    languageNums: List[str] = field(default_factory=list)
+    # Language number -> dictionary of the settings in its [LANGUAGE-#] section
+    batchSettings: Dict[str, Dict[str, str]] = field(default_factory=dict)
+
+    # ---------- Folders ----------
+    outputFolder: str = 'output'
+    workingFolder: str = 'workingFolder'
+    # Kept between runs, unlike the working folder which can be cleared
+    cacheFolder: str = 'cache'
+
+
+def load_config(configFile=CONFIG_FILE, cloudConfigFile=CLOUD_CONFIG_FILE, batchConfigFile=BATCH_CONFIG_FILE):
+    config = configparser.ConfigParser()
+    config.read(configFile)
+    cloudConfig = configparser.ConfigParser()
+    cloudConfig.read(cloudConfigFile)
+    batchConfig = configparser.ConfigParser()
+    batchConfig.read(batchConfigFile)
+
+    settings = config['SETTINGS']
+    cloud = cloudConfig['CLOUD']
+
+    # Get list of languages to process
+    languageNums = batchConfig['SETTINGS']['enabled_languages'].replace(' ','').split(',')
+    batchSettings = load_language_settings(batchConfig, languageNums)
+
+    return Config(
+        skipTranslation = parseBool(settings['skip_translation']),
+        skipSynthesize = parseBool(settings['skip_synthesize']),
+        originalLanguage = settings['original_language'],
+        outputFormat = settings['output_format'].lower(),
+        mixClipping = settings.get('mix_clipping', 'clip').lower().strip(),
+        audioEncoding = settings['synth_audio_encoding'].upper(),
+        nativeSampleRate = int(settings['synth_sample_rate']),
+        pcmSynthesis = parseBool(settings.get('pcm_synthesis', 'False')),
+        twoPassVoiceSynth = parseBool(settings['two_pass_voice_synth']),
+        forceTwoPassStretch = parseBool(settings['force_stretch_with_twopass']),
+        speakingRateCalibration = parseBool(settings.get('speaking_rate_calibration', 'True')),
+        speakingRateTolerancePercent = float(settings.get('speaking_rate_tolerance_percent', '5')),
+        speakingRateMinSamples = int(settings.get('speaking_rate_min_samples', '30')),
+        trimSilenceThresholdDb = float(settings.get('trim_silence_threshold_db', '-50')),
+        trimSilenceChunkMs = int(settings.get('trim_silence_chunk_ms', '10')),
+        azureSentencePause = settings['azure_sentence_pause'].lower().strip("\"").strip("\'"),
+        addBufferMilliseconds = int(settings['add_line_buffer_milliseconds']),
+        combineMaxChars = int(settings['combine_subtitles_max_chars']),
+        combineAlgorithm = settings.get('combine_subtitles_algorithm', 'linear').lower().strip(),
+        useTranslationMemory = parseBool(settings.get('translation_memory', 'True')),
+        maxTranslationRequests = int(settings.get('max_concurrent_translation_requests', '4')),
+        translateTitleDescription = parseBool(settings.get('translate_title_description', 'False')),
+        maxTtsRequests = int(settings.get('max_concurrent_tts_requests', '8')),
+        ttsRequestsPerMinute = int(settings.get('tts_requests_per_minute', '0')),
+        ttsCacheMaxMb = int(settings.get('tts_cache_max_mb', '2000')),
+        streamingAudioBuild = parseBool(settings.get('streaming_audio_build', 'False')),
+        parallelLanguages = parseBool(settings.get('parallel_languages', 'False')),
+        maxParallelLanguages = int(settings.get('max_parallel_languages', '0')),
+        maxStretchWorkers = int(settings.get('max_stretch_workers', '0')),
+        pipelineLanguages = parseBool(settings.get('pipeline_languages', 'False')),
+        pipelineQueueSize = int(settings.get('pipeline_queue_size', '1')),
+        debugMode = parseBool(settings['debug_mode']),
+
+        ttsService = cloud['tts_service'].lower(),
+        googleProjectID = cloud['google_project_id'],
+        azureSpeechKey = cloud['azure_speech_key'],
+        azureSpeechRegion = cloud['azure_speech_region'],
+        batchSynthesize = parseBool(cloud['batch_tts_synthesize']),
+        azureSynthesizerPoolSize = int(cloud.get('azure_synthesizer_pool_size', '4')),
+        translateService = cloud.get('translate_service', 'google').lower(),
+        fakeLatencyMs = int(cloud.get('fake_latency_ms', '0')),
+        fakeErrorRate = float(cloud.get('fake_error_rate', '0')),
+        fakeRequestsPerSecond = int(cloud.get('fake_requests_per_second', '0')),
+        providerServerUrl = cloud.get('provider_server_url', 'http://127.0.0.1:8765'),
+
+        originalVideoFile = os.path.abspath(batchConfig['SETTINGS']['original_video_file_path'].strip("\"")),
+        srtFile = os.path.abspath(batchConfig['SETTINGS']['srt_file_path'].strip("\"")),
+        languageNums = languageNums,
+        batchSettings = batchSettings,
+    )
+
+
+def load_language_settings(batchConfig, languageNums):
+    # Validate the number of sections
+    for num in languageNums:
+        # Check if section exists
+        if not batchConfig.has_section(f'LANGUAGE-{num}'):
+            raise ValueError(f'Invalid language number in batch.ini: {num} - Make sure the section [LANGUAGE-{num}] exists')
+
+    # Validate the settings in each section
+    for num in languageNums:
+        for option in REQUIRED_LANGUAGE_OPTIONS:
+            if not batchConfig.has_option(f'LANGUAGE-{num}', option):
+                raise ValueError(f'Invalid configuration in batch.ini: {num} - Make sure the option "{option}" exists under [LANGUAGE-{num}]')
+
+    # Create a dictionary of the settings from each section
+    batchSettings = {}
+    for num in languageNums:
+        batchSettings[num] = {option: batchConfig[f'LANGUAGE-{num}'][option] for option in REQUIRED_LANGUAGE_OPTIONS}
+    return batchSettings
+
+
+# Config loaded by get_config(), so the files are only read once
+_loadedConfig = None
+
+def get_config():
+    global _loadedConfig
+    if _loadedConfig is None:
+        _loadedConfig = load_config()
+    return _loadedConfig
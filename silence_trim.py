@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+# Finds where the speech in a synthesized clip starts and ends, to trim the silence around it
+# pydub's detect_leading_silence() measures the clip in chunks of a few milliseconds one at a time in Python, and the trailing silence was found
+# by reversing the whole clip, trimming it, and reversing it back. Here the energy of every frame is added up once into a cumulative sum,
+# so the loudness of every chunk from either end comes from a few vectorized operations, and the result is just the two sample indexes to slice at.
+# Chunks are laid out and measured the same way pydub does, so the same threshold and chunk size find the same boundaries
+
+import numpy
+
+DEFAULT_THRESHOLD_DB = -50.0
+DEFAULT_CHUNK_MS = 10
+
+
+# Same rounding as pydub uses to turn milliseconds into a number of frames
+def ms_to_frames(positionMs, sampleRate):
+    return (numpy.asarray(positionMs) * sampleRate / 1000.0).astype(numpy.int64)
+
+# cumulativeEnergy[i] is the sum of the squares of every sample before frame i
+# For mono clips it is all done in one array, since allocating a second array the size of the clip takes longer than the sums themselves
+# The sums are float64, since the square of a single 32 bit sample can already fill an int64. For 16 bit clips they stay exact up to 2^53,
+# which is hours of audio, so they still match pydub's integer sums
+def get_cumulative_energy(samples):
+    cumulativeEnergy = numpy.empty(len(samples) + 1, dtype=numpy.float64)
+    cumulativeEnergy[0] = 0
+    if samples.ndim > 1 and samples.shape[1] > 1:
+        numpy.square(samples, dtype=numpy.float64).sum(axis=1, out=cumulativeEnergy[1:])
+    else:
+        numpy.square(samples.reshape(-1), out=cumulativeEnergy[1:], dtype=numpy.float64)
+    numpy.cumsum(cumulativeEnergy, out=cumulativeEnergy)
+    return cumulativeEnergy
+
+# Returns (milliseconds of silence at the start of frames [segmentStart, segmentEnd), length of the segment in milliseconds), or at its end if fromEnd is True
+# Frames from segmentEnd onwards count as silence even if the clip is longer, since pydub fills a slice that runs past the end with silence
+def count_silent_ms(cumulativeEnergy, segmentStart, segmentEnd, sampleRate, channels, maxAmplitude, thresholdDb, chunkMs, fromEnd=False):
+    lengthMs = round(1000 * ((segmentEnd - segmentStart) / sampleRate))
+    chunkStartsMs = numpy.arange(0, lengthMs, chunkMs, dtype=numpy.int64)
+    chunkStarts = ms_to_frames(chunkStartsMs, sampleRate)
+    chunkEnds = ms_to_frames(numpy.minimum(chunkStartsMs + chunkMs, lengthMs), sampleRate)
+    if fromEnd:
+        firstFrames, lastFrames = segmentEnd - chunkEnds, segmentEnd - chunkStarts
+    else:
+        firstFrames, lastFrames = segmentStart + chunkStarts, segmentStart + chunkEnds
+
+    # Only frames inside both the segment and the clip add energy, but every frame in the chunk counts towards the average
+    realEnd = min(segmentEnd, len(cumulativeEnergy) - 1)
+    chunkEnergy = cumulativeEnergy[numpy.clip(lastFrames, segmentStart, realEnd)] - cumulativeEnergy[numpy.clip(firstFrames, segmentStart, realEnd)]
+    sampleCounts = (chunkEnds - chunkStarts) * channels
+
+    # Root mean square rounded down, then compared in dBFS, the same as pydub's AudioSegment.dBFS
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        rms = numpy.floor(numpy.sqrt(chunkEnergy / numpy.maximum(sampleCounts, 1)))
+        loudness = 20 * numpy.log10(rms / maxAmplitude)
+    loudChunks = numpy.flatnonzero((rms > 0) & (loudness >= thresholdDb))
+    silentMs = int(chunkStartsMs[loudChunks[0]]) if len(loudChunks) else lengthMs
+    return silentMs, lengthMs
+
+# Returns the (start, end) sample indexes of the clip without its leading and trailing silence. Slice the samples with them to trim the clip
+# samples: Array of signed samples, with one column per channel or a flat array for mono audio. sampleWidth: Bytes per sample
+def find_speech_bounds(samples, sampleRate, sampleWidth=2, thresholdDb=DEFAULT_THRESHOLD_DB, chunkMs=DEFAULT_CHUNK_MS):
+    if chunkMs <= 0:
+        raise ValueError(f"Silence trimming chunk size must be more than 0 ms, not {chunkMs}")
+    channels = samples.shape[1] if samples.ndim > 1 else 1
+    maxAmplitude = float(2 ** (sampleWidth * 8 - 1))
+    frameCount = len(samples)
+    cumulativeEnergy = get_cumulative_energy(samples)
+
+    leadingMs, lengthMs = count_silent_ms(cumulativeEnergy, 0, frameCount, sampleRate, channels, maxAmplitude, thresholdDb, chunkMs)
+    # The trailing silence is measured on the clip with its leading silence cut off, which pydub ends at the clip's length rounded to the millisecond
+    start = int(ms_to_frames(leadingMs, sampleRate))
+    trimmedEnd = int(ms_to_frames(lengthMs, sampleRate))
+    trailingMs, trimmedLengthMs = count_silent_ms(cumulativeEnergy, start, trimmedEnd, sampleRate, channels, maxAmplitude, thresholdDb, chunkMs, fromEnd=True)
+    end = trimmedEnd - int(ms_to_frames(trailingMs, sampleRate))
+    start = max(start, trimmedEnd - int(ms_to_frames(trimmedLengthMs, sampleRate)))
+
+    start = min(start, frameCount)
+    return start, min(max(end, start), frameCount)
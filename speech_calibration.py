@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+# Speaking rate calibration: Learns how long each voice takes to say a given number of characters, from every clip that has been measured
+# Each clip's trimmed length is saved to an SQLite database in the cache folder, along with its number of characters and the speed it was synthesized at.
+# Once a voice has enough of them, a straight line fit (milliseconds = intercept + slope * characters, at normal speed) predicts how long a line
+# will be before it is synthesized. So the first pass can already be synthesized at about the right speed, and with two pass synthesis
+# only the lines whose first clip still ended up outside the tolerance are synthesized a second time.
+# Characters are used instead of syllables because they work the same way for every language, including ones without spaces between words
+
+import hashlib
+import os
+import sqlite3
+import threading
+
+DATABASE_FILE_NAME = 'speaking_rates.sqlite3'
+
+# Predicted speeds are rounded to this step, so small changes in the fit between runs don't change the requests, which would miss the clip cache
+SPEED_FACTOR_STEP = 0.02
+# Limits of the speaking rate the TTS services accept
+MIN_SPEED_FACTOR = 0.25
+MAX_SPEED_FACTOR = 4.0
+
+
+class VoiceRate:
+    # Straight line fit of natural (speed 1.0) clip length in milliseconds against number of characters
+    def __init__(self, samples, sumChars, sumMs, sumCharsSquared, sumCharsMs):
+        self.samples = samples
+        denominator = samples * sumCharsSquared - sumChars * sumChars
+        if samples > 1 and denominator > 0:
+            self.slope = (samples * sumCharsMs - sumChars * sumMs) / denominator
+            self.intercept = (sumMs - self.slope * sumChars) / samples
+        else:
+            self.slope = sumMs / sumChars if sumChars else 0.0
+            self.intercept = 0.0
+        # If every clip was about the same length the fit can come out backwards, so just use the average rate instead
+        if self.slope <= 0:
+            self.slope = sumMs / sumChars if sumChars else 0.0
+            self.intercept = 0.0
+
+    def predict_ms(self, characters):
+        return self.intercept + self.slope * characters
+
+    # Speed factor that should make a clip of this many characters last desiredMs. Same meaning as the speed factor from audio_builder.get_speed_factor()
+    def predict_speed_factor(self, characters, desiredMs):
+        speedFactor = self.predict_ms(characters) / max(float(desiredMs), 1.0)
+        speedFactor = round(speedFactor / SPEED_FACTOR_STEP) * SPEED_FACTOR_STEP
+        return round(min(max(speedFactor, MIN_SPEED_FACTOR), MAX_SPEED_FACTOR), 4)
+
+
+class CalibrationStore:
+    def __init__(self, databasePath):
+        folder = os.path.dirname(databasePath)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        # Same as the translation memory, the connection is shared by threads with a lock, and waits for other processes when they are writing
+        self.connection = sqlite3.connect(databasePath, timeout=30, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            # One row per distinct clip, so measuring the same clip again in a later run (such as from the clip cache) doesn't count it twice
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS samples ('
+                ' clip_key TEXT PRIMARY KEY,'
+                ' voice_key TEXT NOT NULL,'
+                ' characters INTEGER NOT NULL,'
+                ' natural_ms REAL NOT NULL)'
+            )
+            self.connection.execute('CREATE INDEX IF NOT EXISTS samples_voice_key ON samples (voice_key)')
+            # How far off the predictions were, for reporting
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS prediction_errors ('
+                ' voice_key TEXT PRIMARY KEY,'
+                ' predictions INTEGER NOT NULL,'
+                ' sum_abs_error REAL NOT NULL)'
+            )
+
+    # Returns the fitted VoiceRate, or None if the voice doesn't have at least minSamples measured clips yet
+    def get_voice_rate(self, voiceKey, minSamples):
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT COUNT(*), SUM(characters), SUM(natural_ms), SUM(characters * characters), SUM(characters * natural_ms)'
+                ' FROM samples WHERE voice_key = ?', (voiceKey,)
+            ).fetchone()
+        if row[0] < max(minSamples, 1):
+            return None
+        return VoiceRate(*row)
+
+    # measurements: Iterable of (clip key, characters, natural length in ms)
+    def add_samples(self, voiceKey, measurements):
+        with self.lock, self.connection:
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO samples (clip_key, voice_key, characters, natural_ms) VALUES (?, ?, ?, ?)',
+                ((clipKey, voiceKey, characters, naturalMs) for clipKey, characters, naturalMs in measurements)
+            )
+
+    def add_prediction_errors(self, voiceKey, errors):
+        if not errors:
+            return
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT INTO prediction_errors (voice_key, predictions, sum_abs_error) VALUES (?, ?, ?)'
+                ' ON CONFLICT (voice_key) DO UPDATE SET predictions = predictions + excluded.predictions, sum_abs_error = sum_abs_error + excluded.sum_abs_error',
+                (voiceKey, len(errors), sum(abs(error) for error in errors))
+            )
+
+    # Returns (number of predictions, average absolute error) over every run, or None if there were none
+    def get_prediction_error(self, voiceKey):
+        with self.lock:
+            row = self.connection.execute('SELECT predictions, sum_abs_error FROM prediction_errors WHERE voice_key = ?', (voiceKey,)).fetchone()
+        if row is None or row[0] == 0:
+            return None
+        return row[0], row[1] / row[0]
+
+
+# One open store per database file for the whole program
+_openStores = {}
+_openStoresLock = threading.Lock()
+
+def get_store(cacheFolder):
+    databasePath = os.path.abspath(os.path.join(cacheFolder, DATABASE_FILE_NAME))
+    with _openStoresLock:
+        if databasePath not in _openStores:
+            _openStores[databasePath] = CalibrationStore(databasePath)
+        return _openStores[databasePath]
+
+
+def get_voice_key(langDict, config):
+    return f"{config.ttsService}|{langDict['languageCode']}|{langDict['voiceName']}"
+
+def get_clip_key(voiceKey, text, speedFactor):
+    return hashlib.sha256(f"{voiceKey}|{round(speedFactor, 4)}|{text}".encode('utf-8')).hexdigest()
+
+def is_enabled(config):
+    return config.speakingRateCalibration and not config.skipSynthesize
+
+
+# Sets 'predicted_speed_factor' on every line, if this voice has been calibrated. The first pass is then synthesized at that speed instead of normal speed
+# Returns True if predictions were made
+def predict_speed_factors(subsDict, langDict, config):
+    if not is_enabled(config):
+        return False
+    voiceRate = get_store(config.cacheFolder).get_voice_rate(get_voice_key(langDict, config), config.speakingRateMinSamples)
+    if voiceRate is None:
+        return False
+    for key, value in subsDict.items():
+        subsDict[key]['predicted_speed_factor'] = voiceRate.predict_speed_factor(len(value['translated_text']), value['duration_ms'])
+    print(f"Speaking rate of {langDict['voiceName']}: {voiceRate.slope:.1f}ms per character (from {voiceRate.samples} clips). First pass will use predicted speeds")
+    return True
+
+# The speed a line's current clip was synthesized at
+def get_synthesized_speed_factor(value):
+    return value.get('synth_speed_factor', 1.0)
+
+# Whether a line needs a second pass after its first clip was measured. Its 'speed_factor' must already be set by audio_builder.get_speed_factor()
+def needs_second_pass(value, config):
+    if 'predicted_speed_factor' not in value:
+        return True
+    return abs(value['speed_factor'] - 1.0) * 100 > config.speakingRateTolerancePercent
+
+# Changes 'speed_factor' from how much the measured clip is off by, to the speed to synthesize it at next time
+def set_second_pass_speed_factor(value):
+    value['speed_factor'] = value['speed_factor'] * get_synthesized_speed_factor(value)
+
+
+# Saves the measured length of each line's first pass clip, and reports how close the predictions were
+# values: The lines, after audio_builder.get_speed_factor() has set their 'speed_factor', which is measured length / desired length
+def record_measurements(values, langDict, config):
+    if not is_enabled(config):
+        return
+    store = get_store(config.cacheFolder)
+    voiceKey = get_voice_key(langDict, config)
+    measurements = []
+    errors = []
+    for value in values:
+        synthesizedSpeedFactor = get_synthesized_speed_factor(value)
+        measuredMs = value['speed_factor'] * float(value['duration_ms'])
+        # A clip synthesized at twice the speed would be twice as long at normal speed
+        naturalMs = measuredMs * synthesizedSpeedFactor
+        measurements.append((get_clip_key(voiceKey, value['translated_text'], synthesizedSpeedFactor), len(value['translated_text']), naturalMs))
+        if 'predicted_speed_factor' in value:
+            errors.append(value['speed_factor'] - 1.0)
+    store.add_samples(voiceKey, measurements)
+
+    if errors:
+        store.add_prediction_errors(voiceKey, errors)
+        withinTolerance = sum(1 for error in errors if abs(error) * 100 <= config.speakingRateTolerancePercent)
+        averageError = sum(abs(error) for error in errors) / len(errors) * 100
+        totalPredictions, totalAverageError = store.get_prediction_error(voiceKey)
+        print(f"Speaking rate prediction for {langDict['voiceName']}: average error {averageError:.1f}%, "
+              f"{withinTolerance} of {len(errors)} lines within {config.speakingRateTolerancePercent:g}% "
+              f"(all runs: average error {totalAverageError * 100:.1f}% over {totalPredictions} lines)")
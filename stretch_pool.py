@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+# Time-stretches clips in a pool of worker processes, one clip per core at a time
+# Rubberband runs as a separate program for every clip, and used to be run for one clip at a time while building the audio, so stretching a
+# long video only ever used one core. Here the clips are handed to worker processes that stay running for the whole program, and the
+# stretched clips come back in the same order they were sent, so they can be placed on the canvas as before.
+# Only a few clips per worker are sent ahead at a time, so a long video doesn't have every clip waiting in memory at once.
+# If stretching a clip fails, only that clip is affected: the error is returned with it instead of stopping the whole track
+
+import collections
+import concurrent.futures
+import multiprocessing
+import os
+import threading
+
+import pyrubberband
+
+# How many clips per worker can be sent ahead of the one the canvas is waiting for
+CLIPS_AHEAD_PER_WORKER = 2
+
+
+# Runs in the worker processes. samples: Array of float samples as read by soundfile
+def stretch_samples(samples, sampleRate, speedFactor):
+    return pyrubberband.time_stretch(samples, sampleRate, speedFactor, rbargs={'--fine': '--fine'}) # Need to add rbarges in weird way because it demands a dictionary of two values
+
+class StretchResult:
+    def __init__(self, key, samples, sampleRate, error=None):
+        self.key = key
+        self.samples = samples # The stretched samples, or the original ones if there was an error
+        self.sampleRate = sampleRate
+        self.error = error
+
+
+class StretchPool:
+    def __init__(self, workers):
+        self.workers = max(1, workers)
+        self.executor = None
+        self.lock = threading.Lock()
+
+    # The workers are started the first time a clip is sent. They are started fresh instead of forked, since the program has other threads running
+    def get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+            return self.executor
+
+    # Replaces the workers after one of them died, such as from running out of memory, so the clips after it can still be stretched
+    def replace_executor(self, brokenExecutor):
+        with self.lock:
+            if self.executor is brokenExecutor:
+                self.executor = None
+        brokenExecutor.shutdown(wait=False, cancel_futures=True)
+
+    # Returns the executor the clip was sent to, along with its future
+    def submit(self, samples, sampleRate, speedFactor):
+        executor = self.get_executor()
+        try:
+            return executor, executor.submit(stretch_samples, samples, sampleRate, speedFactor)
+        except concurrent.futures.BrokenExecutor:
+            # A worker died before its result was collected
+            self.replace_executor(executor)
+            executor = self.get_executor()
+            return executor, executor.submit(stretch_samples, samples, sampleRate, speedFactor)
+
+    def get_result(self, key, samples, sampleRate, speedFactor, executor, future):
+        try:
+            return StretchResult(key, future.result(), sampleRate)
+        except concurrent.futures.BrokenExecutor:
+            # A dead worker takes every clip it was sent with it, so try this one once more with new workers
+            self.replace_executor(executor)
+            try:
+                return StretchResult(key, self.submit(samples, sampleRate, speedFactor)[1].result(), sampleRate)
+            except Exception as ex:
+                return StretchResult(key, samples, sampleRate, f"{type(ex).__name__}: {ex}")
+        except Exception as ex:
+            return StretchResult(key, samples, sampleRate, f"{type(ex).__name__}: {ex}")
+
+    # clips: Iterable of (key, samples, sample rate, speed factor). It is only read from as results are needed, so it can be a generator
+    # Yields a StretchResult for every clip, in the same order. Clips with a speed factor of None are passed through without stretching
+    def stretch_in_order(self, clips):
+        if self.workers == 1:
+            for key, samples, sampleRate, speedFactor in clips:
+                if speedFactor is None:
+                    yield StretchResult(key, samples, sampleRate)
+                    continue
+                try:
+                    yield StretchResult(key, stretch_samples(samples, sampleRate, speedFactor), sampleRate)
+                except Exception as ex:
+                    yield StretchResult(key, samples, sampleRate, f"{type(ex).__name__}: {ex}")
+            return
+
+        maxPending = self.workers * CLIPS_AHEAD_PER_WORKER
+        pending = collections.deque()
+        for key, samples, sampleRate, speedFactor in clips:
+            if speedFactor is None:
+                pending.append((key, samples, sampleRate, speedFactor, None, None))
+            else:
+                pending.append((key, samples, sampleRate, speedFactor, *self.submit(samples, sampleRate, speedFactor)))
+            while len(pending) >= maxPending or (pending and pending[0][5] is None):
+                yield self.collect(pending.popleft())
+        while pending:
+            yield self.collect(pending.popleft())
+
+    def collect(self, pendingClip):
+        key, samples, sampleRate, speedFactor, executor, future = pendingClip
+        if future is None:
+            return StretchResult(key, samples, sampleRate)
+        return self.get_result(key, samples, sampleRate, speedFactor, executor, future)
+
+
+def get_worker_count(config):
+    if config.maxStretchWorkers > 0:
+        return config.maxStretchWorkers
+    return os.cpu_count() or 1
+
+# One pool for the whole program, so the workers are only started once even when several languages are built
+_pools = {}
+_poolsLock = threading.Lock()
+
+def get_pool(config):
+    workers = get_worker_count(config)
+    with _poolsLock:
+        if workers not in _pools:
+            _pools[workers] = StretchPool(workers)
+        return _pools[workers]
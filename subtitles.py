@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+# Streaming subtitle parser and compact cue table
+# Subtitle files (SRT or WebVTT) are read one cue at a time, and the timings are stored as integers in parallel arrays
+# The subsDict structure used by the rest of the program is a thin view over that table, so nothing is converted back and forth from strings
+
+import re
+import copy
+from array import array
+from collections.abc import MutableMapping
+
+# Matches both SRT and VTT timestamp lines, for example:    00:00:20,130 --> 00:00:23,419    or    00:20.130 --> 00:23.419 align:start
+# The hours part is optional because VTT allows leaving it out
+subtitleTimeLineRegex = re.compile(r'\s*(?:(\d+):)?(\d\d):(\d\d)[,.](\d\d\d)\s*-->\s*(?:(\d+):)?(\d\d):(\d\d)[,.](\d\d\d)')
+
+# Blocks in VTT files that are not cues and should be skipped entirely
+vttNonCueBlocks = ('WEBVTT', 'NOTE', 'STYLE', 'REGION')
+
+
+def timestamp_to_ms(hours, minutes, seconds, milliseconds):
+    return int(hours or 0) * 3600000 + int(minutes) * 60000 + int(seconds) * 1000 + int(milliseconds)
+
+def ms_to_timestamp(totalMs):
+    # Formats milliseconds as an SRT timestamp:  HH:MM:SS,MMM
+    hours, remainder = divmod(int(totalMs), 3600000)
+    minutes, remainder = divmod(remainder, 60000)
+    seconds, milliseconds = divmod(remainder, 1000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d},{milliseconds:03d}"
+
+def make_timestamps_line(startMs, endMs):
+    return ms_to_timestamp(startMs) + ' --> ' + ms_to_timestamp(endMs)
+
+
+class Cue:
+    # A single parsed subtitle entry, with times already converted to integer milliseconds
+    __slots__ = ('key', 'start_ms', 'end_ms', 'text')
+
+    def __init__(self, key, start_ms, end_ms, text):
+        self.key = key
+        self.start_ms = start_ms
+        self.end_ms = end_ms
+        self.text = text
+
+    def __repr__(self):
+        return f"Cue({self.key!r}, {self.start_ms}, {self.end_ms}, {self.text!r})"
+
+
+def iter_cues(lineIterable):
+    # Generator that yields one Cue at a time from any iterable of lines (such as an open file), without reading the whole file first
+    # For SRT files the number above the timestamps is used as the key. VTT cue identifiers are optional, so cues without a numeric one are numbered in order
+    previousLine = ''
+    cueCount = 0
+    currentCue = None
+    skippingBlock = False
+
+    for rawLine in lineIterable:
+        line = rawLine.strip()
+
+        # A blank line ends whatever block we were in
+        if not line:
+            if currentCue is not None:
+                yield currentCue
+                currentCue = None
+            skippingBlock = False
+            previousLine = ''
+            continue
+
+        # Add any extra lines of subtitle text onto the current cue
+        if currentCue is not None:
+            if currentCue.text:
+                currentCue.text += ' ' + line
+            else:
+                currentCue.text = line
+            continue
+
+        if skippingBlock:
+            continue
+
+        match = subtitleTimeLineRegex.match(line)
+        if match:
+            cueCount += 1
+            startMs = timestamp_to_ms(*match.group(1, 2, 3, 4))
+            endMs = timestamp_to_ms(*match.group(5, 6, 7, 8))
+            key = previousLine if previousLine.isdigit() else str(cueCount)
+            currentCue = Cue(key, startMs, endMs, '')
+        elif not previousLine and line.startswith(vttNonCueBlocks):
+            skippingBlock = True
+        else:
+            previousLine = line
+
+    # File may not end with a blank line
+    if currentCue is not None:
+        yield currentCue
+
+
+def iter_cues_from_file(filePath):
+    # utf-8-sig so a BOM at the start of the file (common in VTT files) doesn't end up in the first line
+    with open(filePath, 'r', encoding='utf-8-sig') as f:
+        yield from iter_cues(f)
+
+
+class CueTable:
+    # Stores all the cues of a subtitle file in parallel integer arrays, one row per cue
+    # 'q' = signed 64 bit integers, so even extremely long videos won't overflow
+    def __init__(self, bufferMs=0):
+        self.bufferMs = bufferMs
+        self.keys = []
+        self.texts = []
+        self.start = array('q')
+        self.end = array('q')
+        self.startBuffered = array('q')
+        self.endBuffered = array('q')
+        self.gapToNext = array('q')
+        self.rowByKey = {}
+        # Whether the buffered times should be used as the main start and end times. See apply_buffer()
+        self.bufferApplied = False
+
+    def __len__(self):
+        return len(self.keys)
+
+    def append(self, cue):
+        row = len(self.keys)
+        # Goes back to previous row and writes difference in time to current cue
+        if row > 0:
+            self.gapToNext[row - 1] = cue.start_ms - self.end[row - 1]
+
+        self.keys.append(cue.key)
+        self.texts.append(cue.text)
+        self.start.append(cue.start_ms)
+        self.end.append(cue.end_ms)
+        # Adjust times with buffer
+        if self.bufferMs > 0:
+            self.startBuffered.append(cue.start_ms + self.bufferMs)
+            self.endBuffered.append(cue.end_ms - self.bufferMs)
+        else:
+            self.startBuffered.append(cue.start_ms)
+            self.endBuffered.append(cue.end_ms)
+        self.gapToNext.append(0)
+        self.rowByKey[cue.key] = row
+
+    def apply_buffer(self):
+        # Makes the buffered times the main start and end times, like copying 'start_ms_buffered' over 'start_ms' for every entry
+        self.bufferApplied = True
+
+    def start_ms(self, row):
+        return self.startBuffered[row] if self.bufferApplied else self.start[row]
+
+    def end_ms(self, row):
+        return self.endBuffered[row] if self.bufferApplied else self.end[row]
+
+    def view(self, key):
+        return CueView(self, self.rowByKey[key])
+
+    def as_subs_dict(self):
+        # Returns the dictionary structure the rest of the program uses, with keys being the subtitle numbers as strings
+        return {key: CueView(self, row) for row, key in enumerate(self.keys)}
+
+    def new_overlay(self):
+        # Creates a fresh subsDict for one language. The table itself is shared by all languages and never changed,
+        # and each entry only stores what differs for that language (translated_text, TTS_FilePath, speed_factor, combined timings)
+        return self.as_subs_dict()
+
+    @classmethod
+    def from_cues(cls, cues, bufferMs=0):
+        table = cls(bufferMs)
+        for cue in cues:
+            table.append(cue)
+        return table
+
+    @classmethod
+    def from_file(cls, filePath, bufferMs=0):
+        return cls.from_cues(iter_cues_from_file(filePath), bufferMs)
+
+
+# Functions used by CueView to read each of the standard subtitle fields straight out of the table
+_tableFields = {
+    'start_ms': lambda t, r: t.start_ms(r),
+    'end_ms': lambda t, r: t.end_ms(r),
+    'duration_ms': lambda t, r: t.end_ms(r) - t.start_ms(r),
+    'start_ms_buffered': lambda t, r: t.startBuffered[r],
+    'end_ms_buffered': lambda t, r: t.endBuffered[r],
+    'duration_ms_buffered': lambda t, r: t.endBuffered[r] - t.startBuffered[r],
+    'text': lambda t, r: t.texts[r],
+    'break_until_next': lambda t, r: t.gapToNext[r],
+    'srt_timestamps_line': lambda t, r: make_timestamps_line(t.start[r], t.end[r]),
+}
+
+
+class CueView(MutableMapping):
+    # Dictionary-like view of one row of a CueTable, acting as a copy-on-write overlay
+    # Reading a standard field comes straight from the table. Anything written to the view (translated text, file paths, combined timings)
+    # is kept in the view itself, so the shared table is never changed
+    __slots__ = ('_table', '_row', '_overrides')
+
+    def __init__(self, table, row, overrides=None):
+        self._table = table
+        self._row = row
+        # Only created once something is actually written, so untouched entries cost almost nothing
+        self._overrides = overrides
+
+    def __getitem__(self, key):
+        if self._overrides and key in self._overrides:
+            return self._overrides[key]
+        try:
+            getter = _tableFields[key]
+        except KeyError:
+            raise KeyError(key) from None
+        return getter(self._table, self._row)
+
+    def __setitem__(self, key, value):
+        if self._overrides is None:
+            self._overrides = {}
+        self._overrides[key] = value
+
+    def __delitem__(self, key):
+        if not self._overrides:
+            raise KeyError(key)
+        del self._overrides[key]
+
+    def __iter__(self):
+        yield from _tableFields
+        if self._overrides:
+            for key in self._overrides:
+                if key not in _tableFields:
+                    yield key
+
+    def __len__(self):
+        if not self._overrides:
+            return len(_tableFields)
+        return len(_tableFields) + sum(1 for key in self._overrides if key not in _tableFields)
+
+    def __copy__(self):
+        return CueView(self._table, self._row, dict(self._overrides) if self._overrides else None)
+
+    def __deepcopy__(self, memo):
+        # The table is shared and never modified through a view, so only the per-view values need copying
+        return CueView(self._table, self._row, copy.deepcopy(self._overrides, memo))
+
+    def __repr__(self):
+        return f"CueView({dict(self)!r})"
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+# Packs subtitle texts into as few translation requests as possible, without going over the API's limits
+# Each request remembers the position of every text it contains, so the translations can be put back in the right place
+# no matter what order the requests finish in
+
+# Google's API limit is 30000 utf-8 codepoints per request, but we leave some room just in case. Bytes are counted, which is never less than codepoints
+MAX_REQUEST_BYTES = 27000
+# Maximum number of separate texts ('contents') in a single request
+MAX_REQUEST_SEGMENTS = 1024
+
+
+class TranslationRequest:
+    __slots__ = ('indexes', 'texts', 'byteCount')
+
+    def __init__(self):
+        self.indexes = []
+        self.texts = []
+        self.byteCount = 0
+
+    def add(self, index, text, textBytes):
+        self.indexes.append(index)
+        self.texts.append(text)
+        self.byteCount += textBytes
+
+    def __len__(self):
+        return len(self.texts)
+
+
+# Fills each request up to the byte and segment limits, keeping the texts in their original order
+# A single text that is over the byte limit by itself is put in a request on its own, and the API will reject just that request
+def pack_requests(texts, maxBytes=MAX_REQUEST_BYTES, maxSegments=MAX_REQUEST_SEGMENTS):
+    requests = []
+    current = TranslationRequest()
+    for index, text in enumerate(texts):
+        textBytes = len(text.encode('utf-8'))
+        if len(current) > 0 and (current.byteCount + textBytes > maxBytes or len(current) >= maxSegments):
+            requests.append(current)
+            current = TranslationRequest()
+        if textBytes > maxBytes:
+            print(f"\n[!] Warning: Text at position {index + 1} is {textBytes} bytes, which is over the translation request limit of {maxBytes} bytes")
+        current.add(index, text, textBytes)
+
+    if len(current) > 0:
+        requests.append(current)
+    return requests
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+
+# Translation memory: Saves every translation to an SQLite database, so the same text is never sent to the translation API twice
+# Lines are looked up by their exact source text, source language, target language, mimeType and the translation service that translated them.
+# This works across runs, languages and videos, so fixing a typo in one line of an SRT file only re-translates that line, and repeated intros/outros
+# are only translated once. The service is part of the key so the placeholder translations of the fake and http test services are never used for real runs
+
+import os
+import sqlite3
+import threading
+
+DATABASE_FILE_NAME = 'translation_memory.sqlite3'
+
+# SQLite has a limit on the number of parameters in a query, so lookups are done in groups
+LOOKUP_GROUP_SIZE = 500
+
+
+class TranslationMemory:
+    def __init__(self, databasePath):
+        folder = os.path.dirname(databasePath)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        # The connection is shared by threads (such as when languages are pipelined), with a lock around every use
+        # The timeout lets parallel language processes wait for each other instead of failing when writing at the same time
+        self.connection = sqlite3.connect(databasePath, timeout=30, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS translations ('
+                ' source_text TEXT NOT NULL,'
+                ' source_language TEXT NOT NULL,'
+                ' target_language TEXT NOT NULL,'
+                ' mime_type TEXT NOT NULL,'
+                ' translate_service TEXT NOT NULL,'
+                ' translated_text TEXT NOT NULL,'
+                ' PRIMARY KEY (source_text, source_language, target_language, mime_type, translate_service))'
+            )
+
+    # Returns a dictionary of source text -> translated text, for the texts that are in memory
+    # service: The translate_service setting, such as 'google'
+    def lookup(self, texts, sourceLanguage, targetLanguage, mimeType, service):
+        uniqueTexts = list(dict.fromkeys(texts))
+        found = {}
+        with self.lock:
+            for i in range(0, len(uniqueTexts), LOOKUP_GROUP_SIZE):
+                group = uniqueTexts[i:i + LOOKUP_GROUP_SIZE]
+                placeholders = ','.join('?' * len(group))
+                rows = self.connection.execute(
+                    f'SELECT source_text, translated_text FROM translations'
+                    f' WHERE source_language = ? AND target_language = ? AND mime_type = ? AND translate_service = ? AND source_text IN ({placeholders})',
+                    [sourceLanguage, targetLanguage, mimeType, service] + group
+                )
+                found.update(rows)
+        return found
+
+    # translations: Iterable of (source text, translated text) pairs. Texts the service didn't return a translation for are not saved
+    def store(self, translations, sourceLanguage, targetLanguage, mimeType, service):
+        rows = [(sourceText, sourceLanguage, targetLanguage, mimeType, service, translatedText) for sourceText, translatedText in translations]
+        with self.lock, self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO translations (source_text, source_language, target_language, mime_type, translate_service, translated_text) VALUES (?, ?, ?, ?, ?, ?)',
+                rows
+            )
+
+
+# One open memory per database file for the whole program
+_openMemories = {}
+_openMemoriesLock = threading.Lock()
+
+def get_memory(cacheFolder):
+    databasePath = os.path.abspath(os.path.join(cacheFolder, DATABASE_FILE_NAME))
+    with _openMemoriesLock:
+        if databasePath not in _openMemories:
+            _openMemories[databasePath] = TranslationMemory(databasePath)
+        return _openMemories[databasePath]